@@ -8,6 +8,10 @@ load_dotenv()
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/qvanish.db")
 
+# 本地列式行情存储目录
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKET_DATA_DIR = os.getenv("MARKET_DATA_DIR", os.path.join(BASE_DIR, "data", "market"))
+
 # 安全配置
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
@@ -18,4 +22,89 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
 # 应用配置
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "t")
-ENVIRONMENT = os.getenv("ENVIRONMENT", "production") 
\ No newline at end of file
+ENVIRONMENT = os.getenv("ENVIRONMENT", "production") 
+
+# 策略沙箱配置
+SANDBOX_ENABLED = os.getenv("SANDBOX_ENABLED", "True").lower() in ("true", "1", "t")
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_MAX_JOBS_PER_WORKER = int(os.getenv("SANDBOX_MAX_JOBS_PER_WORKER", "50"))
+SANDBOX_MAX_MEMORY_GROWTH_MB = float(os.getenv("SANDBOX_MAX_MEMORY_GROWTH_MB", "512"))
+# 单个工作进程在预加载之后地址空间可以增长的上限（MB），超出时策略的内存分配失败
+SANDBOX_MAX_MEMORY_MB = float(os.getenv("SANDBOX_MAX_MEMORY_MB", "2048"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "300"))
+
+# 行情报价配置
+QUOTE_BATCH_SIZE = int(os.getenv("QUOTE_BATCH_SIZE", "100"))
+QUOTE_MAX_WORKERS = int(os.getenv("QUOTE_MAX_WORKERS", "8"))
+QUOTE_TIMEOUT = float(os.getenv("QUOTE_TIMEOUT", "10"))
+
+# 内存中的最新报价在 /prices 和交易执行中可直接使用的时间（秒），更旧的重新从数据源获取
+LATEST_QUOTE_MAX_AGE = float(os.getenv("LATEST_QUOTE_MAX_AGE", "60"))
+
+# 模拟交易撮合：每次行情更新时每侧最多按最新价成交的股数（模拟市场流动性），0 表示不限
+ORDER_BOOK_TICK_LIQUIDITY = float(os.getenv("ORDER_BOOK_TICK_LIQUIDITY", "10000"))
+
+# 行情缓存配置（秒）
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", "5"))
+QUOTE_CACHE_STALE_TTL = float(os.getenv("QUOTE_CACHE_STALE_TTL", "30"))
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", "5000"))
+
+# 行情数据源配置：yfinance / fixture / synthetic
+MARKET_DATA_PROVIDER = os.getenv("MARKET_DATA_PROVIDER", "yfinance").lower()
+MARKET_DATA_FIXTURE_DIR = os.getenv("MARKET_DATA_FIXTURE_DIR", os.path.join(BASE_DIR, "data", "fixtures"))
+SYNTHETIC_SEED = int(os.getenv("SYNTHETIC_SEED", "42"))
+PROVIDER_MAX_WORKERS = int(os.getenv("PROVIDER_MAX_WORKERS", "8"))
+
+# 实时行情推送配置
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "2"))
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "100"))
+STREAM_MAX_SYMBOLS = int(os.getenv("STREAM_MAX_SYMBOLS", "50"))
+
+# K线聚合缓存（按股票和周期计）
+OHLCV_CACHE_SIZE = int(os.getenv("OHLCV_CACHE_SIZE", "2000"))
+INTRADAY_CACHE_TTL = float(os.getenv("INTRADAY_CACHE_TTL", "60"))
+INTRADAY_CACHE_SIZE = int(os.getenv("INTRADAY_CACHE_SIZE", "500"))
+
+# 技术指标缓存（按股票和指标计）
+INDICATOR_CACHE_SIZE = int(os.getenv("INDICATOR_CACHE_SIZE", "5000"))
+
+# 相关系数矩阵缓存（按股票列表和窗口计）
+CORRELATION_CACHE_SIZE = int(os.getenv("CORRELATION_CACHE_SIZE", "256"))
+CORRELATION_MAX_SYMBOLS = int(os.getenv("CORRELATION_MAX_SYMBOLS", "100"))
+
+# 选股矩阵检查新K线的间隔（秒）
+SCREENER_REFRESH_INTERVAL = float(os.getenv("SCREENER_REFRESH_INTERVAL", "30"))
+
+# 公司行为（拆股、分红）同步间隔（秒）
+CORPORATE_ACTIONS_TTL = float(os.getenv("CORPORATE_ACTIONS_TTL", "86400"))
+
+# 证券主数据（名称、行业、基本面）的刷新间隔（秒）
+SECURITY_REFRESH_TTL = float(os.getenv("SECURITY_REFRESH_TTL", "604800"))
+# 等待调度器刷新的未同步股票数上限
+SECURITY_MISSING_MAX = int(os.getenv("SECURITY_MISSING_MAX", "1000"))
+# 调度器没有运行时，/info 请求中刷新证券信息最多等待限流令牌的时间（秒）
+SECURITY_INLINE_REFRESH_TIMEOUT = float(os.getenv("SECURITY_INLINE_REFRESH_TIMEOUT", "2"))
+
+# 数据质量校验：收盘价相对前几根K线中位数的最大倍数，超过视为异常跳变
+DATA_QUALITY_SPIKE_RATIO = float(os.getenv("DATA_QUALITY_SPIKE_RATIO", "50"))
+# 被隔离的K线所在日期在此时间（秒）内不重新获取
+DATA_QUALITY_RETRY_INTERVAL = float(os.getenv("DATA_QUALITY_RETRY_INTERVAL", "86400"))
+
+# 数据库中保留的年度行情分区数（含当年），更早的年份压缩到列式存储后删除分区表
+MARKET_DATA_HOT_YEARS = int(os.getenv("MARKET_DATA_HOT_YEARS", "2"))
+
+# 上游数据源限流：每秒请求数和允许的突发请求数
+UPSTREAM_RATE_LIMIT = float(os.getenv("UPSTREAM_RATE_LIMIT", "2"))
+UPSTREAM_BURST = float(os.getenv("UPSTREAM_BURST", "5"))
+
+# 行情自动更新配置
+INGESTION_ENABLED = os.getenv("INGESTION_ENABLED", "True").lower() in ("true", "1", "t")
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "4"))
+INGESTION_DEFAULT_UNIVERSE = os.getenv("INGESTION_DEFAULT_UNIVERSE", "AAPL,MSFT,GOOGL,AMZN,TSLA")
+INGESTION_HISTORY_DAYS = int(os.getenv("INGESTION_HISTORY_DAYS", "1825"))
+INGESTION_EOD_HOUR = int(os.getenv("INGESTION_EOD_HOUR", "22"))  # 本地时间，收盘后执行日终更新
+INGESTION_INTRADAY_INTERVAL = float(os.getenv("INGESTION_INTRADAY_INTERVAL", "300"))
+INGESTION_INTRADAY_DAYS = int(os.getenv("INGESTION_INTRADAY_DAYS", "5"))
+INGESTION_MAX_RETRIES = int(os.getenv("INGESTION_MAX_RETRIES", "4"))
+INGESTION_BACKOFF_BASE = float(os.getenv("INGESTION_BACKOFF_BASE", "1"))
+INGESTION_BACKOFF_MAX = float(os.getenv("INGESTION_BACKOFF_MAX", "60"))
@@ -1,5 +1,8 @@
+import logging
+
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc, func, and_
+from sqlalchemy import desc, asc, func, and_, inspect, select, text
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional, Dict, Any, Union, TypeVar, Generic, Type
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
@@ -7,6 +10,8 @@ from jose import JWTError, jwt
 
 from . import models, schemas
 
+logger = logging.getLogger(__name__)
+
 # 密码哈希
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -265,6 +270,131 @@ def delete_trade(db: Session, trade_id: int, user_id: int):
     
     return False
 
+# 委托单相关CRUD操作
+OPEN_ORDER_STATUSES = ("open", "partially_filled")
+
+def create_order(db: Session, order: schemas.OrderCreate, user_id: int):
+    db_order = models.Order(
+        **order.model_dump(),
+        user_id=user_id,
+        filled_quantity=0.0,
+        status="open"
+    )
+    db.add(db_order)
+    db.commit()
+    db.refresh(db_order)
+    return db_order
+
+def get_order(db: Session, order_id: int):
+    return db.query(models.Order).filter(models.Order.id == order_id).first()
+
+def get_user_orders(db: Session, user_id: int, skip: int = 0, limit: int = 100):
+    return db.query(models.Order).filter(
+        models.Order.user_id == user_id
+    ).order_by(desc(models.Order.created_at)).offset(skip).limit(limit).all()
+
+def get_open_orders(db: Session):
+    """所有未完成的委托单，按下单顺序排列，用于启动时恢复订单簿"""
+    return db.query(models.Order).filter(
+        models.Order.status.in_(OPEN_ORDER_STATUSES)
+    ).order_by(asc(models.Order.id)).all()
+
+def record_order_fills(db: Session, fills: List[Dict[str, Any]], states: List[Dict[str, Any]]):
+    """在一个事务中写入一批成交记录、更新相应的投资组合和委托单状态"""
+    portfolios: Dict[int, Any] = {}
+    assets: Dict[tuple, Any] = {}
+    for fill in fills:
+        db_trade = models.Trade(
+            symbol=fill["symbol"],
+            order_type=fill["side"],
+            price=fill["price"],
+            quantity=fill["quantity"],
+            status="executed",
+            executed_at=fill["time"],
+            user_id=fill["user_id"],
+            portfolio_id=fill["portfolio_id"],
+            order_id=fill["order_id"]
+        )
+        db.add(db_trade)
+        if fill["portfolio_id"]:
+            _apply_fill_to_portfolio(db, fill, db_trade, portfolios, assets)
+    
+    for state in states:
+        db.query(models.Order).filter(models.Order.id == state["id"]).update(
+            {key: value for key, value in state.items() if key != "id"},
+            synchronize_session=False
+        )
+    db.commit()
+
+def _apply_fill_to_portfolio(db: Session, fill: Dict[str, Any], db_trade, portfolios: Dict[int, Any], assets: Dict[tuple, Any]):
+    """按成交更新现金和持仓；撮合引擎已冻结所需的现金和持仓，这里的检查只是防止数据被改成负数"""
+    portfolio_id = fill["portfolio_id"]
+    if portfolio_id not in portfolios:
+        portfolios[portfolio_id] = get_portfolio(db, portfolio_id)
+    portfolio = portfolios[portfolio_id]
+    if portfolio is None:
+        return
+    
+    key = (portfolio_id, fill["symbol"])
+    if key not in assets:
+        assets[key] = get_asset_by_symbol(db, portfolio_id=portfolio_id, symbol=fill["symbol"])
+    asset = assets[key]
+    price, quantity = fill["price"], fill["quantity"]
+    
+    if fill["side"] == "buy":
+        cost = quantity * price
+        if portfolio.cash_balance < cost:
+            logger.error("成交 %s 超出投资组合 %d 的现金余额", fill["order_id"], portfolio_id)
+            return
+        portfolio.cash_balance -= cost
+        if asset is None:
+            asset = models.PortfolioAsset(
+                symbol=fill["symbol"],
+                quantity=quantity,
+                average_price=price,
+                portfolio_id=portfolio_id
+            )
+            db.add(asset)
+            assets[key] = asset
+        else:
+            new_quantity = asset.quantity + quantity
+            asset.average_price = (asset.average_price * asset.quantity + price * quantity) / new_quantity
+            asset.quantity = new_quantity
+    else:
+        if asset is None or asset.quantity < quantity:
+            logger.error("成交 %s 超出投资组合 %d 的持仓", fill["order_id"], portfolio_id)
+            return
+        portfolio.cash_balance += quantity * price
+        db_trade.profit_loss = (price - asset.average_price) * quantity
+        asset.quantity -= quantity
+        if asset.quantity <= 0:
+            # 完全卖出，删除资产记录
+            db.delete(asset)
+            assets[key] = None
+            return
+    
+    asset.current_price = price
+    asset.market_value = asset.quantity * price
+    asset.profit_loss = (price - asset.average_price) * asset.quantity
+    asset.profit_loss_percentage = (price - asset.average_price) / asset.average_price * 100 if asset.average_price > 0 else 0
+
+def ensure_trade_order_column(db: Session):
+    """为旧版本创建的trades表补建order_id列"""
+    columns = {column["name"] for column in inspect(db.get_bind()).get_columns("trades")}
+    if "order_id" in columns:
+        return
+    db.execute(text("ALTER TABLE trades ADD COLUMN order_id INTEGER REFERENCES orders(id)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_trades_order_id ON trades (order_id)"))
+    db.commit()
+
+def ensure_order_triggered_column(db: Session):
+    """为旧版本创建的orders表补建triggered列"""
+    columns = {column["name"] for column in inspect(db.get_bind()).get_columns("orders")}
+    if "triggered" in columns:
+        return
+    db.execute(text("ALTER TABLE orders ADD COLUMN triggered BOOLEAN DEFAULT FALSE"))
+    db.commit()
+
 # 资产组合相关CRUD操作
 def get_portfolio(db: Session, portfolio_id: int):
     return db.query(models.Portfolio).filter(models.Portfolio.id == portfolio_id).first()
@@ -391,45 +521,383 @@ def get_ai_chats_by_user(db: Session, user_id: int, skip: int = 0, limit: int =
     ).order_by(desc(models.AIAssistantChat.created_at)).offset(skip).limit(limit).all()
 
 # 市场数据相关CRUD操作
+# 批量写入时每批的行数，以及冲突时需要更新的字段
+MARKET_DATA_UPSERT_CHUNK_SIZE = 5000
+MARKET_DATA_UPSERT_COLUMNS = ["open", "high", "low", "close", "volume", "updated_at"]
+
+# 已确认存在的年度分区：(数据库, 年份) -> 是否已归档
+_market_data_partition_state: Dict[tuple, bool] = {}
+
+def get_market_data_partitions(db: Session):
+    return db.query(models.MarketDataPartition).order_by(asc(models.MarketDataPartition.year)).all()
+
+def ensure_market_data_partition(db: Session, year: int) -> bool:
+    """确保年度分区表存在；返回 False 表示该年已归档，数据只保存在列式存储中"""
+    key = (str(db.get_bind().url), year)
+    archived = _market_data_partition_state.get(key)
+    if archived is not None:
+        return not archived
+    
+    partition = db.query(models.MarketDataPartition).filter(models.MarketDataPartition.year == year).first()
+    if partition is None or not partition.archived:
+        # 在会话自己的连接上建表，避免 SQLite 上与会话的事务互相等待
+        models.market_data_partition(year).create(bind=db.connection(), checkfirst=True)
+    if partition is None:
+        partition = models.MarketDataPartition(year=year, archived=False)
+        db.add(partition)
+        try:
+            db.commit()
+        except IntegrityError:
+            # 其他线程同时创建了该分区
+            db.rollback()
+            partition = db.query(models.MarketDataPartition).filter(models.MarketDataPartition.year == year).first()
+    
+    _market_data_partition_state[key] = partition.archived
+    return not partition.archived
+
+def archive_market_data_partition(db: Session, year: int, row_count: int):
+    """标记分区已归档并删除分区表，调用方需先把数据压缩进列式存储"""
+    partition = db.query(models.MarketDataPartition).filter(models.MarketDataPartition.year == year).first()
+    partition.archived = True
+    partition.row_count = row_count
+    partition.archived_at = datetime.utcnow()
+    db.commit()
+    _market_data_partition_state[(str(db.get_bind().url), year)] = True
+    models.market_data_partition(year).drop(bind=db.connection(), checkfirst=True)
+    db.commit()
+
+def get_market_data_partition_symbols(db: Session, year: int) -> List[str]:
+    table = models.market_data_partition(year)
+    return [row[0] for row in db.execute(select(table.c.symbol).distinct()).all()]
+
+def get_market_data_partition_rows(db: Session, year: int, symbol: str):
+    table = models.market_data_partition(year)
+    return db.execute(
+        select(table).where(table.c.symbol == symbol).order_by(asc(table.c.date))
+    ).all()
+
 def create_market_data(db: Session, market_data: schemas.MarketDataCreate):
-    # 检查是否已存在相同的数据
-    existing = db.query(models.MarketData).filter(
-        models.MarketData.symbol == market_data.symbol,
-        models.MarketData.date == market_data.date
+    bulk_upsert_market_data(db, [market_data.model_dump()])
+    table = models.market_data_partition(market_data.date.year)
+    if not ensure_market_data_partition(db, market_data.date.year):
+        return None
+    return db.execute(
+        select(table).where(table.c.symbol == market_data.symbol, table.c.date == market_data.date)
     ).first()
+
+def get_market_data(db: Session, filter_params: schemas.MarketDataFilter):
+    """只查询覆盖请求区间的未归档年度分区，已归档的年份需从列式存储读取"""
+    years = [
+        partition.year for partition in get_market_data_partitions(db)
+        if not partition.archived
+        and (filter_params.start_date is None or partition.year >= filter_params.start_date.year)
+        and (filter_params.end_date is None or partition.year <= filter_params.end_date.year)
+    ]
     
-    if existing:
-        # 更新现有记录
-        update_data = market_data.model_dump()
-        for key, value in update_data.items():
-            setattr(existing, key, value)
+    rows = []
+    for year in years:
+        table = models.market_data_partition(year)
+        query = select(table).where(table.c.symbol == filter_params.symbol)
+        if filter_params.start_date:
+            query = query.where(table.c.date >= filter_params.start_date)
+        if filter_params.end_date:
+            query = query.where(table.c.date <= filter_params.end_date)
+        if filter_params.limit is not None:
+            query = query.limit(filter_params.limit - len(rows))
+        rows.extend(db.execute(query.order_by(asc(table.c.date))).all())
+        if filter_params.limit is not None and len(rows) >= filter_params.limit:
+            break
+    return rows
+
+def bulk_create_market_data(db: Session, market_data_list: List[schemas.MarketDataCreate]):
+    return bulk_upsert_market_data(db, [data.model_dump() for data in market_data_list])
+
+def bulk_upsert_market_data(db: Session, rows: List[Dict[str, Any]], chunk_size: int = MARKET_DATA_UPSERT_CHUNK_SIZE) -> int:
+    """按年份写入对应的分区表，(symbol, date) 冲突时更新价格字段；已归档年份的数据只保存在列式存储中，不写入数据库"""
+    if not rows:
+        return 0
+    
+    now = datetime.utcnow()
+    by_year: Dict[int, List[Dict[str, Any]]] = {}
+    for row in rows:
+        row.setdefault("updated_at", now)
+        by_year.setdefault(row["date"].year, []).append(row)
+    
+    written = 0
+    try:
+        for year, year_rows in sorted(by_year.items()):
+            if ensure_market_data_partition(db, year):
+                _upsert_market_data_rows(db, models.market_data_partition(year), year_rows, chunk_size)
+                written += len(year_rows)
         db.commit()
-        db.refresh(existing)
-        return existing
+    except Exception:
+        db.rollback()
+        raise
+    
+    return written
+
+def _upsert_market_data_rows(db: Session, table, rows: List[Dict[str, Any]], chunk_size: int):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
     else:
-        # 创建新记录
-        db_market_data = models.MarketData(**market_data.model_dump())
-        db.add(db_market_data)
+        # 其他数据库不支持 ON CONFLICT，逐条合并
+        for row in rows:
+            existing = db.execute(
+                select(table.c.id).where(table.c.symbol == row["symbol"], table.c.date == row["date"])
+            ).first()
+            if existing:
+                db.execute(table.update().where(table.c.id == existing[0]).values(**row))
+            else:
+                db.execute(table.insert().values(**row))
+        return
+    
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["symbol", "date"],
+        set_={column: stmt.excluded[column] for column in MARKET_DATA_UPSERT_COLUMNS}
+    )
+    for i in range(0, len(rows), chunk_size):
+        db.execute(stmt, rows[i:i + chunk_size])
+
+def migrate_legacy_market_data(db: Session) -> int:
+    """
+    把旧版 market_data 单表中的数据按年迁移到分区表，每年一个事务，中断后可重复执行。
+    已归档年份的数据留在旧表中，由 services.partitions.archive_legacy_market_data 补写到列式存储后删除。
+    """
+    legacy = models.MarketData.__table__
+    first, last = db.query(func.min(legacy.c.date), func.max(legacy.c.date)).one()
+    if first is None:
+        return 0
+    
+    columns = ["symbol", "date", "open", "high", "low", "close", "volume", "updated_at"]
+    moved = 0
+    for year in range(first.year, last.year + 1):
+        if not ensure_market_data_partition(db, year):
+            continue
+        table = models.market_data_partition(year)
+        exists = select(table.c.id).where(
+            table.c.symbol == legacy.c.symbol, table.c.date == legacy.c.date
+        ).exists()
+        source = select(*[legacy.c[column] for column in columns]).where(_legacy_year(year), ~exists)
+        moved += db.execute(table.insert().from_select(columns, source)).rowcount or 0
+        db.execute(legacy.delete().where(_legacy_year(year)))
         db.commit()
-        db.refresh(db_market_data)
-        return db_market_data
+    return moved
 
-def get_market_data(db: Session, filter_params: schemas.MarketDataFilter):
-    query = db.query(models.MarketData).filter(models.MarketData.symbol == filter_params.symbol)
+def _legacy_year(year: int):
+    legacy = models.MarketData.__table__
+    return and_(legacy.c.date >= datetime(year, 1, 1), legacy.c.date < datetime(year + 1, 1, 1))
+
+def get_legacy_market_data_symbols(db: Session, year: int) -> List[str]:
+    legacy = models.MarketData.__table__
+    return [row[0] for row in db.execute(select(legacy.c.symbol).where(_legacy_year(year)).distinct()).all()]
+
+def get_legacy_market_data_rows(db: Session, year: int, symbol: str):
+    legacy = models.MarketData.__table__
+    return db.execute(
+        select(legacy).where(_legacy_year(year), legacy.c.symbol == symbol).order_by(asc(legacy.c.date))
+    ).all()
+
+def delete_legacy_market_data(db: Session, year: int) -> int:
+    deleted = db.execute(models.MarketData.__table__.delete().where(_legacy_year(year))).rowcount or 0
+    db.commit()
+    return deleted
+
+def ensure_market_data_unique_index(db: Session):
+    """为旧版本创建的market_data表补建(symbol, date)唯一约束，重复记录只保留最新的一条"""
+    inspector = inspect(db.get_bind())
+    unique_columns = {tuple(c["column_names"]) for c in inspector.get_unique_constraints("market_data")}
+    unique_columns |= {tuple(i["column_names"]) for i in inspector.get_indexes("market_data") if i.get("unique")}
+    if ("symbol", "date") in unique_columns:
+        return
+    
+    db.execute(text(
+        "DELETE FROM market_data WHERE id NOT IN "
+        "(SELECT MAX(id) FROM market_data GROUP BY symbol, date)"
+    ))
+    db.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_market_data_symbol_date ON market_data (symbol, date)"
+    ))
+    db.commit()
+
+# 数据质量相关CRUD操作
+def replace_market_data_quality(db: Session, symbol: str, start: datetime, end: datetime, rows: List[Dict[str, Any]]):
+    """删除 [start, end] 内原有的质量记录后写入新记录，在同一事务中完成"""
+    db.query(models.MarketDataQuality).filter(
+        models.MarketDataQuality.symbol == symbol,
+        models.MarketDataQuality.date >= start,
+        models.MarketDataQuality.date <= end
+    ).delete(synchronize_session=False)
+    if rows:
+        db.bulk_insert_mappings(models.MarketDataQuality, rows)
+    db.commit()
+
+def get_market_data_quality(db: Session, symbol: str, quarantined_only: bool = False, limit: int = 100):
+    query = db.query(models.MarketDataQuality).filter(models.MarketDataQuality.symbol == symbol)
+    if quarantined_only:
+        query = query.filter(models.MarketDataQuality.quarantined == True)
+    return query.order_by(desc(models.MarketDataQuality.date)).limit(limit).all()
+
+def get_market_data_quality_counts(db: Session, symbols: List[str]):
+    """按 (股票, 标记, 是否隔离) 统计质量记录数"""
+    return db.query(
+        models.MarketDataQuality.symbol,
+        models.MarketDataQuality.flags,
+        models.MarketDataQuality.quarantined,
+        func.count(models.MarketDataQuality.id)
+    ).filter(
+        models.MarketDataQuality.symbol.in_(symbols)
+    ).group_by(
+        models.MarketDataQuality.symbol,
+        models.MarketDataQuality.flags,
+        models.MarketDataQuality.quarantined
+    ).all()
+
+# 公司行为（拆股、分红）相关CRUD操作
+def get_corporate_actions(db: Session, symbol: str):
+    return db.query(models.CorporateAction).filter(
+        models.CorporateAction.symbol == symbol
+    ).order_by(asc(models.CorporateAction.date)).all()
+
+def save_corporate_actions(db: Session, actions: List[schemas.CorporateActionCreate]) -> int:
+    """写入新的公司行为，已存在的事件只在数值变化时更新，返回新增或修改的条数"""
+    if not actions:
+        return 0
     
-    if filter_params.start_date:
-        query = query.filter(models.MarketData.date >= filter_params.start_date)
+    existing = {
+        (action.symbol, action.date, action.action_type): action
+        for action in db.query(models.CorporateAction).filter(
+            models.CorporateAction.symbol.in_({action.symbol for action in actions})
+        )
+    }
     
-    if filter_params.end_date:
-        query = query.filter(models.MarketData.date <= filter_params.end_date)
+    changed = 0
+    for action in actions:
+        key = (action.symbol, action.date, action.action_type.value)
+        current = existing.get(key)
+        if current is None:
+            db.add(models.CorporateAction(
+                symbol=action.symbol,
+                date=action.date,
+                action_type=action.action_type.value,
+                value=action.value
+            ))
+            changed += 1
+        elif abs(current.value - action.value) > 1e-9:
+            current.value = action.value
+            changed += 1
     
-    return query.order_by(asc(models.MarketData.date)).limit(filter_params.limit).all()
+    if changed:
+        db.commit()
+    return changed
 
-def bulk_create_market_data(db: Session, market_data_list: List[schemas.MarketDataCreate]):
-    result = []
-    for data in market_data_list:
-        result.append(create_market_data(db, data))
-    return result
+# 行情自动更新股票池相关CRUD操作
+def get_tracked_symbols(db: Session, active_only: bool = True):
+    query = db.query(models.TrackedSymbol)
+    if active_only:
+        query = query.filter(models.TrackedSymbol.is_active == True)
+    return query.order_by(asc(models.TrackedSymbol.symbol)).all()
+
+def get_tracked_symbol(db: Session, symbol: str):
+    return db.query(models.TrackedSymbol).filter(models.TrackedSymbol.symbol == symbol).first()
+
+def add_tracked_symbols(db: Session, symbols: List[str]) -> List[models.TrackedSymbol]:
+    """加入股票池，已停用的重新启用"""
+    tracked = []
+    for symbol in symbols:
+        db_symbol = get_tracked_symbol(db, symbol)
+        if db_symbol is None:
+            db_symbol = models.TrackedSymbol(symbol=symbol, is_active=True)
+            db.add(db_symbol)
+        else:
+            db_symbol.is_active = True
+        tracked.append(db_symbol)
+    db.commit()
+    return tracked
+
+def deactivate_tracked_symbol(db: Session, symbol: str) -> bool:
+    db_symbol = get_tracked_symbol(db, symbol)
+    if db_symbol is None:
+        return False
+    db_symbol.is_active = False
+    db.commit()
+    return True
+
+def record_ingestion_result(
+    db: Session,
+    symbol: str,
+    success: bool,
+    duration_ms: float,
+    last_bar_date: Optional[datetime] = None,
+    error: Optional[str] = None
+):
+    """记录一次行情更新的结果"""
+    db_symbol = get_tracked_symbol(db, symbol)
+    if db_symbol is None:
+        db_symbol = models.TrackedSymbol(symbol=symbol, is_active=False)
+        db.add(db_symbol)
+    
+    now = datetime.utcnow()
+    db_symbol.last_attempt_at = now
+    db_symbol.last_duration_ms = duration_ms
+    if success:
+        db_symbol.last_success_at = now
+        db_symbol.success_count = (db_symbol.success_count or 0) + 1
+        db_symbol.consecutive_failures = 0
+        db_symbol.last_error = None
+        if last_bar_date is not None:
+            db_symbol.last_bar_date = last_bar_date
+    else:
+        db_symbol.failure_count = (db_symbol.failure_count or 0) + 1
+        db_symbol.consecutive_failures = (db_symbol.consecutive_failures or 0) + 1
+        db_symbol.last_error = error
+    db.commit()
+    return db_symbol
+
+# 证券主数据
+def get_security(db: Session, symbol: str):
+    return db.query(models.Security).filter(models.Security.symbol == symbol).first()
+
+def get_securities(db: Session, symbols: Optional[List[str]] = None):
+    query = db.query(models.Security)
+    if symbols is not None:
+        query = query.filter(models.Security.symbol.in_(symbols))
+    return query.order_by(asc(models.Security.symbol)).all()
+
+def upsert_security(db: Session, security: schemas.SecurityCreate) -> models.Security:
+    db_security = get_security(db, security.symbol)
+    if db_security is None:
+        db_security = models.Security(symbol=security.symbol)
+        db.add(db_security)
+    for key, value in security.model_dump(exclude={"symbol"}).items():
+        setattr(db_security, key, value)
+    db_security.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(db_security)
+    return db_security
+
+def get_latest_quotes(db: Session):
+    return db.query(models.LatestQuote).all()
+
+def upsert_latest_quotes(db: Session, quotes: List[schemas.LatestQuote]) -> int:
+    existing = {
+        quote.symbol: quote
+        for quote in db.query(models.LatestQuote).filter(
+            models.LatestQuote.symbol.in_([quote.symbol for quote in quotes])
+        ).all()
+    }
+    for quote in quotes:
+        db_quote = existing.get(quote.symbol)
+        if db_quote is None:
+            db_quote = models.LatestQuote(symbol=quote.symbol)
+            db.add(db_quote)
+        for key, value in quote.model_dump(exclude={"symbol"}).items():
+            setattr(db_quote, key, value)
+    db.commit()
+    return len(quotes)
 
 # 扩展现有函数以支持新需求
 def get_user_strategies(db: Session, user_id: int, is_active: Optional[bool] = None, skip: int = 0, limit: int = 100):
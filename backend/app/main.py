@@ -2,9 +2,14 @@ from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
-from . import models, schemas, crud
+from . import models, schemas, crud, config
 from .database import engine, SessionLocal
-from .routers import strategies, backtest, trading, ai_assistant, market_data, auth, users, dashboard, portfolio, orders, user
+from .services.order_book import matching_engine
+from .services.partitions import archive_legacy_market_data
+from .services.sandbox import get_sandbox_pool, shutdown_sandbox_pool
+from .services.scheduler import get_ingestion_scheduler, shutdown_ingestion_scheduler
+from .services.streaming import shutdown_stream_hub
+from .routers import strategies, backtest, trading, ai_assistant, market_data, auth, users, dashboard, portfolio, orders, user, streaming
 
 # 创建数据库表
 models.Base.metadata.create_all(bind=engine)
@@ -46,6 +51,39 @@ app.include_router(dashboard.router, prefix="/api/dashboard", tags=["仪表盘"]
 app.include_router(portfolio.router, prefix="/api/portfolio", tags=["投资组合"])
 app.include_router(orders.router, prefix="/api/orders", tags=["订单"])
 app.include_router(user.router, prefix="/api/user", tags=["用户设置"])
+app.include_router(streaming.router, prefix="/ws", tags=["实时行情"])
+
+@app.on_event("startup")
+def start_background_services():
+    # 为旧数据库补建行情数据的唯一约束，批量写入依赖它处理冲突
+    db = SessionLocal()
+    try:
+        crud.ensure_market_data_unique_index(db)
+        # 旧版单表中的行情数据迁移到年度分区表，已归档年份的补写到列式存储
+        crud.migrate_legacy_market_data(db)
+        archive_legacy_market_data(db)
+        # 旧版trades表补建order_id列，orders表补建triggered列
+        crud.ensure_trade_order_column(db)
+        crud.ensure_order_triggered_column(db)
+    finally:
+        db.close()
+    
+    # 预先启动沙箱工作进程，避免首个回测承担进程启动和导入开销
+    if config.SANDBOX_ENABLED:
+        get_sandbox_pool()
+    
+    # 启动行情更新工作线程；关闭自动更新时仍可通过 /api/market-data/update 手动加入任务
+    get_ingestion_scheduler().start(periodic=config.INGESTION_ENABLED)
+    
+    # 恢复模拟交易的挂单，开始按行情撮合
+    matching_engine.start()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await shutdown_stream_hub()
+    shutdown_ingestion_scheduler()
+    matching_engine.stop()
+    shutdown_sandbox_pool()
 
 @app.get("/api/health")
 def health_check():
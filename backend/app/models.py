@@ -1,7 +1,9 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text, JSON, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text, JSON, Enum, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
+from typing import Dict
 import enum
+import threading
 
 from .database import Base
 
@@ -95,12 +97,33 @@ class Trade(Base):
     strategy_id = Column(Integer, ForeignKey("strategies.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     portfolio_id = Column(Integer, ForeignKey("portfolios.id"))
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True, index=True)  # 撮合产生的成交对应的委托单
 
     # 关系
     strategy = relationship("Strategy", back_populates="trades")
     user = relationship("User", back_populates="trades")
     portfolio = relationship("Portfolio", back_populates="trades")
 
+class Order(Base):
+    """模拟交易的委托单，未成交的部分挂在内存订单簿中，每笔成交记录为一条 trades"""
+    __tablename__ = "orders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, index=True)
+    side = Column(String)  # "buy", "sell"
+    order_type = Column(String)  # "market", "limit", "stop", "stop_limit"
+    quantity = Column(Float)
+    limit_price = Column(Float, nullable=True)
+    stop_price = Column(Float, nullable=True)
+    filled_quantity = Column(Float, default=0.0)
+    average_price = Column(Float, nullable=True)  # 成交均价
+    status = Column(String, index=True)  # "open", "partially_filled", "filled", "canceled"
+    triggered = Column(Boolean, default=False)  # 止损单是否已触发，已触发的止损限价单按限价单挂单
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"))
+
 class Portfolio(Base):
     __tablename__ = "portfolios"
 
@@ -146,6 +169,7 @@ class AIAssistantChat(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 class MarketData(Base):
+    """旧版本的单表行情数据，启动时迁移到按年分区的表中"""
     __tablename__ = "market_data"
 
     id = Column(Integer, primary_key=True, index=True)
@@ -158,11 +182,130 @@ class MarketData(Base):
     volume = Column(Float)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    class Config:
-        table_name = "market_data"
-        indexes = [
-            ("symbol", "date", "unique"),
-        ]
+    __table_args__ = (
+        UniqueConstraint("symbol", "date", name="uq_market_data_symbol_date"),
+    )
+
+class MarketDataPartition(Base):
+    """行情数据的年度分区；archived 为 True 的分区已压缩进列式存储，对应的表已删除"""
+    __tablename__ = "market_data_partitions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    year = Column(Integer, unique=True, index=True)
+    archived = Column(Boolean, default=False)
+    row_count = Column(Integer, nullable=True)  # 归档时的行数
+    created_at = Column(DateTime, default=datetime.utcnow)
+    archived_at = Column(DateTime, nullable=True)
+
+_market_data_partitions: Dict[int, Table] = {}
+_market_data_partitions_lock = threading.Lock()
+
+def market_data_partition(year: int) -> Table:
+    """按年分区的行情数据表 market_data_{year}，结构与 market_data 相同，(symbol, date) 唯一"""
+    with _market_data_partitions_lock:
+        table = _market_data_partitions.get(year)
+        if table is None:
+            table = Table(
+                f"market_data_{year}",
+                Base.metadata,
+                Column("id", Integer, primary_key=True),
+                Column("symbol", String, nullable=False),
+                Column("date", DateTime, nullable=False),
+                Column("open", Float),
+                Column("high", Float),
+                Column("low", Float),
+                Column("close", Float),
+                Column("volume", Float),
+                Column("updated_at", DateTime, default=datetime.utcnow),
+                UniqueConstraint("symbol", "date", name=f"uq_market_data_{year}_symbol_date"),
+            )
+            _market_data_partitions[year] = table
+        return table
+
+class MarketDataQuality(Base):
+    """校验中发现问题的K线：flags 为质量标记（按位组合），被隔离的K线未写入行情数据，数值为数据源返回的原始值"""
+    __tablename__ = "market_data_quality"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, index=True)
+    date = Column(DateTime, index=True)
+    flags = Column(Integer)
+    quarantined = Column(Boolean, default=False)
+    open = Column(Float, nullable=True)
+    high = Column(Float, nullable=True)
+    low = Column(Float, nullable=True)
+    close = Column(Float, nullable=True)
+    volume = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("symbol", "date", name="uq_market_data_quality_symbol_date"),
+    )
+
+class CorporateAction(Base):
+    __tablename__ = "corporate_actions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, index=True)
+    date = Column(DateTime, index=True)  # 除权除息日
+    action_type = Column(String)  # split, dividend
+    value = Column(Float)  # 拆股比例（如 4 表示 1 拆 4）或每股股息，均以未复权价格计
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("symbol", "date", "action_type", name="uq_corporate_action"),
+    )
+
+class TrackedSymbol(Base):
+    """行情数据自动更新的股票池，同时记录每只股票的数据新鲜度和失败情况"""
+    __tablename__ = "tracked_symbols"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, unique=True, index=True)
+    is_active = Column(Boolean, default=True)
+    last_attempt_at = Column(DateTime, nullable=True)
+    last_success_at = Column(DateTime, nullable=True)
+    last_bar_date = Column(DateTime, nullable=True)  # 本地存储中最新一根K线的日期
+    last_duration_ms = Column(Float, nullable=True)
+    success_count = Column(Integer, default=0)
+    failure_count = Column(Integer, default=0)
+    consecutive_failures = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Security(Base):
+    """证券主数据：名称、行业和基本面指标，由后台任务定期从数据源刷新"""
+    __tablename__ = "securities"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, unique=True, index=True)
+    name = Column(String)
+    sector = Column(String, index=True)
+    industry = Column(String)
+    market_cap = Column(Float)
+    pe_ratio = Column(Float)
+    dividend_yield = Column(Float)
+    beta = Column(Float)
+    week_52_high = Column(Float)
+    week_52_low = Column(Float)
+    avg_volume = Column(Float)
+    description = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class LatestQuote(Base):
+    """每只股票的最新报价，由行情写入、实时推送和报价接口更新，启动时加载到内存"""
+    __tablename__ = "latest_quotes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    symbol = Column(String, unique=True, index=True)
+    price = Column(Float)
+    change = Column(Float)
+    change_percent = Column(Float)
+    volume = Column(Float)
+    time = Column(String)  # 报价对应的K线时间
+    source = Column(String)  # "bar" / "stream" / "quote"
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 class UserApiKey(Base):
     __tablename__ = "user_api_keys"
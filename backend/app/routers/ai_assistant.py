@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
 import openai
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.indicators import get_indicators, parse_indicators
+from ..services.ingestion import load_market_data
 from .auth import get_current_active_user
 
 router = APIRouter()
@@ -207,12 +210,18 @@ async def market_analysis(
     # 将股票代码转换为逗号分隔的字符串
     symbols_str = ", ".join(symbols)
     
+    # 从共享的指标缓存中取最新的技术指标，作为分析的数据依据
+    indicator_summary = await run_in_threadpool(summarize_indicators, db, symbols)
+    
     # 准备市场分析提示
     prompt = f"""
     请对以下股票进行市场分析，包括技术面和基本面分析：
     
     股票代码: {symbols_str}
     
+    最新技术指标：
+    {indicator_summary}
+    
     请提供以下分析：
     1. 当前市场趋势分析
     2. 每只股票的技术指标分析（如均线、RSI、MACD等）
@@ -262,4 +271,29 @@ async def market_analysis(
         return {
             "response": fallback_message,
             "context": {"error": error_message}
-        } 
\ No newline at end of file
+        } 
+
+# 市场分析提示中使用的指标
+ANALYSIS_INDICATORS = ["sma20", "sma50", "rsi14", "macd"]
+
+# 辅助函数：汇总每只股票最新的技术指标，获取失败的股票跳过
+def summarize_indicators(db: Session, symbols: List[str]) -> str:
+    specs = parse_indicators(ANALYSIS_INDICATORS)
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=120)
+    
+    lines = []
+    for symbol in symbols:
+        symbol = symbol.strip().upper()
+        try:
+            load_market_data(db, symbol, start_date, end_date)
+            values = get_indicators(symbol, specs, start_date, end_date).dropna()
+        except Exception:
+            continue
+        if values.empty:
+            continue
+        latest = values.iloc[-1]
+        formatted = ", ".join(f"{name}={value:.2f}" for name, value in latest.items())
+        lines.append(f"{symbol} ({values.index[-1].strftime('%Y-%m-%d')}): {formatted}")
+    
+    return "\n    ".join(lines) if lines else "暂无"
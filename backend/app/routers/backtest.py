@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
-import pandas as pd
-import numpy as np
-import yfinance as yf
 from datetime import datetime, timedelta
-import json
 import traceback
 
-from .. import crud, models, schemas
+from .. import config, crud, models, schemas
 from ..database import get_db
+from ..services.backtest_compare import compare_backtests
+from ..services.backtest_engine import simple_backtest_engine
+from ..services.etag import make_etag, matches as etag_matches, not_modified, set_etag
+from ..services.indicators import get_indicators, parse_indicators
+from ..services.ingestion import load_market_data
+from ..services.sandbox import get_sandbox_pool
+from ..services.strategy_analyzer import analyze_strategy
 from .auth import get_current_active_user
 
 router = APIRouter()
@@ -67,6 +70,53 @@ async def create_backtest(
     
     return db_backtest
 
+# 对比多个回测
+@router.get("/compare")
+async def compare_backtest_results(
+    request: Request,
+    response: Response,
+    ids: str,
+    max_points: int = 500,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    try:
+        backtest_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="回测ID格式错误")
+
+    if len(backtest_ids) < 2 or len(backtest_ids) > 10:
+        raise HTTPException(status_code=400, detail="请提供2到10个回测ID")
+
+    backtests = []
+    for backtest_id in backtest_ids:
+        db_backtest = crud.get_backtest(db, backtest_id=backtest_id)
+        if db_backtest is None:
+            raise HTTPException(status_code=404, detail=f"回测不存在: {backtest_id}")
+
+        # 检查用户是否有权访问此回测
+        if db_backtest.user_id != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="没有足够的权限访问此回测"
+            )
+
+        if db_backtest.status != "completed":
+            raise HTTPException(status_code=400, detail=f"回测尚未完成: {backtest_id}")
+
+        backtests.append(db_backtest)
+
+    # 已完成的回测结果不再改变，ETag 由回测及其创建时间和采样点数决定，命中时不需要对齐和降采样
+    etag = make_etag("compare", max_points, [(backtest.id, backtest.created_at) for backtest in backtests])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    try:
+        return compare_backtests(backtests, max_points=max(max_points, 2))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # 获取指定回测
 @router.get("/{backtest_id}", response_model=schemas.Backtest)
 async def read_backtest(
@@ -127,46 +177,62 @@ def run_backtest_task(
             user_id=strategy.owner_id
         )
         
-        # 从策略代码中提取交易符号
-        # 这里假设策略参数中包含symbol字段
+        # 静态分析策略代码，推断所需的股票、字段和回看窗口
+        requirements = analyze_strategy(strategy.code, strategy.parameters)
+        
+        # 优先使用策略参数中的symbol字段，其次使用代码中引用的股票
         symbols = []
         if strategy.parameters and "symbols" in strategy.parameters:
             symbols = strategy.parameters["symbols"]
         elif strategy.parameters and "symbol" in strategy.parameters:
             symbols = [strategy.parameters["symbol"]]
+        elif requirements.symbols:
+            symbols = requirements.symbols
         else:
             # 默认使用一些常见股票
             symbols = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA"]
         
-        # 获取市场数据
+        # 获取前复权的市场数据：只保留策略用到的字段，并向前多取指标预热所需的数据
+        fetch_start = start_date - timedelta(days=requirements.warmup_days())
         market_data = {}
         for symbol in symbols:
-            ticker = yf.Ticker(symbol)
-            data = ticker.history(start=start_date, end=end_date)
+            data = load_market_data(db, symbol, fetch_start, end_date, columns=requirements.columns, adjusted=True)
             if not data.empty:
                 market_data[symbol] = data
         
         if not market_data:
             raise ValueError("无法获取市场数据")
         
+        # 策略用到的技术指标从共享的指标缓存中取，策略通过 indicators[symbol][name] 访问
+        indicators = {}
+        if requirements.indicators:
+            specs = parse_indicators(requirements.indicators)
+            for symbol in market_data:
+                indicators[symbol] = get_indicators(symbol, specs, fetch_start, end_date)
+        
         # 准备回测环境
         # 在实际应用中，这里应该有更复杂的回测逻辑
         # 这里我们使用一个简化版的回测框架
         
         # 解析并执行策略代码
-        # 注意：在生产环境中，应该使用更安全的方法来执行用户代码
+        # 注意：策略代码在沙箱进程中以受限的内置函数执行
         strategy_code = strategy.code
         strategy_parameters = strategy.parameters or {}
         
-        # 创建简单的回测引擎
-        results = simple_backtest_engine(
+        # 创建简单的回测引擎，启用沙箱时在预热的隔离进程中执行
+        engine_kwargs = dict(
             market_data=market_data,
             strategy_code=strategy_code,
             parameters=strategy_parameters,
             initial_capital=initial_capital,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            indicators=indicators
         )
+        if config.SANDBOX_ENABLED:
+            results = get_sandbox_pool().run(simple_backtest_engine, **engine_kwargs)
+        else:
+            results = simple_backtest_engine(**engine_kwargs)
         
         # 更新回测结果
         final_capital = results.get("final_capital", initial_capital)
@@ -205,202 +271,3 @@ def run_backtest_task(
             backtest_update=backtest_update,
             user_id=strategy.owner_id
         )
-
-# 简单回测引擎（模拟实现）
-def simple_backtest_engine(
-    market_data: Dict[str, pd.DataFrame],
-    strategy_code: str,
-    parameters: Dict[str, Any],
-    initial_capital: float,
-    start_date: datetime,
-    end_date: datetime
-) -> Dict[str, Any]:
-    """
-    一个非常简化的回测引擎实现，仅用于演示。
-    实际应用中应该使用更完善的回测框架。
-    """
-    # 创建回测环境
-    portfolio = {
-        "cash": initial_capital,
-        "positions": {},
-        "trades": [],
-        "equity_curve": []
-    }
-    
-    # 创建交易函数
-    def buy(symbol, shares, price):
-        cost = shares * price
-        if portfolio["cash"] >= cost:
-            portfolio["cash"] -= cost
-            if symbol in portfolio["positions"]:
-                portfolio["positions"][symbol] += shares
-            else:
-                portfolio["positions"][symbol] = shares
-            
-            portfolio["trades"].append({
-                "type": "buy",
-                "symbol": symbol,
-                "shares": shares,
-                "price": price,
-                "timestamp": current_date.strftime("%Y-%m-%d")
-            })
-            return True
-        return False
-    
-    def sell(symbol, shares, price):
-        if symbol in portfolio["positions"] and portfolio["positions"][symbol] >= shares:
-            portfolio["positions"][symbol] -= shares
-            portfolio["cash"] += shares * price
-            
-            if portfolio["positions"][symbol] == 0:
-                del portfolio["positions"][symbol]
-            
-            portfolio["trades"].append({
-                "type": "sell",
-                "symbol": symbol,
-                "shares": shares,
-                "price": price,
-                "timestamp": current_date.strftime("%Y-%m-%d")
-            })
-            return True
-        return False
-    
-    # 准备执行环境
-    # 注意：在生产环境中应该使用更安全的方法
-    strategy_globals = {
-        "market_data": market_data,
-        "parameters": parameters,
-        "buy": buy,
-        "sell": sell,
-        "np": np,
-        "pd": pd
-    }
-    
-    # 编译策略代码
-    try:
-        strategy_compiled = compile(strategy_code, "<string>", "exec")
-    except Exception as e:
-        return {
-            "error": f"策略代码编译错误: {str(e)}",
-            "final_capital": initial_capital,
-            "trades": []
-        }
-    
-    # 执行策略
-    try:
-        # 设置回测开始日期
-        all_dates = set()
-        for symbol, data in market_data.items():
-            all_dates.update(data.index.date)
-        
-        all_dates = sorted(all_dates)
-        
-        # 主回测循环
-        for date in all_dates:
-            current_date = datetime.combine(date, datetime.min.time())
-            if current_date < start_date or current_date > end_date:
-                continue
-            
-            # 更新当前日期
-            strategy_globals["current_date"] = current_date
-            
-            # 准备当日数据
-            for symbol, data in market_data.items():
-                if date in data.index.date:
-                    current_data = data.loc[data.index.date == date]
-                    strategy_globals[f"{symbol}_data"] = current_data
-                    strategy_globals[f"{symbol}_price"] = current_data["Close"].iloc[-1]
-            
-            # 执行策略
-            exec(strategy_compiled, strategy_globals)
-            
-            # 计算当前持仓价值
-            portfolio_value = portfolio["cash"]
-            for symbol, shares in portfolio["positions"].items():
-                if symbol in market_data and date in market_data[symbol].index.date:
-                    price = market_data[symbol].loc[market_data[symbol].index.date == date, "Close"].iloc[-1]
-                    portfolio_value += shares * price
-            
-            # 记录权益曲线
-            portfolio["equity_curve"].append({
-                "date": current_date.strftime("%Y-%m-%d"),
-                "value": portfolio_value
-            })
-    
-    except Exception as e:
-        return {
-            "error": f"策略执行错误: {str(e)}",
-            "final_capital": initial_capital,
-            "trades": portfolio["trades"]
-        }
-    
-    # 计算回测指标
-    final_capital = portfolio["cash"]
-    for symbol, shares in portfolio["positions"].items():
-        if symbol in market_data:
-            final_price = market_data[symbol]["Close"].iloc[-1]
-            final_capital += shares * final_price
-    
-    # 计算收益率
-    returns = []
-    if len(portfolio["equity_curve"]) > 1:
-        for i in range(1, len(portfolio["equity_curve"])):
-            prev_value = portfolio["equity_curve"][i-1]["value"]
-            curr_value = portfolio["equity_curve"][i]["value"]
-            returns.append((curr_value - prev_value) / prev_value)
-    
-    # 计算Sharpe比率（假设无风险利率为0）
-    sharpe_ratio = 0
-    if returns:
-        daily_returns = np.array(returns)
-        if np.std(daily_returns) > 0:
-            sharpe_ratio = np.mean(daily_returns) / np.std(daily_returns) * np.sqrt(252)  # 年化
-    
-    # 计算最大回撤
-    max_drawdown = 0
-    if portfolio["equity_curve"]:
-        equity_values = [point["value"] for point in portfolio["equity_curve"]]
-        peak = equity_values[0]
-        for value in equity_values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak
-            if drawdown > max_drawdown:
-                max_drawdown = drawdown
-    
-    # 计算胜率
-    win_trades = 0
-    total_trades = len(portfolio["trades"])
-    if total_trades > 0:
-        buy_trades = {}
-        for trade in portfolio["trades"]:
-            if trade["type"] == "buy":
-                key = f"{trade['symbol']}_{trade['timestamp']}"
-                buy_trades[key] = trade
-            elif trade["type"] == "sell":
-                key = f"{trade['symbol']}_{trade['timestamp']}"
-                if key in buy_trades:
-                    buy_trade = buy_trades[key]
-                    if trade["price"] > buy_trade["price"]:
-                        win_trades += 1
-        
-        win_rate = win_trades / total_trades if total_trades > 0 else 0
-    else:
-        win_rate = 0
-    
-    # 返回回测结果
-    return {
-        "final_capital": final_capital,
-        "profit_loss": final_capital - initial_capital,
-        "profit_loss_pct": (final_capital - initial_capital) / initial_capital * 100,
-        "sharpe_ratio": sharpe_ratio,
-        "max_drawdown": max_drawdown,
-        "win_rate": win_rate,
-        "total_trades": total_trades,
-        "trades": portfolio["trades"],
-        "equity_curve": portfolio["equity_curve"],
-        "final_positions": [
-            {"symbol": symbol, "shares": shares}
-            for symbol, shares in portfolio["positions"].items()
-        ]
-    } 
\ No newline at end of file
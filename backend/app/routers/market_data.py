@@ -1,144 +1,487 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
-import yfinance as yf
+from typing import Iterator, List, Optional, Tuple
+import base64
+import json
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 
-from .. import crud, models, schemas
+from .. import config, crud, models, schemas
 from ..database import get_db
+from ..services.market_store import STORE_COLUMNS, get_market_store
+from ..services.corporate_actions import corporate_actions, data_version, read_frame
+from ..services.cache import get_cache_stats, intraday_cache, quote_cache
+from ..services.ingestion import ensure_market_data
+from ..services.providers import get_provider
+from ..services.quotes import fetch_quotes, normalize_symbols
+from ..services.indicators import get_indicators, indicator_cache, parse_indicators, to_columnar
+from ..services.serialization import frame_columns, negotiate_format, render_columns
+from ..services.data_quality import flag_names, quality_report
+from ..services.latest_quotes import QUOTE, latest_quotes
+from ..services.order_book import matching_engine
+from ..services.etag import bar_range, content_etag, make_etag, matches as etag_matches, not_modified, set_etag
+from ..services.partitions import compact_partitions
+from ..services.correlation import correlation_cache, lookback_days, matrix_to_list
+from ..services.screener import run_screen, screener_matrix
+from ..services.scheduler import INFO, get_ingestion_scheduler
+from ..services.security_master import security_master
+from ..services.resample import INTRADAY_INTERVALS, SUPPORTED_INTERVALS, aggregate_cache, slice_bars
 from .auth import get_current_active_user
 
 router = APIRouter()
 
+# 单页最多返回的K线数
+MAX_PAGE_SIZE = 10000
+
 # 获取历史数据
-@router.get("/historical", response_model=List[schemas.MarketData])
+# 按日期升序分页：响应头 X-Next-Cursor 给出下一页的游标，作为 cursor 参数传回即可继续读取
+@router.get("/historical", response_model=List[schemas.MarketDataBase])
 async def get_historical_data(
+    request: Request,
     symbol: str, 
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     limit: int = 100,
+    adjusted: bool = True,
+    format: Optional[str] = None,
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
+    symbol = symbol.strip().upper()
+    # 响应格式：json（默认）、columnar、arrow、msgpack，也可以通过 Accept 请求头指定
+    response_format = negotiate_format(request, format)
+    if limit <= 0 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit 必须在 1 到 {MAX_PAGE_SIZE} 之间")
+    
     # 处理日期参数
     end_date_dt = datetime.now() if not end_date else datetime.strptime(end_date, "%Y-%m-%d")
     start_date_dt = end_date_dt - timedelta(days=30) if not start_date else datetime.strptime(start_date, "%Y-%m-%d")
     
-    # 构建过滤参数
-    filter_params = schemas.MarketDataFilter(
-        symbol=symbol,
-        start_date=start_date_dt,
-        end_date=end_date_dt,
-        limit=limit
+    # 游标是上一页最后一根K线的 (symbol, date)，本页从其后开始
+    read_start = start_date_dt
+    if cursor:
+        cursor_symbol, after = decode_cursor(cursor)
+        if cursor_symbol != symbol:
+            raise HTTPException(status_code=400, detail="游标与股票代码不匹配")
+        read_start = max(start_date_dt, after + timedelta(microseconds=1))
+    
+    # 条件请求：数据已全部在本地时直接比较 ETag，不读取数据也不序列化
+    etag_params = ("historical", limit, adjusted, response_format)
+    etag = await run_in_threadpool(stored_etag, symbol, read_start, end_date_dt, *etag_params)
+    if etag is not None and etag_matches(request, etag):
+        return not_modified(etag)
+    
+    # 从本地列式存储读取，缺失的区间从外部API补齐；adjusted 为 False 时返回未复权的原始数据
+    # 多读一行用于判断是否还有下一页
+    def read_page():
+        ensure_market_data(db, symbol, start_date_dt, end_date_dt)
+        return data_version(symbol), read_frame(symbol, read_start, end_date_dt, adjusted=adjusted, limit=limit + 1)
+    
+    try:
+        version, data = await run_in_threadpool(read_page)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取市场数据失败: {str(e)}"
+        )
+    
+    etag = market_etag(symbol, read_start, end_date_dt, version, *etag_params)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    # 直接从列数组序列化
+    has_more = len(data) > limit
+    data = data.iloc[:limit]
+    response = render_columns(frame_columns(data), response_format, {"symbol": symbol})
+    if has_more:
+        response.headers["X-Next-Cursor"] = encode_cursor(symbol, data.index[-1])
+    return set_etag(response, etag)
+
+# 以 NDJSON 流式返回历史数据，每行一根K线，按年份分区逐块读取，服务端内存占用与区间长度无关
+@router.get("/historical/stream")
+async def stream_historical_data(
+    symbol: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    adjusted: bool = True,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    end_date_dt = datetime.now() if not end_date else datetime.strptime(end_date, "%Y-%m-%d")
+    start_date_dt = datetime(1970, 1, 1) if not start_date else datetime.strptime(start_date, "%Y-%m-%d")
+    symbol = symbol.strip().upper()
+    
+    try:
+        await run_in_threadpool(ensure_market_data, db, symbol, start_date_dt, end_date_dt)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取市场数据失败: {str(e)}"
+        )
+    
+    return StreamingResponse(
+        iterate_in_threadpool(iter_ndjson(symbol, start_date_dt, end_date_dt, adjusted)),
+        media_type="application/x-ndjson"
     )
+
+# 获取指定周期的K线（周线、月线由日线在服务端聚合，1h 从数据源获取）
+@router.get("/ohlcv", response_model=schemas.OHLCVResponse)
+async def get_ohlcv(
+    request: Request,
+    symbol: str,
+    interval: str = "1d",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = 500,
+    adjusted: bool = True,
+    format: Optional[str] = None,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    response_format = negotiate_format(request, format)
+    if interval not in SUPPORTED_INTERVALS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的周期: {interval}，可选: {', '.join(SUPPORTED_INTERVALS)}"
+        )
+    symbol = symbol.strip().upper()
+    
+    end_date_dt = datetime.now() if not end_date else datetime.strptime(end_date, "%Y-%m-%d")
+    start_date_dt = end_date_dt - timedelta(days=365) if not start_date else datetime.strptime(start_date, "%Y-%m-%d")
     
-    # 查询数据库
-    market_data = crud.get_market_data(db, filter_params=filter_params)
-    
-    # 如果数据库中没有数据，则从外部API获取
-    if not market_data:
-        try:
-            data = fetch_market_data(symbol, start_date_dt, end_date_dt)
-            
-            # 保存数据到数据库
-            market_data = []
-            for index, row in data.iterrows():
-                market_data_item = schemas.MarketDataCreate(
-                    symbol=symbol,
-                    date=index,
-                    open=row['Open'],
-                    high=row['High'],
-                    low=row['Low'],
-                    close=row['Close'],
-                    volume=row['Volume']
-                )
-                db_item = crud.create_market_data(db, market_data=market_data_item)
-                market_data.append(db_item)
-            
-            # 限制返回条数
-            market_data = market_data[-limit:] if len(market_data) > limit else market_data
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"获取市场数据失败: {str(e)}"
+    etag_params = ("ohlcv", interval, limit, adjusted, response_format)
+    etag = None
+    if interval not in INTRADAY_INTERVALS:
+        etag = await run_in_threadpool(stored_etag, symbol, start_date_dt, end_date_dt, *etag_params)
+        if etag is not None and etag_matches(request, etag):
+            return not_modified(etag)
+    
+    try:
+        if interval in INTRADAY_INTERVALS:
+            bars = await intraday_cache.get_or_load(
+                (symbol, interval, start_date_dt.date(), end_date_dt.date()),
+                lambda: get_provider().history(symbol, start_date_dt, end_date_dt + timedelta(days=1), interval)
             )
+        else:
+            version, bars = await run_in_threadpool(load_ohlcv, db, symbol, interval, start_date_dt, end_date_dt, adjusted)
+            etag = market_etag(symbol, start_date_dt, end_date_dt, version, *etag_params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取K线数据失败: {str(e)}"
+        )
     
-    return market_data
+    # 返回最近的 limit 根K线
+    bars = bars.iloc[-limit:] if limit > 0 else bars.iloc[:0]
+    columns = frame_columns(bars)
+    if etag is None:
+        # 分钟线直接来自数据源，没有数据版本，按内容计算
+        etag = content_etag((symbol, *etag_params), columns)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response = render_columns(
+        columns,
+        response_format,
+        {"symbol": symbol, "interval": interval},
+        rows_key="bars"
+    )
+    return set_etag(response, etag)
 
-# 获取多个股票的最新价格
-@router.get("/prices")
-async def get_latest_prices(
-    symbols: str,
-    current_user: models.User = Depends(get_current_active_user)
+# 获取技术指标，如 names=rsi14,sma50,macd
+@router.get("/indicators")
+async def get_technical_indicators(
+    request: Request,
+    response: Response,
+    symbol: str,
+    names: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = 500,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
 ):
-    symbol_list = symbols.split(",")
+    try:
+        specs = parse_indicators(names.split(","))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not specs:
+        raise HTTPException(status_code=400, detail="请提供指标名称")
+    symbol = symbol.strip().upper()
+    
+    end_date_dt = datetime.now() if not end_date else datetime.strptime(end_date, "%Y-%m-%d")
+    start_date_dt = end_date_dt - timedelta(days=365) if not start_date else datetime.strptime(start_date, "%Y-%m-%d")
+    
+    # 指标基于全部已存储的历史计算，数据版本不变时结果不变
+    etag_params = ("indicators", tuple(spec.name for spec in specs), limit)
+    etag = await run_in_threadpool(stored_etag, symbol, start_date_dt, end_date_dt, *etag_params)
+    if etag is not None and etag_matches(request, etag):
+        return not_modified(etag)
+    
+    # 只需补齐请求区间的行情，指标缓存自己读取存储
+    def compute():
+        ensure_market_data(db, symbol, start_date_dt, end_date_dt)
+        return data_version(symbol), get_indicators(symbol, specs, start_date_dt, end_date_dt)
     
     try:
-        prices = {}
+        version, values = await run_in_threadpool(compute)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"计算技术指标失败: {str(e)}"
+        )
+    
+    etag = market_etag(symbol, start_date_dt, end_date_dt, version, *etag_params)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    
+    values = values.iloc[-limit:] if limit > 0 else values.iloc[:0]
+    return {
+        "symbol": symbol,
+        "dates": [index.strftime("%Y-%m-%d") for index in values.index],
+        "indicators": to_columnar(values)
+    }
+
+# 计算多只股票最近 window 个交易日收益率的相关系数和协方差矩阵
+@router.get("/correlation", response_model=schemas.CorrelationResponse)
+async def get_correlation(
+    symbols: str,
+    window: int = 60,
+    end_date: Optional[str] = None,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    symbol_list = normalize_symbols(symbols.split(","))
+    if len(symbol_list) < 2:
+        raise HTTPException(status_code=400, detail="至少需要两个股票代码")
+    if len(symbol_list) > config.CORRELATION_MAX_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"最多支持 {config.CORRELATION_MAX_SYMBOLS} 个股票")
+    if window < 2 or window > 2520:
+        raise HTTPException(status_code=400, detail="窗口长度需在 2 到 2520 之间")
+    
+    end_date_dt = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
+    
+    def compute():
+        last = end_date_dt or datetime.now()
         for symbol in symbol_list:
-            ticker = yf.Ticker(symbol.strip())
-            hist = ticker.history(period="1d")
-            if not hist.empty:
-                prices[symbol] = {
-                    "price": hist['Close'].iloc[-1],
-                    "change": hist['Close'].iloc[-1] - hist['Open'].iloc[-1],
-                    "change_percent": ((hist['Close'].iloc[-1] - hist['Open'].iloc[-1]) / hist['Open'].iloc[-1] * 100),
-                    "volume": hist['Volume'].iloc[-1],
-                    "time": hist.index[-1].strftime("%Y-%m-%d %H:%M:%S")
-                }
-        
-        return {"prices": prices}
+            ensure_market_data(db, symbol, last - timedelta(days=lookback_days(window)), last)
+        return correlation_cache.get(symbol_list, window, end_date_dt)
     
+    try:
+        result = await run_in_threadpool(compute)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取股票价格失败: {str(e)}"
+            detail=f"计算相关系数失败: {str(e)}"
         )
+    
+    return {
+        **result,
+        "symbols": symbol_list,
+        "window": window,
+        "correlation": matrix_to_list(result["correlation"]),
+        "covariance": matrix_to_list(result["covariance"]),
+        "volatility": matrix_to_list(result["volatility"])[0],
+    }
 
-# 后台任务：定期更新市场数据
-def update_market_data_background(db: Session, symbols: List[str]):
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=7)  # 更新最近一周的数据
+# 获取多个股票的最新价格
+@router.get("/prices")
+async def get_latest_prices(
+    symbols: str,
+    current_user: models.User = Depends(get_current_active_user)
+):
+    symbol_list = normalize_symbols(symbols.split(","))
+    if not symbol_list:
+        raise HTTPException(status_code=400, detail="请提供股票代码")
     
-    for symbol in symbols:
-        try:
-            data = fetch_market_data(symbol, start_date, end_date)
-            
-            for index, row in data.iterrows():
-                market_data_item = schemas.MarketDataCreate(
-                    symbol=symbol,
-                    date=index,
-                    open=row['Open'],
-                    high=row['High'],
-                    low=row['Low'],
-                    close=row['Close'],
-                    volume=row['Volume']
-                )
-                crud.create_market_data(db, market_data=market_data_item)
-        
-        except Exception as e:
-            print(f"更新市场数据失败: {symbol}, 错误: {str(e)}")
-
-# 触发数据更新
+    # 内存中足够新的最新报价（实时推送、盘中刷新写入的）直接返回
+    fresh = latest_quotes.get_many(symbol_list, config.LATEST_QUOTE_MAX_AGE)
+    
+    # 其余股票在报价缓存未命中时合并为一次批量请求，在线程池中执行以免阻塞事件循环
+    async def load_quotes(keys):
+        quotes, errors = await run_in_threadpool(fetch_quotes, keys)
+        for symbol, quote in quotes.items():
+            latest_quotes.update(symbol, quote, QUOTE)
+        return quotes, errors
+    
+    missing = [symbol for symbol in symbol_list if symbol not in fresh]
+    prices, errors = await quote_cache.get_many(missing, load_quotes) if missing else ({}, {})
+    prices.update({symbol: latest_quotes.as_quote(quote) for symbol, quote in fresh.items()})
+    
+    return {
+        "prices": {symbol: prices[symbol] for symbol in symbol_list if symbol in prices},
+        "errors": {symbol: str(e) for symbol, e in errors.items()}
+    }
+
+# 触发数据更新：加入行情更新任务队列，由后台工作线程限流执行
 @router.post("/update")
 async def trigger_data_update(
-    background_tasks: BackgroundTasks,
+    symbols: List[str],
+    current_user: models.User = Depends(get_current_active_user)
+):
+    # 检查用户权限
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="没有足够的权限执行此操作"
+        )
+    
+    scheduler = get_ingestion_scheduler()
+    queued = [symbol for symbol in normalize_symbols(symbols) if scheduler.enqueue(symbol)]
+    
+    return {"message": "数据更新任务已加入队列", "queued": queued}
+
+# 查看自动更新的股票池、数据新鲜度和调度器状态
+@router.get("/ingestion/status")
+async def read_ingestion_status(
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="没有足够的权限执行此操作"
+        )
+    
+    return {
+        "scheduler": get_ingestion_scheduler().stats(),
+        "symbols": [schemas.TrackedSymbol.model_validate(tracked) for tracked in crud.get_tracked_symbols(db, active_only=False)]
+    }
+
+# 加入自动更新的股票池，并立即回填历史数据
+@router.post("/ingestion/universe", response_model=List[schemas.TrackedSymbol])
+async def add_to_universe(
     symbols: List[str],
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    # 检查用户权限
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="没有足够的权限执行此操作"
         )
     
-    # 添加后台任务
-    background_tasks.add_task(update_market_data_background, db, symbols)
+    symbols = normalize_symbols(symbols)
+    if not symbols:
+        raise HTTPException(status_code=400, detail="请提供股票代码")
+    tracked = crud.add_tracked_symbols(db, symbols)
+    scheduler = get_ingestion_scheduler()
+    for symbol in symbols:
+        scheduler.enqueue(symbol)
+    return tracked
+
+# 从自动更新的股票池中移除
+@router.delete("/ingestion/universe/{symbol}")
+async def remove_from_universe(
+    symbol: str,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="没有足够的权限执行此操作"
+        )
+    
+    if not crud.deactivate_tracked_symbol(db, symbol.strip().upper()):
+        raise HTTPException(status_code=404, detail="股票不在自动更新列表中")
+    return {"message": "已从自动更新列表中移除"}
+
+# 按代码或公司名称搜索股票，用于输入联想
+@router.get("/search", response_model=List[schemas.SymbolSearchResult])
+async def search_symbols(
+    q: str,
+    limit: int = 10,
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return security_master.search(q, max(1, min(limit, 50)))
+
+# 按表达式对股票池做横截面筛选和排序，只使用本地已有的数据
+@router.post("/screener", response_model=schemas.ScreenerResponse)
+async def screen_symbols(
+    request: schemas.ScreenerRequest,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if request.symbols:
+        symbols = normalize_symbols(request.symbols)
+    else:
+        symbols = [tracked.symbol for tracked in crud.get_tracked_symbols(db)]
+    
+    try:
+        return await run_in_threadpool(
+            run_screen, symbols, request.expression, request.sort_by, request.descending, max(1, min(request.limit, 500))
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 各股票的数据质量分，默认为自动更新的股票池
+@router.get("/quality", response_model=List[schemas.DataQualityReport])
+async def get_data_quality(
+    symbols: Optional[str] = None,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if symbols:
+        symbol_list = normalize_symbols(symbols.split(","))
+    else:
+        symbol_list = [tracked.symbol for tracked in crud.get_tracked_symbols(db)]
+    return quality_report(db, symbol_list)
+
+# 某只股票被标记或隔离的K线
+@router.get("/quality/{symbol}/issues", response_model=List[schemas.DataQualityIssue])
+async def get_data_quality_issues(
+    symbol: str,
+    quarantined_only: bool = False,
+    limit: int = 100,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    issues = crud.get_market_data_quality(db, symbol.strip().upper(), quarantined_only, max(1, min(limit, 1000)))
+    return [
+        schemas.DataQualityIssue.model_validate(issue).model_copy(update={"issues": flag_names(issue.flags)})
+        for issue in issues
+    ]
+
+# 查看行情数据的年度分区及归档状态
+@router.get("/partitions", response_model=List[schemas.MarketDataPartition])
+async def read_market_data_partitions(
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="没有足够的权限执行此操作"
+        )
+    
+    return crud.get_market_data_partitions(db)
+
+# 立即归档超出保留年数的行情分区（调度器每天收盘后也会执行）
+@router.post("/partitions/compact")
+async def compact_market_data_partitions(
+    hot_years: int = config.MARKET_DATA_HOT_YEARS,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="没有足够的权限执行此操作"
+        )
+    if hot_years < 1:
+        raise HTTPException(status_code=400, detail="至少保留当年的分区")
     
-    return {"message": "数据更新任务已启动"}
+    archived = await run_in_threadpool(compact_partitions, db, hot_years)
+    return {"message": "行情分区归档完成", "archived": archived}
 
 # 获取股票基本信息
 @router.get("/info/{symbol}")
@@ -146,40 +489,117 @@ async def get_stock_info(
     symbol: str,
     current_user: models.User = Depends(get_current_active_user)
 ):
+    symbol = symbol.strip().upper()
+    info = await run_in_threadpool(security_master.info, symbol)
+    if info is not None:
+        return info
+    scheduler = get_ingestion_scheduler()
+    if scheduler.is_running:
+        # 不在请求中访问数据源，加入后台刷新队列
+        scheduler.enqueue(symbol, INFO)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="股票信息尚未同步，已加入更新队列，请稍后重试"
+        )
+    # 没有后台任务会处理队列，限流刷新一次
+    security = await run_in_threadpool(security_master.refresh_once, symbol)
+    if security is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="无法获取股票信息"
+        )
+    return security_master.info(symbol)
+
+# 获取股票的拆股和分红记录
+@router.get("/corporate-actions/{symbol}", response_model=List[schemas.CorporateAction])
+async def get_corporate_actions(
+    symbol: str,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    symbol = symbol.strip().upper()
     try:
-        ticker = yf.Ticker(symbol)
-        info = ticker.info
-        
-        # 提取有用的信息
-        relevant_info = {
-            "symbol": symbol,
-            "name": info.get("shortName", ""),
-            "sector": info.get("sector", ""),
-            "industry": info.get("industry", ""),
-            "market_cap": info.get("marketCap", 0),
-            "pe_ratio": info.get("trailingPE", 0),
-            "dividend_yield": info.get("dividendYield", 0) * 100 if info.get("dividendYield") else 0,
-            "beta": info.get("beta", 0),
-            "52_week_high": info.get("fiftyTwoWeekHigh", 0),
-            "52_week_low": info.get("fiftyTwoWeekLow", 0),
-            "avg_volume": info.get("averageVolume", 0),
-            "description": info.get("longBusinessSummary", ""),
-        }
-        
-        return relevant_info
-    
+        await run_in_threadpool(corporate_actions.sync, db, symbol)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"获取股票信息失败: {str(e)}"
+            detail=f"获取公司行为失败: {str(e)}"
         )
+    return crud.get_corporate_actions(db, symbol)
 
-# 辅助函数：从Yahoo Finance获取市场数据
-def fetch_market_data(symbol: str, start_date: datetime, end_date: datetime):
-    ticker = yf.Ticker(symbol)
-    data = ticker.history(start=start_date, end=end_date)
-    
-    if data.empty:
-        raise ValueError(f"无法获取股票数据: {symbol}")
-    
-    return data 
\ No newline at end of file
+# 查看行情缓存命中情况
+@router.get("/cache/stats")
+async def read_cache_stats(
+    current_user: models.User = Depends(get_current_active_user)
+):
+    return {
+        "caches": get_cache_stats(),
+        "ohlcv_aggregates": aggregate_cache.stats(),
+        "indicators": indicator_cache.stats(),
+        "securities": security_master.stats(),
+        "screener": screener_matrix.stats(),
+        "correlation": correlation_cache.stats(),
+        "latest_quotes": latest_quotes.stats(),
+        "order_book": matching_engine.stats()
+    }
+
+# 辅助函数：分页游标，编码 (symbol, date)
+def encode_cursor(symbol: str, date) -> str:
+    payload = f"{symbol.upper()}|{pd.Timestamp(date).isoformat()}"
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, datetime]:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        symbol, date = payload.split("|", 1)
+        return symbol, datetime.fromisoformat(date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+# 辅助函数：逐个分区生成 NDJSON 行
+def iter_ndjson(symbol: str, start_date: datetime, end_date: datetime, adjusted: bool) -> Iterator[bytes]:
+    for chunk in get_market_store().iter_chunks(symbol, start_date, end_date):
+        frame = get_market_store().to_frame(chunk, STORE_COLUMNS)
+        if adjusted:
+            frame = corporate_actions.adjust(symbol, frame)
+        dates = np.datetime_as_string(frame.index.to_numpy(dtype="datetime64[ns]"), unit="s").tolist()
+        lines = [
+            json.dumps({"symbol": symbol, "date": date, "open": o, "high": h, "low": l, "close": c, "volume": v})
+            for date, o, h, l, c, v in zip(
+                dates,
+                frame["Open"].tolist(),
+                frame["High"].tolist(),
+                frame["Low"].tolist(),
+                frame["Close"].tolist(),
+                frame["Volume"].tolist()
+            )
+        ]
+        if lines:
+            yield ("\n".join(lines) + "\n").encode()
+
+# 辅助函数：补齐行情数据后，从聚合缓存中取指定周期的K线，同时返回读取前的数据版本
+def load_ohlcv(
+    db: Session,
+    symbol: str,
+    interval: str,
+    start_date: datetime,
+    end_date: datetime,
+    adjusted: bool = True
+) -> Tuple[Tuple[int, int], pd.DataFrame]:
+    ensure_market_data(db, symbol, start_date, end_date)
+    # 先取版本再读数据，读取期间的写入只会让 ETag 偏旧，下次请求时重新返回完整响应
+    version = data_version(symbol)
+    if interval == "1d":
+        return version, read_frame(symbol, start_date, end_date, adjusted=adjusted)
+    return version, slice_bars(aggregate_cache.get(symbol, interval, adjusted), start_date, end_date)
+
+# 辅助函数：行情接口的 ETag，由股票、按日期归一化的区间、数据版本和其余影响响应的参数计算
+def market_etag(symbol: str, start: datetime, end: datetime, version: Tuple[int, int], *params) -> str:
+    return make_etag(symbol.upper(), *bar_range(start, end), version, *params)
+
+# 辅助函数：请求区间已全部在本地存储中（当天的K线在临时覆盖的有效期内）时由存储的数据版本返回当前的 ETag；否则需要先补齐数据，返回 None
+def stored_etag(symbol: str, start: datetime, end: datetime, *params) -> Optional[str]:
+    symbol = symbol.upper()
+    if get_market_store().missing_ranges(symbol, start, end):
+        return None
+    return market_etag(symbol, start, end, data_version(symbol), *params)
@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any
-from datetime import datetime
-import uuid
-import random
 
-from .. import crud, models, schemas
+from .. import config, crud, models, schemas
 from ..database import get_db
+from ..services.latest_quotes import QUOTE, latest_quotes
+from ..services.order_book import CANCELED, BookOrder, InsufficientFunds, from_db_order, matching_engine
+from ..services.providers import get_provider
 from .auth import get_current_active_user
 
 router = APIRouter()
@@ -19,51 +20,49 @@ async def get_orders(
     db: Session = Depends(get_db)
 ) -> List[Dict[str, Any]]:
     """获取订单列表"""
-    # 从trades表获取用户的交易记录，转换为订单格式
-    trades = crud.get_trades(db, user_id=current_user.id, skip=skip, limit=limit)
-    
-    orders = []
-    for trade in trades:
-        # 将Trade转换为前端期望的TradeOrder格式
-        orders.append({
-            "id": str(trade.id),
-            "symbol": trade.symbol,
-            "type": trade.order_type,  # "buy" or "sell"
-            "status": _convert_trade_status(trade.status),
-            "quantity": trade.quantity,
-            "price": trade.price,
-            "total": trade.quantity * trade.price,
-            "timestamp": trade.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        })
-    
-    return orders
+    orders = crud.get_user_orders(db, user_id=current_user.id, skip=skip, limit=limit)
+
+    # 未完成的委托单以订单簿中的状态为准，数据库由后台线程异步更新
+    return [
+        _order_response(matching_engine.get(order.id) or from_db_order(order), order.created_at)
+        for order in orders
+    ]
 
 @router.post("/")
 async def place_order(
     order_data: Dict[str, Any],
-    background_tasks: BackgroundTasks,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ) -> Dict[str, Any]:
-    """下单"""
+    """下单：委托进入内存订单簿立即撮合，未成交的限价单和止损单挂单等待行情"""
     try:
         # 验证订单数据
         symbol = order_data.get("symbol", "").upper()
         order_type = order_data.get("type")  # "buy" or "sell"
         quantity = float(order_data.get("quantity", 0))
-        order_style = order_data.get("order_type", "market")  # "market" or "limit"
+        order_style = order_data.get("order_type", "market")  # "market" / "limit" / "stop" / "stop_limit"
         price = float(order_data.get("price", 0)) if order_data.get("price") else None
-        
+        stop_price = float(order_data.get("stop_price", 0)) if order_data.get("stop_price") else None
+
         if not symbol or not order_type or quantity <= 0:
             raise HTTPException(status_code=400, detail="订单参数无效")
-        
+
         if order_type not in ["buy", "sell"]:
             raise HTTPException(status_code=400, detail="订单类型必须是 buy 或 sell")
-        
+
+        if order_style not in [style.value for style in schemas.OrderStyle]:
+            raise HTTPException(status_code=400, detail="委托类型必须是 market、limit、stop 或 stop_limit")
+
+        if order_style in ["limit", "stop_limit"] and (price is None or price <= 0):
+            raise HTTPException(status_code=400, detail="限价单需要提供有效的价格")
+
+        if order_style in ["stop", "stop_limit"] and (stop_price is None or stop_price <= 0):
+            raise HTTPException(status_code=400, detail="止损单需要提供有效的止损价")
+
         # 获取用户的默认投资组合
         portfolios = crud.get_user_portfolios(db, user_id=current_user.id)
         portfolio = portfolios[0] if portfolios else None
-        
+
         # 如果没有投资组合，创建一个默认的
         if not portfolio:
             portfolio_create = schemas.PortfolioCreate(
@@ -73,213 +72,93 @@ async def place_order(
                 total_value=100000.0
             )
             portfolio = crud.create_portfolio(db, portfolio=portfolio_create, user_id=current_user.id)
-        
-        # 模拟获取当前市场价格
-        if not price or order_style == "market":
-            price = _get_mock_market_price(symbol)
-        
-        # 创建交易记录
-        trade_create = schemas.TradeCreate(
+
+        # 市价单需要最新价，内存中没有或已超过 LATEST_QUOTE_MAX_AGE 时从数据源重新获取
+        latest = latest_quotes.get(symbol, config.LATEST_QUOTE_MAX_AGE)
+        if latest is None and order_style == "market":
+            try:
+                quote = await run_in_threadpool(get_provider().fetch_quote, symbol)
+            except Exception:
+                raise HTTPException(status_code=400, detail=f"无法获取股票价格: {symbol}")
+            latest_quotes.update(symbol, quote, QUOTE)
+
+        # 创建委托单记录
+        order_create = schemas.OrderCreate(
             symbol=symbol,
-            order_type=order_type,
+            side=order_type,
+            order_type=order_style,
             quantity=quantity,
-            price=price,
-            portfolio_id=portfolio.id,
-            strategy_id=None  # 手动交易没有策略ID
+            limit_price=price if order_style in ["limit", "stop_limit"] else None,
+            stop_price=stop_price if order_style in ["stop", "stop_limit"] else None,
+            portfolio_id=portfolio.id
         )
-        
-        trade = crud.create_trade(db, trade=trade_create, user_id=current_user.id)
-        
-        # 在后台处理订单执行
-        background_tasks.add_task(
-            process_order_execution,
-            db=db,
-            trade_id=trade.id,
-            user_id=current_user.id
-        )
-        
-        # 返回订单确认
-        return {
-            "id": str(trade.id),
-            "symbol": symbol,
-            "type": order_type,
-            "status": "pending",
-            "quantity": quantity,
-            "price": price,
-            "total": quantity * price,
-            "timestamp": trade.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        }
-        
+        db_order = crud.create_order(db, order=order_create, user_id=current_user.id)
+
+        # 撮合；成交由后台线程写入 trades 并更新投资组合
+        try:
+            order = matching_engine.submit(from_db_order(db_order))
+        except InsufficientFunds as e:
+            # 保留被拒绝的委托记录
+            crud.record_order_fills(db, [], [{"id": db_order.id, "status": CANCELED}])
+            raise HTTPException(status_code=400, detail=str(e))
+        return _order_response(order, db_order.created_at)
+
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail="数值参数格式错误")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"下单失败: {str(e)}")
 
-def _convert_trade_status(trade_status: str) -> str:
-    """转换交易状态为前端期望的格式"""
-    status_map = {
-        "pending": "pending",
-        "executed": "filled",
-        "canceled": "canceled",
-        "failed": "canceled"
-    }
-    return status_map.get(trade_status, "pending")
+# 撤销未完成的委托单
+@router.delete("/{order_id}")
+async def cancel_order(
+    order_id: int,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+) -> Dict[str, Any]:
+    db_order = crud.get_order(db, order_id=order_id)
+    if db_order is None or db_order.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="订单不存在")
 
-def _get_mock_market_price(symbol: str) -> float:
-    """获取模拟市场价格"""
-    # 模拟不同股票的价格范围
-    price_ranges = {
-        "AAPL": (170, 180),
-        "GOOGL": (130, 145),
-        "MSFT": (370, 385),
-        "TSLA": (240, 260),
-        "AMZN": (140, 155),
-        "META": (320, 340),
-        "NVDA": (450, 480),
-        "NFLX": (420, 450)
-    }
-    
-    if symbol in price_ranges:
-        min_price, max_price = price_ranges[symbol]
-        return round(random.uniform(min_price, max_price), 2)
-    else:
-        # 对于未知股票，返回随机价格
-        return round(random.uniform(50, 200), 2)
+    order = matching_engine.cancel(order_id)
+    if order is None:
+        raise HTTPException(status_code=400, detail="只有未完成的订单可以撤销")
+    return _order_response(order, db_order.created_at)
 
-async def process_order_execution(db: Session, trade_id: int, user_id: int):
-    """后台处理订单执行"""
-    try:
-        # 获取交易记录
-        trade = crud.get_trade(db, trade_id=trade_id)
-        if not trade or trade.status != "pending":
-            return
-        
-        # 模拟订单执行延迟
-        import asyncio
-        await asyncio.sleep(random.uniform(1, 3))  # 1-3秒随机延迟
-        
-        # 模拟执行成功率（95%成功率）
-        if random.random() < 0.95:
-            # 订单执行成功
-            execution_price = trade.price * (1 + random.uniform(-0.001, 0.001))  # 轻微滑点
-            
-            trade_update = schemas.TradeUpdate(
-                status="executed",
-                price=execution_price,
-                executed_at=datetime.now()
-            )
-            
-            # 更新投资组合
-            if trade.portfolio_id:
-                await _update_portfolio_from_trade(db, trade, execution_price)
-                
-        else:
-            # 订单执行失败
-            trade_update = schemas.TradeUpdate(
-                status="failed",
-                executed_at=datetime.now()
-            )
-        
-        # 更新交易状态
-        crud.update_trade(db, trade_id=trade_id, trade_update=trade_update, user_id=user_id)
-        
-    except Exception as e:
-        # 处理执行过程中的错误
-        trade_update = schemas.TradeUpdate(
-            status="failed",
-            executed_at=datetime.now()
-        )
-        crud.update_trade(db, trade_id=trade_id, trade_update=trade_update, user_id=user_id)
+# 查看某只股票订单簿的买卖档位
+@router.get("/book/{symbol}")
+async def get_order_book(
+    symbol: str,
+    levels: int = 10,
+    current_user: models.User = Depends(get_current_active_user)
+) -> Dict[str, Any]:
+    return matching_engine.depth(symbol.strip().upper(), max(1, min(levels, 100)))
 
-async def _update_portfolio_from_trade(db: Session, trade: models.Trade, execution_price: float):
-    """根据交易更新投资组合"""
-    try:
-        portfolio = crud.get_portfolio(db, portfolio_id=trade.portfolio_id)
-        if not portfolio:
-            return
-        
-        if trade.order_type == "buy":
-            # 买入操作
-            cost = trade.quantity * execution_price
-            
-            # 检查现金余额
-            if portfolio.cash_balance >= cost:
-                # 减少现金
-                new_cash_balance = portfolio.cash_balance - cost
-                
-                # 更新或创建资产
-                existing_asset = crud.get_asset_by_symbol(db, portfolio_id=portfolio.id, symbol=trade.symbol)
-                
-                if existing_asset:
-                    # 更新现有资产
-                    new_quantity = existing_asset.quantity + trade.quantity
-                    new_avg_price = ((existing_asset.average_price * existing_asset.quantity) + 
-                                   (execution_price * trade.quantity)) / new_quantity
-                    
-                    asset_update = schemas.AssetUpdate(
-                        quantity=new_quantity,
-                        average_price=new_avg_price,
-                        current_price=execution_price,
-                        market_value=new_quantity * execution_price
-                    )
-                    crud.update_asset(db, asset_id=existing_asset.id, asset_update=asset_update)
-                else:
-                    # 创建新资产
-                    asset_create = schemas.AssetCreate(
-                        symbol=trade.symbol,
-                        quantity=trade.quantity,
-                        average_price=execution_price,
-                        current_price=execution_price,
-                        market_value=trade.quantity * execution_price,
-                        portfolio_id=portfolio.id
-                    )
-                    crud.create_asset(db, asset=asset_create)
-                
-                # 更新投资组合
-                portfolio_update = schemas.PortfolioUpdate(
-                    cash_balance=new_cash_balance,
-                    total_value=portfolio.total_value  # 总价值保持不变（现金变股票）
-                )
-                crud.update_portfolio(db, portfolio_id=portfolio.id, portfolio_update=portfolio_update, user_id=trade.user_id)
-        
-        elif trade.order_type == "sell":
-            # 卖出操作
-            existing_asset = crud.get_asset_by_symbol(db, portfolio_id=portfolio.id, symbol=trade.symbol)
-            
-            if existing_asset and existing_asset.quantity >= trade.quantity:
-                # 增加现金
-                revenue = trade.quantity * execution_price
-                new_cash_balance = portfolio.cash_balance + revenue
-                
-                # 更新资产
-                new_quantity = existing_asset.quantity - trade.quantity
-                
-                if new_quantity > 0:
-                    # 还有剩余持仓
-                    asset_update = schemas.AssetUpdate(
-                        quantity=new_quantity,
-                        current_price=execution_price,
-                        market_value=new_quantity * execution_price
-                    )
-                    crud.update_asset(db, asset_id=existing_asset.id, asset_update=asset_update)
-                else:
-                    # 完全卖出，删除资产记录
-                    crud.delete_asset(db, asset_id=existing_asset.id)
-                
-                # 计算盈亏
-                profit_loss = (execution_price - existing_asset.average_price) * trade.quantity
-                
-                # 更新交易盈亏
-                trade_update = schemas.TradeUpdate(profit_loss=profit_loss)
-                crud.update_trade(db, trade_id=trade.id, trade_update=trade_update, user_id=trade.user_id)
-                
-                # 更新投资组合
-                portfolio_update = schemas.PortfolioUpdate(
-                    cash_balance=new_cash_balance,
-                    total_value=portfolio.total_value  # 总价值保持不变（股票变现金）
-                )
-                crud.update_portfolio(db, portfolio_id=portfolio.id, portfolio_update=portfolio_update, user_id=trade.user_id)
-                
-    except Exception as e:
-        # 记录错误但不抛出异常，避免影响交易状态更新
-        print(f"更新投资组合失败: {str(e)}")
\ No newline at end of file
+def _order_response(order: BookOrder, created_at) -> Dict[str, Any]:
+    """转换为前端期望的 TradeOrder 格式"""
+    price = order.average_price or order.limit_price or order.stop_price or 0.0
+    return {
+        "id": str(order.id),
+        "symbol": order.symbol,
+        "type": order.side,  # "buy" or "sell"
+        "order_type": order.order_type,
+        "status": _convert_order_status(order.status),
+        "quantity": order.quantity,
+        "filled_quantity": order.filled,
+        "price": price,
+        "limit_price": order.limit_price,
+        "stop_price": order.stop_price,
+        "total": order.quantity * price,
+        "timestamp": created_at.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def _convert_order_status(order_status: str) -> str:
+    """转换委托单状态为前端期望的格式，部分成交仍视为待处理"""
+    status_map = {
+        "open": "pending",
+        "partially_filled": "pending",
+        "filled": "filled",
+        "canceled": "canceled"
+    }
+    return status_map.get(order_status, "pending")
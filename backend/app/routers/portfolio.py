@@ -6,6 +6,8 @@ import random
 
 from .. import crud, models, schemas
 from ..database import get_db
+from ..services.latest_quotes import latest_quotes
+from ..services.security_master import security_master
 from .auth import get_current_active_user
 
 router = APIRouter()
@@ -27,8 +29,9 @@ async def get_positions(
         assets = crud.get_portfolio_assets(db, portfolio_id=portfolio.id)
         
         for asset in assets:
-            # 模拟当前价格更新
-            current_price = asset.current_price * (1 + random.uniform(-0.05, 0.05))
+            # 按内存中的最新价估值，没有报价时使用上次成交价
+            latest = latest_quotes.get(asset.symbol)
+            current_price = latest.price if latest is not None else asset.current_price
             value = asset.quantity * current_price
             profit_loss = value - (asset.quantity * asset.average_price)
             profit_loss_percent = (profit_loss / (asset.quantity * asset.average_price)) * 100
@@ -64,17 +67,18 @@ async def get_assets(
         portfolio_assets = crud.get_portfolio_assets(db, portfolio_id=portfolio.id)
         
         for asset in portfolio_assets:
-            current_price = asset.current_price * (1 + random.uniform(-0.03, 0.03))
+            latest = latest_quotes.get(asset.symbol)
+            current_price = latest.price if latest is not None else asset.current_price
             value = asset.quantity * current_price
             allocation = (value / total_portfolio_value * 100) if total_portfolio_value > 0 else 0
             
-            # 模拟日涨跌和总收益
-            day_change = random.uniform(-5.0, 5.0)
+            # 日涨跌取最新报价，总收益按持仓成本计算
+            day_change = latest.change_percent if latest is not None else 0.0
             total_return = ((current_price - asset.average_price) / asset.average_price) * 100
             
             assets.append({
                 "symbol": asset.symbol,
-                "name": _get_stock_name(asset.symbol),
+                "name": security_master.name(asset.symbol),
                 "shares": asset.quantity,
                 "price": round(current_price, 2),
                 "value": round(value, 2),
@@ -202,17 +206,3 @@ def _generate_mock_performance() -> Dict[str, Any]:
         "total_return": 25.0,
         "history": history
     }
-
-def _get_stock_name(symbol: str) -> str:
-    """根据股票代码获取公司名称"""
-    stock_names = {
-        "AAPL": "苹果公司",
-        "GOOGL": "字母公司", 
-        "MSFT": "微软公司",
-        "TSLA": "特斯拉公司",
-        "AMZN": "亚马逊公司",
-        "META": "Meta公司",
-        "NVDA": "英伟达公司",
-        "NFLX": "Netflix公司"
-    }
-    return stock_names.get(symbol, f"{symbol} 公司")
\ No newline at end of file
@@ -0,0 +1,98 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from jose import JWTError, jwt
+from typing import Optional
+import asyncio
+
+from .. import config, crud, models
+from ..database import SessionLocal
+from ..services.quotes import normalize_symbols
+from ..services.streaming import Subscriber, get_stream_hub
+
+router = APIRouter()
+
+# 实时行情推送
+# 连接：/ws/market-data?token=<JWT>&symbols=AAPL,MSFT
+# 客户端消息：{"action": "subscribe" | "unsubscribe", "symbols": ["AAPL"]}
+# 服务端消息：snapshot（完整报价）、update（只包含变化的字段）、error、subscribed
+@router.websocket("/market-data")
+async def market_data_stream(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    symbols: Optional[str] = None
+):
+    # 浏览器的 WebSocket 无法设置请求头，通过查询参数传递token
+    user = await run_in_threadpool(get_user_from_token, token)
+    if user is None or not user.is_active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    hub = get_stream_hub()
+    subscriber = Subscriber()
+
+    async def send_messages():
+        while True:
+            message = await subscriber.receive()
+            await websocket.send_json(message)
+
+    sender = asyncio.create_task(send_messages())
+    try:
+        if symbols:
+            await update_subscriptions(websocket, hub, subscriber, "subscribe", symbols.split(","))
+
+        while True:
+            message = await websocket.receive_json()
+            action = message.get("action") if isinstance(message, dict) else None
+            if action not in ("subscribe", "unsubscribe"):
+                subscriber.send({"type": "error", "detail": "未知的操作"})
+                continue
+            symbols_field = message.get("symbols") or []
+            # 兼容 "AAPL,MSFT" 形式的字符串，其他非列表的值直接拒绝，避免按字符逐个订阅
+            if isinstance(symbols_field, str):
+                symbols_field = symbols_field.split(",")
+            if not isinstance(symbols_field, list):
+                subscriber.send({"type": "error", "detail": "symbols 必须是股票代码列表"})
+                continue
+            await update_subscriptions(websocket, hub, subscriber, action, symbols_field)
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        sender.cancel()
+        hub.disconnect(subscriber)
+
+# 辅助函数：处理订阅和取消订阅
+async def update_subscriptions(websocket: WebSocket, hub, subscriber: Subscriber, action: str, symbols):
+    symbols = normalize_symbols([str(symbol) for symbol in symbols])
+
+    if action == "subscribe":
+        allowed = config.STREAM_MAX_SYMBOLS - len(subscriber.symbols)
+        new_symbols = [symbol for symbol in symbols if symbol not in subscriber.symbols]
+        if len(new_symbols) > allowed:
+            subscriber.send({"type": "error", "detail": f"每个连接最多订阅 {config.STREAM_MAX_SYMBOLS} 只股票"})
+            new_symbols = new_symbols[:max(allowed, 0)]
+        for symbol in new_symbols:
+            hub.subscribe(subscriber, symbol)
+    else:
+        for symbol in symbols:
+            hub.unsubscribe(subscriber, symbol)
+
+    subscriber.send({"type": "subscribed", "symbols": sorted(subscriber.symbols)})
+
+# 辅助函数：校验token并返回用户
+def get_user_from_token(token: Optional[str]) -> Optional[models.User]:
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, crud.SECRET_KEY, algorithms=[crud.ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+
+    db = SessionLocal()
+    try:
+        return crud.get_user_by_username(db, username=username)
+    finally:
+        db.close()
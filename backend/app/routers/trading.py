@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
-import yfinance as yf
 from datetime import datetime
 
-from .. import crud, models, schemas
+from .. import config, crud, models, schemas
 from ..database import get_db
+from ..services.latest_quotes import QUOTE, latest_quotes
+from ..services.order_book import matching_engine
+from ..services.providers import get_provider
 from .auth import get_current_active_user
 
 router = APIRouter()
@@ -137,17 +139,21 @@ def execute_trade_task(db: Session, trade_id: int, user_id: int):
             return
         
         # 获取当前市场价格
-        ticker = yf.Ticker(trade.symbol)
         current_price = None
         
-        try:
-            # 获取实时价格
-            hist = ticker.history(period="1d")
-            if not hist.empty:
-                current_price = hist['Close'].iloc[-1]
-        except Exception:
-            # 如果无法获取实时价格，使用交易中指定的价格
-            current_price = trade.price
+        # 优先使用内存中足够新的最新报价，不访问数据源
+        latest = latest_quotes.get(trade.symbol, config.LATEST_QUOTE_MAX_AGE)
+        if latest is not None:
+            current_price = latest.price
+        else:
+            try:
+                # 获取实时价格
+                quote = get_provider().fetch_quote(trade.symbol)
+                latest_quotes.update(trade.symbol, quote, QUOTE)
+                current_price = quote["price"]
+            except Exception:
+                # 如果无法获取实时价格，使用交易中指定的价格
+                current_price = trade.price
         
         if not current_price:
             # 更新交易状态为失败
@@ -165,7 +171,8 @@ def execute_trade_task(db: Session, trade_id: int, user_id: int):
                 if trade.order_type == "buy":
                     # 检查现金是否足够
                     cost = trade.quantity * current_price
-                    if portfolio.cash_balance < cost:
+                    # 撮合引擎中委托单冻结的现金不能使用
+                    if portfolio.cash_balance < cost or not matching_engine.adjust(portfolio.id, trade.symbol, -cost, trade.quantity):
                         # 资金不足，交易失败
                         trade_update = schemas.TradeUpdate(
                             status="failed",
@@ -216,7 +223,11 @@ def execute_trade_task(db: Session, trade_id: int, user_id: int):
                     assets = crud.get_assets_by_portfolio(db, portfolio_id=portfolio.id)
                     asset = next((a for a in assets if a.symbol == trade.symbol), None)
                     
-                    if not asset or asset.quantity < trade.quantity:
+                    # 撮合引擎中卖单冻结的持仓不能卖出
+                    if (
+                        not asset or asset.quantity < trade.quantity
+                        or not matching_engine.adjust(portfolio.id, trade.symbol, trade.quantity * current_price, -trade.quantity)
+                    ):
                         # 持仓不足，交易失败
                         trade_update = schemas.TradeUpdate(
                             status="failed",
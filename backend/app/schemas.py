@@ -124,6 +124,40 @@ class OrderStatus(str, Enum):
     CANCELED = "canceled"
     FAILED = "failed"
 
+class OrderStyle(str, Enum):
+    MARKET = "market"
+    LIMIT = "limit"
+    STOP = "stop"
+    STOP_LIMIT = "stop_limit"
+
+class OrderState(str, Enum):
+    OPEN = "open"
+    PARTIALLY_FILLED = "partially_filled"
+    FILLED = "filled"
+    CANCELED = "canceled"
+
+class OrderCreate(BaseModel):
+    symbol: str
+    side: OrderType
+    order_type: OrderStyle = OrderStyle.MARKET
+    quantity: float
+    limit_price: Optional[float] = None
+    stop_price: Optional[float] = None
+    portfolio_id: Optional[int] = None
+
+class Order(OrderCreate):
+    id: int
+    filled_quantity: float = 0.0
+    average_price: Optional[float] = None
+    status: OrderState
+    triggered: bool = False
+    created_at: datetime
+    updated_at: datetime
+    user_id: int
+
+    class Config:
+        from_attributes = True
+
 class TradeBase(BaseModel):
     symbol: str
     order_type: OrderType
@@ -233,7 +267,7 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 # 市场数据相关模式
-class MarketDataCreate(BaseModel):
+class MarketDataBase(BaseModel):
     symbol: str
     date: datetime
     open: float
@@ -242,13 +276,162 @@ class MarketDataCreate(BaseModel):
     close: float
     volume: float
 
-class MarketData(MarketDataCreate):
+class MarketDataCreate(MarketDataBase):
+    pass
+
+class MarketData(MarketDataBase):
+    id: int
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class DataQualityIssue(BaseModel):
+    symbol: str
+    date: datetime
+    flags: int
+    issues: List[str] = []
+    quarantined: bool
+    open: Optional[float] = None
+    high: Optional[float] = None
+    low: Optional[float] = None
+    close: Optional[float] = None
+    volume: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+class DataQualityReport(BaseModel):
+    symbol: str
+    bars: int
+    repaired: int
+    warnings: int
+    quarantined: int
+    score: float
+
+class MarketDataPartition(BaseModel):
+    year: int
+    archived: bool
+    row_count: Optional[int] = None
+    created_at: datetime
+    archived_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class CorporateActionType(str, Enum):
+    SPLIT = "split"
+    DIVIDEND = "dividend"
+
+class CorporateActionBase(BaseModel):
+    symbol: str
+    date: datetime
+    action_type: CorporateActionType
+    value: float
+
+class CorporateActionCreate(CorporateActionBase):
+    pass
+
+class CorporateAction(CorporateActionBase):
     id: int
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class TrackedSymbol(BaseModel):
+    symbol: str
+    is_active: bool
+    last_attempt_at: Optional[datetime] = None
+    last_success_at: Optional[datetime] = None
+    last_bar_date: Optional[datetime] = None
+    last_duration_ms: Optional[float] = None
+    success_count: int = 0
+    failure_count: int = 0
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class SecurityBase(BaseModel):
+    symbol: str
+    name: str = ""
+    sector: str = ""
+    industry: str = ""
+    market_cap: float = 0
+    pe_ratio: float = 0
+    dividend_yield: float = 0
+    beta: float = 0
+    week_52_high: float = 0
+    week_52_low: float = 0
+    avg_volume: float = 0
+    description: str = ""
+
+class SecurityCreate(SecurityBase):
+    pass
+
+class Security(SecurityBase):
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class LatestQuote(BaseModel):
+    symbol: str
+    price: float
+    change: float = 0
+    change_percent: float = 0
+    volume: float = 0
+    time: str
+    source: str
     updated_at: datetime
 
     class Config:
         from_attributes = True
 
+class SymbolSearchResult(BaseModel):
+    symbol: str
+    name: str
+    sector: str
+    match: str  # symbol / symbol_prefix / name_prefix / fuzzy
+
+class ScreenerRequest(BaseModel):
+    expression: str  # 如 rsi14 < 30 and volume > 2 * avg_volume20 and close > sma200
+    sort_by: Optional[str] = None  # 排序表达式，如 change_pct
+    descending: bool = True
+    limit: int = 50
+    symbols: Optional[List[str]] = None  # 默认为自动更新的股票池
+
+class ScreenerResponse(BaseModel):
+    expression: str
+    total: int
+    matched: int
+    results: List[Dict[str, Any]]
+
+class CorrelationResponse(BaseModel):
+    symbols: List[str]
+    window: int
+    start_date: str
+    end_date: str
+    observations: int
+    correlation: List[List[Optional[float]]]
+    covariance: List[List[Optional[float]]]  # 日收益率协方差
+    volatility: List[Optional[float]]  # 年化波动率
+
+class OHLCVBar(BaseModel):
+    date: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+
+class OHLCVResponse(BaseModel):
+    symbol: str
+    interval: str
+    bars: List[OHLCVBar]
+
 class MarketDataFilter(BaseModel):
     symbol: str
     start_date: Optional[datetime] = None
@@ -0,0 +1 @@
+# 业务服务模块
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+回测对比服务，基于已存储的列式权益序列对多个回测进行对齐和比较
+"""
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+from .. import models
+
+# 对比结果中每条曲线的最大点数
+DEFAULT_MAX_POINTS = 500
+
+# 参与对比的指标字段
+COMPARE_METRICS = ["final_capital", "profit_loss", "sharpe_ratio", "max_drawdown", "win_rate"]
+
+
+def extract_equity_series(results: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """从回测结果中取出列式权益序列（日期, 权益值）"""
+    results = results or {}
+    series = results.get("equity_series")
+    if series and series.get("dates"):
+        dates = np.array(series["dates"], dtype="datetime64[D]")
+        values = np.asarray(series["values"], dtype=float)
+    else:
+        # 兼容旧版本按行存储的权益曲线
+        curve = results.get("equity_curve") or []
+        dates = np.array([point["date"] for point in curve], dtype="datetime64[D]")
+        values = np.array([point["value"] for point in curve], dtype=float)
+    return dates, values
+
+
+def align_series(series: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """按共同交易日对齐多条权益序列，返回 (日期, 权益矩阵[回测数 x 日期数])"""
+    common = series[0][0]
+    for dates, _ in series[1:]:
+        common = np.intersect1d(common, dates, assume_unique=True)
+
+    matrix = np.empty((len(series), len(common)), dtype=float)
+    for i, (dates, values) in enumerate(series):
+        matrix[i] = values[np.searchsorted(dates, common)]
+    return common, matrix
+
+
+def downsample_indices(length: int, max_points: int) -> np.ndarray:
+    """等间距抽样下标，始终保留首尾两个点"""
+    if length <= max_points:
+        return np.arange(length)
+    return np.unique(np.linspace(0, length - 1, max_points).round().astype(int))
+
+
+def drawdown_matrix(equity: np.ndarray) -> np.ndarray:
+    """计算每条权益曲线在每个时点的回撤"""
+    peaks = np.maximum.accumulate(equity, axis=1)
+    return (peaks - equity) / peaks
+
+
+def compare_backtests(
+    backtests: List[models.Backtest],
+    max_points: int = DEFAULT_MAX_POINTS,
+    drawdown_threshold: float = 0.0
+) -> Dict[str, Any]:
+    """对比多个已完成的回测，不重新运行任何回测"""
+    series = [extract_equity_series(backtest.results) for backtest in backtests]
+    dates, equity = align_series(series)
+
+    if len(dates) < 2:
+        raise ValueError("回测之间没有足够的共同交易日")
+
+    # 归一化为以1为起点的净值曲线，便于叠加显示
+    normalized = equity / equity[:, :1]
+    sample = downsample_indices(len(dates), max_points)
+
+    # 日收益率及相关性
+    returns = np.diff(equity, axis=1) / equity[:, :-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.corrcoef(returns)
+    correlation = np.nan_to_num(np.atleast_2d(correlation))
+
+    # 回撤重叠：两者同时处于回撤的天数占任一处于回撤天数的比例
+    in_drawdown = drawdown_matrix(equity) > drawdown_threshold
+    both = in_drawdown[:, None, :] & in_drawdown[None, :, :]
+    either = in_drawdown[:, None, :] | in_drawdown[None, :, :]
+    either_count = either.sum(axis=2)
+    overlap = np.where(either_count > 0, both.sum(axis=2) / np.maximum(either_count, 1), 0.0)
+
+    # 指标差值以第一个回测为基准
+    baseline = backtests[0]
+    metrics = []
+    for i, backtest in enumerate(backtests):
+        values = {name: getattr(backtest, name) for name in COMPARE_METRICS}
+        values["total_return"] = float(normalized[i, -1] - 1)
+        deltas = {}
+        for name in COMPARE_METRICS:
+            base_value = getattr(baseline, name)
+            if values[name] is not None and base_value is not None:
+                deltas[name] = values[name] - base_value
+        deltas["total_return"] = values["total_return"] - float(normalized[0, -1] - 1)
+        metrics.append({
+            "backtest_id": backtest.id,
+            "name": backtest.name,
+            "metrics": values,
+            "deltas": deltas,
+        })
+
+    ids = [backtest.id for backtest in backtests]
+    return {
+        "backtest_ids": ids,
+        "aligned_points": int(len(dates)),
+        "start_date": str(dates[0]),
+        "end_date": str(dates[-1]),
+        "curves": {
+            "dates": [str(d) for d in dates[sample]],
+            "series": {
+                str(backtest_id): normalized[i, sample].round(6).tolist()
+                for i, backtest_id in enumerate(ids)
+            },
+        },
+        "metrics": metrics,
+        "return_correlation": correlation.round(6).tolist(),
+        "drawdown_overlap": overlap.round(6).tolist(),
+    }
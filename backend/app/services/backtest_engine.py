@@ -0,0 +1,216 @@
+"""
+回测引擎，独立于路由模块以便在沙箱工作进程中预加载
+"""
+from typing import Dict, Any, Optional
+from datetime import datetime
+import pandas as pd
+import numpy as np
+
+from .sandbox import SAFE_BUILTINS, compile_strategy, module_proxy
+
+# 简单回测引擎（模拟实现）
+def simple_backtest_engine(
+    market_data: Dict[str, pd.DataFrame],
+    strategy_code: str,
+    parameters: Dict[str, Any],
+    initial_capital: float,
+    start_date: datetime,
+    end_date: datetime,
+    indicators: Optional[Dict[str, pd.DataFrame]] = None
+) -> Dict[str, Any]:
+    """
+    一个非常简化的回测引擎实现，仅用于演示。
+    实际应用中应该使用更完善的回测框架。
+    """
+    # 创建回测环境
+    portfolio = {
+        "cash": initial_capital,
+        "positions": {},
+        "trades": [],
+        "equity_curve": []
+    }
+    
+    # 创建交易函数
+    def buy(symbol, shares, price):
+        cost = shares * price
+        if portfolio["cash"] >= cost:
+            portfolio["cash"] -= cost
+            if symbol in portfolio["positions"]:
+                portfolio["positions"][symbol] += shares
+            else:
+                portfolio["positions"][symbol] = shares
+            
+            portfolio["trades"].append({
+                "type": "buy",
+                "symbol": symbol,
+                "shares": shares,
+                "price": price,
+                "timestamp": current_date.strftime("%Y-%m-%d")
+            })
+            return True
+        return False
+    
+    def sell(symbol, shares, price):
+        if symbol in portfolio["positions"] and portfolio["positions"][symbol] >= shares:
+            portfolio["positions"][symbol] -= shares
+            portfolio["cash"] += shares * price
+            
+            if portfolio["positions"][symbol] == 0:
+                del portfolio["positions"][symbol]
+            
+            portfolio["trades"].append({
+                "type": "sell",
+                "symbol": symbol,
+                "shares": shares,
+                "price": price,
+                "timestamp": current_date.strftime("%Y-%m-%d")
+            })
+            return True
+        return False
+    
+    # 准备执行环境
+    # 策略代码只能使用受限的内置函数和白名单模块，np/pd 以模块代理提供
+    strategy_globals = {
+        "market_data": market_data,
+        "indicators": indicators or {},
+        "parameters": parameters,
+        "buy": buy,
+        "sell": sell,
+        "np": module_proxy(np),
+        "pd": module_proxy(pd),
+        "__builtins__": SAFE_BUILTINS
+    }
+    
+    # 编译策略代码
+    try:
+        strategy_compiled = compile_strategy(strategy_code)
+    except Exception as e:
+        return {
+            "error": f"策略代码编译错误: {str(e)}",
+            "final_capital": initial_capital,
+            "trades": []
+        }
+    
+    # 执行策略
+    try:
+        # 设置回测开始日期
+        all_dates = set()
+        for symbol, data in market_data.items():
+            all_dates.update(data.index.date)
+        
+        all_dates = sorted(all_dates)
+        
+        # 主回测循环
+        for date in all_dates:
+            current_date = datetime.combine(date, datetime.min.time())
+            if current_date < start_date or current_date > end_date:
+                continue
+            
+            # 更新当前日期
+            strategy_globals["current_date"] = current_date
+            
+            # 准备当日数据
+            for symbol, data in market_data.items():
+                if date in data.index.date:
+                    current_data = data.loc[data.index.date == date]
+                    strategy_globals[f"{symbol}_data"] = current_data
+                    strategy_globals[f"{symbol}_price"] = current_data["Close"].iloc[-1]
+            
+            # 执行策略
+            exec(strategy_compiled, strategy_globals)
+            
+            # 计算当前持仓价值
+            portfolio_value = portfolio["cash"]
+            for symbol, shares in portfolio["positions"].items():
+                if symbol in market_data and date in market_data[symbol].index.date:
+                    price = market_data[symbol].loc[market_data[symbol].index.date == date, "Close"].iloc[-1]
+                    portfolio_value += shares * price
+            
+            # 记录权益曲线
+            portfolio["equity_curve"].append({
+                "date": current_date.strftime("%Y-%m-%d"),
+                "value": portfolio_value
+            })
+    
+    except Exception as e:
+        return {
+            "error": f"策略执行错误: {str(e)}",
+            "final_capital": initial_capital,
+            "trades": portfolio["trades"]
+        }
+    
+    # 计算回测指标
+    final_capital = portfolio["cash"]
+    for symbol, shares in portfolio["positions"].items():
+        if symbol in market_data:
+            final_price = market_data[symbol]["Close"].iloc[-1]
+            final_capital += shares * final_price
+    
+    # 计算收益率
+    returns = []
+    if len(portfolio["equity_curve"]) > 1:
+        for i in range(1, len(portfolio["equity_curve"])):
+            prev_value = portfolio["equity_curve"][i-1]["value"]
+            curr_value = portfolio["equity_curve"][i]["value"]
+            returns.append((curr_value - prev_value) / prev_value)
+    
+    # 计算Sharpe比率（假设无风险利率为0）
+    sharpe_ratio = 0
+    if returns:
+        daily_returns = np.array(returns)
+        if np.std(daily_returns) > 0:
+            sharpe_ratio = np.mean(daily_returns) / np.std(daily_returns) * np.sqrt(252)  # 年化
+    
+    # 计算最大回撤
+    max_drawdown = 0
+    if portfolio["equity_curve"]:
+        equity_values = [point["value"] for point in portfolio["equity_curve"]]
+        peak = equity_values[0]
+        for value in equity_values:
+            if value > peak:
+                peak = value
+            drawdown = (peak - value) / peak
+            if drawdown > max_drawdown:
+                max_drawdown = drawdown
+    
+    # 计算胜率
+    win_trades = 0
+    total_trades = len(portfolio["trades"])
+    if total_trades > 0:
+        buy_trades = {}
+        for trade in portfolio["trades"]:
+            if trade["type"] == "buy":
+                key = f"{trade['symbol']}_{trade['timestamp']}"
+                buy_trades[key] = trade
+            elif trade["type"] == "sell":
+                key = f"{trade['symbol']}_{trade['timestamp']}"
+                if key in buy_trades:
+                    buy_trade = buy_trades[key]
+                    if trade["price"] > buy_trade["price"]:
+                        win_trades += 1
+        
+        win_rate = win_trades / total_trades if total_trades > 0 else 0
+    else:
+        win_rate = 0
+    
+    # 返回回测结果
+    return {
+        "final_capital": final_capital,
+        "profit_loss": final_capital - initial_capital,
+        "profit_loss_pct": (final_capital - initial_capital) / initial_capital * 100,
+        "sharpe_ratio": sharpe_ratio,
+        "max_drawdown": max_drawdown,
+        "win_rate": win_rate,
+        "total_trades": total_trades,
+        "trades": portfolio["trades"],
+        "equity_curve": portfolio["equity_curve"],
+        # 列式存储的权益序列，供回测对比等分析直接使用
+        "equity_series": {
+            "dates": [point["date"] for point in portfolio["equity_curve"]],
+            "values": [point["value"] for point in portfolio["equity_curve"]]
+        },
+        "final_positions": [
+            {"symbol": symbol, "shares": shares}
+            for symbol, shares in portfolio["positions"].items()
+        ]
+    }
@@ -0,0 +1,173 @@
+"""
+进程内TTL缓存
+
+- 每类数据独立配置TTL，并按LRU限制条目数
+- 同一个键的并发未命中合并为一次上游请求（single-flight）
+- 过期不久的数据先返回旧值，同时在后台刷新（stale-while-revalidate）
+- 记录命中、未命中等计数
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .. import config
+
+# 批量加载函数：接收一组键，返回 (成功加载的值, 每个键的错误)
+BatchLoader = Callable[[List[Hashable]], Awaitable[Tuple[Dict[Hashable, Any], Dict[Hashable, Any]]]]
+
+_caches: Dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    def __init__(self, name: str, ttl: float, max_size: int = 1024, stale_ttl: Optional[float] = None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = ttl if stale_ttl is None else stale_ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        _caches[name] = self
+
+    def _lookup(self, key: Hashable) -> Tuple[Any, Optional[str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, None
+        value, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age < self.ttl:
+            self._entries.move_to_end(key)
+            return value, "fresh"
+        if age < self.ttl + self.stale_ttl:
+            self._entries.move_to_end(key)
+            return value, "stale"
+        del self._entries[key]
+        return None, None
+
+    def _store(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def set(self, key: Hashable, value: Any):
+        self._store(key, value)
+
+    def _start_load(self, keys: List[Hashable], loader: BatchLoader) -> Dict[Hashable, asyncio.Future]:
+        """启动一次批量加载，返回每个键对应的 Future"""
+        loop = asyncio.get_running_loop()
+        futures = {key: loop.create_future() for key in keys}
+        for future in futures.values():
+            # 后台刷新的结果可能没有人等待，避免未读取异常的警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight.update(futures)
+
+        async def run():
+            try:
+                loaded, failed = await loader(keys)
+            except Exception as e:
+                loaded, failed = {}, {key: e for key in keys}
+            for key, future in futures.items():
+                self._inflight.pop(key, None)
+                if key in loaded:
+                    self._store(key, loaded[key])
+                    future.set_result(loaded[key])
+                else:
+                    error = failed.get(key, "没有可用的数据")
+                    future.set_exception(error if isinstance(error, Exception) else LookupError(error))
+
+        task = loop.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return futures
+
+    async def get_many(self, keys: List[Hashable], loader: BatchLoader) -> Tuple[Dict[Hashable, Any], Dict[Hashable, Exception]]:
+        """批量读取，未命中的键通过一次 loader 调用加载"""
+        values: Dict[Hashable, Any] = {}
+        errors: Dict[Hashable, Exception] = {}
+        waiting: Dict[Hashable, asyncio.Future] = {}
+        to_load: List[Hashable] = []
+        to_refresh: List[Hashable] = []
+
+        for key in keys:
+            value, state = self._lookup(key)
+            if state == "fresh":
+                self.hits += 1
+                values[key] = value
+            elif state == "stale":
+                self.stale_hits += 1
+                values[key] = value
+                if key not in self._inflight:
+                    to_refresh.append(key)
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[key] = self._inflight[key]
+            else:
+                self.misses += 1
+                to_load.append(key)
+
+        if to_refresh:
+            self._start_load(to_refresh, loader)
+        if to_load:
+            waiting.update(self._start_load(to_load, loader))
+
+        for key, future in waiting.items():
+            try:
+                values[key] = await asyncio.shield(future)
+            except Exception as e:
+                errors[key] = e
+        return values, errors
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """读取单个键，未命中时调用 loader() 加载，加载失败时抛出原异常"""
+        async def batch_loader(keys):
+            return {key: await loader()}, {}
+
+        values, errors = await self.get_many([key], batch_loader)
+        if key in errors:
+            raise errors[key]
+        return values[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.stale_hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+def get_cache_stats() -> List[Dict[str, Any]]:
+    return [cache.stats() for cache in _caches.values()]
+
+
+# 各类行情数据的缓存
+quote_cache = TTLCache(
+    "quotes",
+    ttl=config.QUOTE_CACHE_TTL,
+    max_size=config.QUOTE_CACHE_SIZE,
+    stale_ttl=config.QUOTE_CACHE_STALE_TTL,
+)
+intraday_cache = TTLCache(
+    "intraday",
+    ttl=config.INTRADAY_CACHE_TTL,
+    max_size=config.INTRADAY_CACHE_SIZE,
+)
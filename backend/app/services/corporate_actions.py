@@ -0,0 +1,220 @@
+"""
+公司行为与复权
+
+本地存储和数据库只保存未复权的原始行情，拆股和分红事件单独保存在 corporate_actions 表中。
+读取时按事件计算复权因子并向量化地相乘（前复权），新的拆股或分红只需追加一条事件，
+不必重写历史行情。
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .. import config, crud, schemas
+from ..database import SessionLocal
+from .market_store import get_market_store
+from .providers import get_provider
+
+SPLIT = schemas.CorporateActionType.SPLIT.value
+DIVIDEND = schemas.CorporateActionType.DIVIDEND.value
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close"]
+
+
+def _split_factors(split_dates: np.ndarray, ratios: np.ndarray, dates: np.ndarray) -> np.ndarray:
+    """每个日期之后发生的所有拆股比例的乘积"""
+    order = np.argsort(split_dates)
+    split_dates, ratios = split_dates[order], ratios[order]
+    suffix = np.append(np.cumprod(ratios[::-1])[::-1], 1.0)
+    return suffix[np.searchsorted(split_dates, dates, side="right")]
+
+
+def _events_version(actions) -> int:
+    """事件内容的哈希，没有事件时为 0"""
+    if not actions:
+        return 0
+    content = "|".join(
+        f"{action.date.isoformat()},{action.action_type},{action.value!r}"
+        for action in sorted(actions, key=lambda action: (action.date, action.action_type))
+    )
+    return int.from_bytes(hashlib.sha1(content.encode("utf-8")).digest()[:8], "big") or 1
+
+
+class CorporateActionBook:
+    """按股票缓存公司行为事件及复权因子"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # symbol -> (版本号, 事件)；事件按日期排序，列为 date, action_type, value
+        # 版本号由数据库中的事件计算，重启后或多个进程之间相同的事件得到相同的版本号
+        self._events: Dict[str, Tuple[int, pd.DataFrame]] = {}
+        self._synced_at: Dict[str, float] = {}
+        # symbol -> ((事件版本, 存储版本), 事件日期, 价格因子后缀积, 成交量因子后缀积)
+        self._factors: Dict[str, Tuple[Tuple[int, int], np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    # 事件
+    def events(self, symbol: str) -> pd.DataFrame:
+        return self._load(symbol.upper())[1]
+
+    def version(self, symbol: str) -> int:
+        return self._load(symbol.upper())[0]
+
+    def _load(self, symbol: str, reload: bool = False) -> Tuple[int, pd.DataFrame]:
+        with self._lock:
+            entry = self._events.get(symbol)
+            if entry is not None and not reload:
+                return entry
+
+            db = SessionLocal()
+            try:
+                actions = crud.get_corporate_actions(db, symbol)
+            finally:
+                db.close()
+            events = pd.DataFrame(
+                {
+                    "date": pd.to_datetime([action.date for action in actions]).astype("datetime64[ns]"),
+                    "action_type": [action.action_type for action in actions],
+                    "value": np.array([action.value for action in actions], dtype=float),
+                }
+            )
+            self._events[symbol] = (_events_version(actions), events)
+            self._factors.pop(symbol, None)
+            return self._events[symbol]
+
+    def sync(self, db: Session, symbol: str, force: bool = False) -> int:
+        """从数据源同步公司行为，距上次同步不足 CORPORATE_ACTIONS_TTL 时跳过，返回新增或修改的事件数"""
+        symbol = symbol.upper()
+        now = time.monotonic()
+        with self._lock:
+            synced_at = self._synced_at.get(symbol)
+            if not force and synced_at is not None and now - synced_at < config.CORPORATE_ACTIONS_TTL:
+                return 0
+            self._synced_at[symbol] = now
+
+        actions = self._from_provider(symbol)
+        changed = crud.save_corporate_actions(db, actions)
+        if changed:
+            self._load(symbol, reload=True)
+        return changed
+
+    def _from_provider(self, symbol: str) -> List[schemas.CorporateActionCreate]:
+        provider = get_provider()
+        frame = provider.fetch_actions(symbol)
+        if frame is None or frame.empty:
+            return []
+
+        index = pd.DatetimeIndex(frame.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        index = index.normalize()
+        dividends = frame["Dividends"].to_numpy(dtype=float) if "Dividends" in frame else np.zeros(len(frame))
+        splits = frame["Stock Splits"].to_numpy(dtype=float) if "Stock Splits" in frame else np.zeros(len(frame))
+
+        # 已按拆股复权的数据源给出的股息也是复权后的，换算回除息日当时的金额
+        if provider.split_adjusted and np.any(splits > 0):
+            split_mask = splits > 0
+            dividends = dividends * _split_factors(
+                index.to_numpy()[split_mask], splits[split_mask], index.to_numpy()
+            )
+
+        actions = []
+        for date, dividend, split in zip(index.to_pydatetime(), dividends, splits):
+            if split > 0 and split != 1:
+                actions.append(schemas.CorporateActionCreate(symbol=symbol, date=date, action_type=SPLIT, value=float(split)))
+            if dividend > 0:
+                actions.append(schemas.CorporateActionCreate(symbol=symbol, date=date, action_type=DIVIDEND, value=float(dividend)))
+        return actions
+
+    # 原始行情
+    def to_raw(self, symbol: str, frame: pd.DataFrame) -> pd.DataFrame:
+        """数据源已按拆股复权时，还原为除权前的原始价格和成交量"""
+        if frame is None or frame.empty or not get_provider().split_adjusted:
+            return frame
+        events = self.events(symbol)
+        splits = events[events["action_type"] == SPLIT]
+        if splits.empty:
+            return frame
+
+        index = pd.DatetimeIndex(frame.index)
+        dates = (index.tz_localize(None) if index.tz is not None else index).to_numpy(dtype="datetime64[ns]")
+        factors = _split_factors(splits["date"].to_numpy(), splits["value"].to_numpy(), dates)
+        raw = frame.copy()
+        for column in PRICE_COLUMNS:
+            if column in raw:
+                raw[column] = raw[column].to_numpy(dtype=float) * factors
+        if "Volume" in raw:
+            raw["Volume"] = raw["Volume"].to_numpy(dtype=float) / factors
+        return raw
+
+    # 复权
+    def _adjustment(self, symbol: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """返回 (事件日期, 价格因子后缀积, 成交量因子后缀积)，按事件和存储版本缓存"""
+        store = get_market_store()
+        version, events = self._load(symbol)
+        key = (version, store.version(symbol))
+        with self._lock:
+            cached = self._factors.get(symbol)
+            if cached is not None and cached[0] == key:
+                return cached[1], cached[2], cached[3]
+
+        dates = events["date"].to_numpy()
+        price_factors = np.ones(len(events))
+        volume_factors = np.ones(len(events))
+        for i, (date, action_type, value) in enumerate(zip(dates, events["action_type"], events["value"])):
+            if action_type == SPLIT and value > 0:
+                price_factors[i] = 1.0 / value
+                volume_factors[i] = value
+            elif action_type == DIVIDEND:
+                # 以除息日前一个交易日的原始收盘价计算分红因子
+                previous = store.read(symbol, pd.Timestamp(date) - timedelta(days=14), pd.Timestamp(date) - timedelta(microseconds=1), ["close"])["close"]
+                if len(previous) and previous[-1] > value:
+                    price_factors[i] = 1.0 - value / previous[-1]
+
+        price_suffix = np.append(np.cumprod(price_factors[::-1])[::-1], 1.0)
+        volume_suffix = np.append(np.cumprod(volume_factors[::-1])[::-1], 1.0)
+        with self._lock:
+            self._factors[symbol] = (key, dates, price_suffix, volume_suffix)
+        return dates, price_suffix, volume_suffix
+
+    def adjust(self, symbol: str, frame: pd.DataFrame) -> pd.DataFrame:
+        """对原始行情做前复权：每根K线乘以其后所有事件因子的乘积"""
+        if frame.empty:
+            return frame
+        event_dates, price_suffix, volume_suffix = self._adjustment(symbol.upper())
+        if not len(event_dates):
+            return frame
+
+        positions = np.searchsorted(event_dates, frame.index.to_numpy(dtype="datetime64[ns]"), side="right")
+        adjusted = frame.copy()
+        for column in PRICE_COLUMNS:
+            if column in adjusted:
+                adjusted[column] = adjusted[column].to_numpy(dtype=float) * price_suffix[positions]
+        if "Volume" in adjusted:
+            adjusted["Volume"] = adjusted["Volume"].to_numpy(dtype=float) * volume_suffix[positions]
+        return adjusted
+
+
+corporate_actions = CorporateActionBook()
+
+
+def read_frame(
+    symbol: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    columns: Optional[List[str]] = None,
+    adjusted: bool = True,
+    limit: Optional[int] = None
+) -> pd.DataFrame:
+    """从本地存储读取行情，adjusted 为 True 时返回前复权数据"""
+    frame = get_market_store().read_frame(symbol, start, end, columns=columns, limit=limit)
+    return corporate_actions.adjust(symbol, frame) if adjusted else frame
+
+
+def data_version(symbol: str) -> Tuple[int, int]:
+    """(存储版本, 公司行为版本)，任一变化都意味着复权后的数据可能改变"""
+    return get_market_store().version(symbol), corporate_actions.version(symbol)
@@ -0,0 +1,219 @@
+"""
+收益率相关系数与协方差矩阵
+
+多只股票的前复权收盘价按共同交易日对齐后计算日收益率，取最近 window 个收益率，
+用 ΣR 和 ΣRᵀR 一次得到协方差矩阵，再换算为相关系数矩阵。
+
+结果按 (股票列表, 窗口, 截止日期) 缓存：
+- 指定截止日期的历史窗口按数据版本判断是否过期，过期时整体重算
+- 不指定截止日期时维护最新窗口的累加和；有新K线时减去被改动和移出窗口的行、加上新行，
+  不需要重新读取整个窗口。公司行为变化或改动早于窗口时整体重算，累计更新 window 次后也整体重算以消除浮点误差
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .. import config
+from .corporate_actions import data_version, read_frame
+from .market_store import get_market_store
+
+Key = Tuple[Tuple[str, ...], int]
+
+
+def lookback_days(window: int) -> int:
+    """window 个交易日收益率所需的自然日数（考虑周末和节假日）"""
+    return int(window * 1.5) + 30
+
+
+def aligned_closes(symbols: List[str], start: Optional[datetime], end: Optional[datetime]) -> pd.DataFrame:
+    """各股票的前复权收盘价，只保留所有股票都有数据的交易日"""
+    closes = {symbol: read_frame(symbol, start, end, columns=["Close"])["Close"] for symbol in symbols}
+    return pd.DataFrame(closes, columns=symbols).dropna()
+
+
+@dataclass
+class _Window:
+    """窗口内的收益率及其累加和"""
+    versions: List[Tuple[int, int]]
+    dates: np.ndarray  # (T,)
+    returns: np.ndarray  # (T, N)
+    sums: np.ndarray  # (N,)
+    products: np.ndarray  # (N, N)
+    updates: int = 0
+
+    @classmethod
+    def from_returns(cls, versions: List[Tuple[int, int]], dates: np.ndarray, returns: np.ndarray) -> "_Window":
+        return cls(versions, dates, returns, returns.sum(axis=0), returns.T @ returns)
+
+
+def _returns(closes: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    values = closes.to_numpy(dtype=float)
+    returns = values[1:] / values[:-1] - 1
+    return closes.index[1:].to_numpy(dtype="datetime64[ns]"), returns
+
+
+def _matrices(window: _Window) -> Dict[str, Any]:
+    observations = len(window.dates)
+    if observations < 2:
+        raise ValueError("共同交易日不足，无法计算相关系数")
+    mean = window.sums / observations
+    covariance = (window.products - observations * np.outer(mean, mean)) / (observations - 1)
+    volatility = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = np.clip(covariance / np.outer(volatility, volatility), -1.0, 1.0)
+    np.fill_diagonal(correlation, np.where(volatility > 0, 1.0, np.nan))
+    return {
+        "start_date": pd.Timestamp(window.dates[0]).strftime("%Y-%m-%d"),
+        "end_date": pd.Timestamp(window.dates[-1]).strftime("%Y-%m-%d"),
+        "observations": observations,
+        "correlation": correlation,
+        "covariance": covariance,
+        # 年化波动率
+        "volatility": volatility * np.sqrt(252),
+    }
+
+
+class CorrelationCache:
+    def __init__(self, max_size: int = config.CORRELATION_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # 最新窗口：(股票列表, 窗口) -> 累加状态
+        self._latest: "OrderedDict[Key, _Window]" = OrderedDict()
+        # 历史窗口：(股票列表, 窗口, 截止日期) -> (数据版本, 结果)
+        self._history: "OrderedDict[Tuple[Tuple[str, ...], int, str], Tuple[List[Tuple[int, int]], Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.incremental_updates = 0
+        self.full_rebuilds = 0
+
+    def get(self, symbols: List[str], window: int, end: Optional[datetime] = None) -> Dict[str, Any]:
+        """返回相关系数、协方差矩阵和年化波动率，调用方需先确保行情数据已补齐"""
+        symbols = tuple(symbol.upper() for symbol in symbols)
+        # 先取版本号再读数据，读取期间发生的写入会在下次请求时重新处理
+        versions = [data_version(symbol) for symbol in symbols]
+        if end is not None:
+            return self._get_history(symbols, window, end, versions)
+
+        key = (symbols, window)
+        with self._lock:
+            state = self._latest.get(key)
+            if state is not None:
+                self._latest.move_to_end(key)
+
+        if state is not None and state.versions == versions:
+            self.hits += 1
+        else:
+            updated = self._update(symbols, window, state, versions) if state is not None else None
+            if updated is None:
+                self.full_rebuilds += 1
+                updated = self._build(symbols, window, None, versions)
+            else:
+                self.incremental_updates += 1
+            state = updated
+            self._store(self._latest, key, state)
+        return _matrices(state)
+
+    def _get_history(
+        self,
+        symbols: Tuple[str, ...],
+        window: int,
+        end: datetime,
+        versions: List[Tuple[int, int]]
+    ) -> Dict[str, Any]:
+        key = (symbols, window, end.strftime("%Y-%m-%d"))
+        with self._lock:
+            entry = self._history.get(key)
+            if entry is not None:
+                self._history.move_to_end(key)
+        if entry is not None and entry[0] == versions:
+            self.hits += 1
+            return entry[1]
+
+        self.full_rebuilds += 1
+        result = _matrices(self._build(symbols, window, end, versions))
+        self._store(self._history, key, (versions, result))
+        return result
+
+    def _store(self, entries: OrderedDict, key, value):
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_size:
+                entries.popitem(last=False)
+
+    @staticmethod
+    def _build(symbols: Tuple[str, ...], window: int, end: Optional[datetime], versions: List[Tuple[int, int]]) -> _Window:
+        last = end if end is not None else datetime.now()
+        closes = aligned_closes(list(symbols), last - timedelta(days=lookback_days(window)), end)
+        dates, returns = _returns(closes.iloc[-(window + 1):])
+        return _Window.from_returns(versions, dates, returns)
+
+    @staticmethod
+    def _update(
+        symbols: Tuple[str, ...],
+        window: int,
+        state: _Window,
+        versions: List[Tuple[int, int]]
+    ) -> Optional[_Window]:
+        """按改动的最早日期更新窗口；无法增量更新时返回 None"""
+        # 新的公司行为会改变此前所有K线的复权价格
+        if any(old[1] != new[1] for old, new in zip(state.versions, versions)):
+            return None
+        if state.updates >= window:
+            return None
+
+        store = get_market_store()
+        changed = datetime.max
+        for symbol, old in zip(symbols, state.versions):
+            symbol_changed = store.changed_since(symbol, old[0])
+            if symbol_changed is None:
+                return None
+            changed = min(changed, symbol_changed)
+        if changed == datetime.max:
+            return _Window(versions, state.dates, state.returns, state.sums, state.products, state.updates)
+
+        # 改动日期及之后的收益率需要重算，之前的不变；保留的最后一天作为计算下一个收益率的基准
+        kept = int(np.searchsorted(state.dates, np.datetime64(pd.Timestamp(changed)), side="left"))
+        if kept == 0:
+            return None
+        removed = state.returns[kept:]
+        base_date = pd.Timestamp(state.dates[kept - 1]).to_pydatetime()
+        new_dates, added = _returns(aligned_closes(list(symbols), base_date, None))
+
+        dates = np.concatenate([state.dates[:kept], new_dates])
+        returns = np.concatenate([state.returns[:kept], added])
+        sums = state.sums - removed.sum(axis=0) + added.sum(axis=0)
+        products = state.products - removed.T @ removed + added.T @ added
+
+        # 移出窗口最前面的行
+        excess = len(dates) - window
+        if excess > 0:
+            dropped = returns[:excess]
+            sums = sums - dropped.sum(axis=0)
+            products = products - dropped.T @ dropped
+            dates, returns = dates[excess:], returns[excess:]
+        elif len(dates) < min(window, len(state.dates)):
+            return None
+        return _Window(versions, dates, returns, sums, products, state.updates + 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "latest": len(self._latest),
+            "history": len(self._history),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "incremental_updates": self.incremental_updates,
+            "full_rebuilds": self.full_rebuilds,
+        }
+
+
+correlation_cache = CorrelationCache()
+
+
+def matrix_to_list(matrix: np.ndarray) -> List:
+    """NaN 输出为 null"""
+    return [[None if np.isnan(value) else float(value) for value in row] for row in np.atleast_2d(matrix)]
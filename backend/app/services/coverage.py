@@ -0,0 +1,74 @@
+"""
+行情数据覆盖范围索引，以合并后的日期区间集合记录已缓存的数据范围
+"""
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Tuple, Union
+
+DateLike = Union[date, datetime, str]
+
+ONE_DAY = timedelta(days=1)
+
+
+def _to_date(value: DateLike) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class IntervalSet:
+    """按天计的闭区间集合，插入时自动合并重叠或相邻的区间"""
+
+    def __init__(self, intervals: Optional[Iterable[Tuple[DateLike, DateLike]]] = None):
+        self._starts: List[date] = []
+        self._ends: List[date] = []
+        for start, end in intervals or []:
+            self.add(start, end)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self):
+        return iter(zip(self._starts, self._ends))
+
+    def add(self, start: DateLike, end: DateLike):
+        start, end = _to_date(start), _to_date(end)
+        if end < start:
+            return
+
+        # 找到所有与 [start-1, end+1] 相交的区间并合并
+        i = bisect_left(self._ends, start - ONE_DAY)
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end + ONE_DAY:
+            start = min(start, self._starts[j])
+            end = max(end, self._ends[j])
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def contains(self, start: DateLike, end: DateLike) -> bool:
+        return not self.missing(start, end)
+
+    def missing(self, start: DateLike, end: DateLike) -> List[Tuple[date, date]]:
+        """返回 [start, end] 中尚未覆盖的子区间"""
+        start, end = _to_date(start), _to_date(end)
+        gaps = []
+        cursor = start
+        i = bisect_left(self._ends, start)
+        while cursor <= end and i < len(self._starts):
+            if self._starts[i] > cursor:
+                gaps.append((cursor, min(end, self._starts[i] - ONE_DAY)))
+            cursor = max(cursor, self._ends[i] + ONE_DAY)
+            i += 1
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def to_list(self) -> List[List[str]]:
+        return [[start.isoformat(), end.isoformat()] for start, end in self]
+
+    @classmethod
+    def from_list(cls, items: Iterable[Iterable[str]]) -> "IntervalSet":
+        return cls((start, end) for start, end in items)
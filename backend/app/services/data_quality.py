@@ -0,0 +1,246 @@
+"""
+行情数据质量校验
+
+数据源返回的每批K线在写入前整体校验，检查都是数组运算：
+    可修复的问题   开高低价缺失、最高价低于最低价、开收盘价超出高低区间、成交量为负、日期重复
+    隔离的问题     收盘价缺失或非正、收盘价相对前几根K线的中位数偏离超过 DATA_QUALITY_SPIKE_RATIO 倍
+    仅标记的问题   成交量为 0（停牌等）
+修复后的K线照常写入并记录标记；被隔离的K线不写入存储，原始数值保存在 market_data_quality 表中。
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .. import config, crud, schemas
+from .corporate_actions import SPLIT, corporate_actions
+from .market_store import get_market_store
+
+# 质量标记（按位组合）
+MISSING_VALUE = 1  # 开高低价缺失，已用收盘价补齐
+OHLC_INCONSISTENT = 2  # 最高价低于最低价或开收盘价超出高低区间，已修正
+ZERO_VOLUME = 4  # 成交量为 0
+NEGATIVE_VOLUME = 8  # 成交量为负，已置为 0
+INVALID_CLOSE = 16  # 收盘价缺失或非正
+PRICE_SPIKE = 32  # 收盘价异常跳变
+DUPLICATE_DATE = 64  # 同一日期有多条，保留最后一条
+
+FLAG_NAMES = {
+    MISSING_VALUE: "missing_value",
+    OHLC_INCONSISTENT: "ohlc_inconsistent",
+    ZERO_VOLUME: "zero_volume",
+    NEGATIVE_VOLUME: "negative_volume",
+    INVALID_CLOSE: "invalid_close",
+    PRICE_SPIKE: "price_spike",
+    DUPLICATE_DATE: "duplicate_date",
+}
+
+QUARANTINE_FLAGS = INVALID_CLOSE | PRICE_SPIKE
+REPAIR_FLAGS = MISSING_VALUE | OHLC_INCONSISTENT | NEGATIVE_VOLUME | DUPLICATE_DATE
+WARNING_FLAGS = ZERO_VOLUME
+
+# 计算质量分时各类问题的扣分权重
+QUARANTINE_PENALTY = 1.0
+REPAIR_PENALTY = 0.5
+WARNING_PENALTY = 0.1
+
+# 异常跳变的参考价：此前最多 SPIKE_REFERENCE_BARS 根K线收盘价的中位数
+SPIKE_REFERENCE_BARS = 5
+
+
+def flag_names(flags: int) -> List[str]:
+    return [name for flag, name in FLAG_NAMES.items() if flags & flag]
+
+
+@dataclass
+class ValidationResult:
+    clean: pd.DataFrame  # 通过校验（可能已修复）的K线
+    flags: np.ndarray  # clean 中每根K线的质量标记
+    quarantined: pd.DataFrame  # 被隔离的原始K线
+    quarantined_flags: np.ndarray
+
+    @property
+    def checked(self) -> int:
+        return len(self.clean) + len(self.quarantined)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "checked": self.checked,
+            "repaired": int(np.count_nonzero(self.flags & REPAIR_FLAGS)),
+            "warnings": int(np.count_nonzero(self.flags & WARNING_FLAGS)),
+            "quarantined": len(self.quarantined),
+        }
+
+
+def validate_bars(
+    frame: pd.DataFrame,
+    previous_closes: Optional[np.ndarray] = None,
+    split_dates: Optional[np.ndarray] = None,
+    spike_ratio: float = config.DATA_QUALITY_SPIKE_RATIO
+) -> ValidationResult:
+    """
+    校验一批K线（列为 Open/High/Low/Close/Volume）。
+    previous_closes 是本批之前已存储的最近几根收盘价，用作开头几根K线的跳变参考；
+    参考区间内有拆股时不做跳变检查，避免把除权前后的价格差当作异常。
+    """
+    if frame is None or frame.empty:
+        empty = np.zeros(0, dtype=np.int64)
+        return ValidationResult(frame, empty, frame, empty)
+
+    index = pd.DatetimeIndex(frame.index)
+    naive = (index.tz_localize(None) if index.tz is not None else index).to_numpy(dtype="datetime64[ns]")
+    order = np.argsort(naive, kind="stable")
+    frame, naive = frame.iloc[order], naive[order]
+
+    # 重复日期保留最后一条
+    last_of_date = np.append(naive[1:] != naive[:-1], True)
+    duplicated = np.zeros(len(naive), dtype=bool)
+    duplicated[:-1] = naive[1:] == naive[:-1]
+    has_duplicate = np.zeros(len(naive), dtype=bool)
+    has_duplicate[1:] = duplicated[:-1]
+    frame, naive, has_duplicate = frame[last_of_date], naive[last_of_date], has_duplicate[last_of_date]
+
+    opens = frame["Open"].to_numpy(dtype=float).copy()
+    highs = frame["High"].to_numpy(dtype=float).copy()
+    lows = frame["Low"].to_numpy(dtype=float).copy()
+    closes = frame["Close"].to_numpy(dtype=float)
+    volumes = frame["Volume"].to_numpy(dtype=float).copy()
+    flags = np.where(has_duplicate, DUPLICATE_DATE, 0).astype(np.int64)
+
+    invalid_close = ~np.isfinite(closes) | (closes <= 0)
+    flags[invalid_close] |= INVALID_CLOSE
+
+    # 开高低价缺失时用收盘价补齐
+    missing = ~np.isfinite(opens) | ~np.isfinite(highs) | ~np.isfinite(lows)
+    flags[missing & ~invalid_close] |= MISSING_VALUE
+    opens = np.where(np.isfinite(opens), opens, closes)
+    highs = np.where(np.isfinite(highs), highs, np.maximum(opens, closes))
+    lows = np.where(np.isfinite(lows), lows, np.minimum(opens, closes))
+
+    # 高低价颠倒或开收盘价超出区间时，以四个价格的最大最小值作为高低价
+    inconsistent = (highs < lows) | (opens > highs) | (opens < lows) | (closes > highs) | (closes < lows)
+    flags[inconsistent & ~invalid_close] |= OHLC_INCONSISTENT
+    stacked = np.vstack([opens, highs, lows, closes])
+    highs = np.where(inconsistent, np.nanmax(stacked, axis=0), highs)
+    lows = np.where(inconsistent, np.nanmin(stacked, axis=0), lows)
+
+    volumes = np.where(np.isfinite(volumes), volumes, 0.0)
+    flags[volumes < 0] |= NEGATIVE_VOLUME
+    flags[volumes == 0] |= ZERO_VOLUME
+    volumes = np.maximum(volumes, 0.0)
+
+    # 异常跳变：与此前几根有效收盘价的中位数比较
+    previous_closes = np.asarray(previous_closes if previous_closes is not None else [], dtype=float)
+    reference_closes = np.concatenate([previous_closes[-SPIKE_REFERENCE_BARS:], np.where(invalid_close, np.nan, closes)])
+    reference = (
+        pd.Series(reference_closes)
+        .rolling(SPIKE_REFERENCE_BARS, min_periods=1)
+        .median()
+        .shift(1)
+        .to_numpy()[len(reference_closes) - len(closes):]
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = closes / reference
+    spike = np.isfinite(ratio) & ((ratio > spike_ratio) | (ratio < 1.0 / spike_ratio))
+    if split_dates is not None and len(split_dates) and spike.any():
+        # 参考区间（约前 SPIKE_REFERENCE_BARS 根K线）内有拆股的不算跳变
+        window_start = np.concatenate([np.full(SPIKE_REFERENCE_BARS, naive[0]), naive])[:len(naive)]
+        splits = np.sort(np.asarray(split_dates, dtype="datetime64[ns]"))
+        spike &= np.searchsorted(splits, naive, side="right") == np.searchsorted(splits, window_start, side="right")
+    flags[spike & ~invalid_close] |= PRICE_SPIKE
+
+    quarantined = (flags & QUARANTINE_FLAGS) != 0
+    clean = pd.DataFrame(
+        {"Open": opens, "High": highs, "Low": lows, "Close": closes, "Volume": volumes},
+        index=frame.index,
+    )
+    return ValidationResult(
+        clean=clean[~quarantined],
+        flags=flags[~quarantined],
+        quarantined=frame[quarantined],
+        quarantined_flags=flags[quarantined],
+    )
+
+
+def quality_score(bars: int, repaired: int, warnings: int, quarantined: int) -> float:
+    """0 到 1 的质量分，按问题严重程度加权扣分"""
+    total = bars + quarantined
+    if total == 0:
+        return 1.0
+    penalty = quarantined * QUARANTINE_PENALTY + repaired * REPAIR_PENALTY + warnings * WARNING_PENALTY
+    return max(0.0, 1.0 - penalty / total)
+
+
+def validate_batch(symbol: str, frame: pd.DataFrame) -> ValidationResult:
+    """以本地存储中本批之前的收盘价和已知的拆股日期为参考校验一批原始K线"""
+    if frame is None or frame.empty:
+        return validate_bars(frame)
+    index = pd.DatetimeIndex(frame.index)
+    first = (index.tz_localize(None) if index.tz is not None else index).min()
+    # 前 SPIKE_REFERENCE_BARS 根K线，按自然日多取一些
+    previous = get_market_store().read(
+        symbol, first - timedelta(days=SPIKE_REFERENCE_BARS * 3 + 10), first - timedelta(microseconds=1), ["close"]
+    )["close"]
+    events = corporate_actions.events(symbol)
+    split_dates = events.loc[events["action_type"] == SPLIT, "date"].to_numpy()
+    return validate_bars(frame, np.asarray(previous), split_dates)
+
+
+def save_validation_result(db: Session, symbol: str, frame: pd.DataFrame, result: ValidationResult):
+    """用本批的校验结果替换该区间原有的质量记录，只保存有标记的K线"""
+    if frame is None or frame.empty:
+        return
+    index = pd.DatetimeIndex(frame.index)
+    index = index.tz_localize(None) if index.tz is not None else index
+    flagged = result.clean[result.flags != 0]
+    rows = []
+    for bars, flags, quarantined in (
+        (flagged, result.flags[result.flags != 0], False),
+        (result.quarantined, result.quarantined_flags, True),
+    ):
+        if bars.empty:
+            continue
+        dates = pd.DatetimeIndex(bars.index)
+        dates = dates.tz_localize(None) if dates.tz is not None else dates
+        for date, flag, open_, high, low, close, volume in zip(
+            dates.to_pydatetime(), flags.tolist(),
+            *(bars[column].to_numpy(dtype=float).tolist() for column in ["Open", "High", "Low", "Close", "Volume"])
+        ):
+            rows.append({
+                "symbol": symbol, "date": date, "flags": flag, "quarantined": quarantined,
+                "open": _nullable(open_), "high": _nullable(high), "low": _nullable(low),
+                "close": _nullable(close), "volume": _nullable(volume),
+            })
+    crud.replace_market_data_quality(db, symbol, index.min().to_pydatetime(), index.max().to_pydatetime(), rows)
+
+
+def _nullable(value: float) -> Optional[float]:
+    return value if np.isfinite(value) else None
+
+
+def quality_report(db: Session, symbols: List[str]) -> List[schemas.DataQualityReport]:
+    """每只股票的K线数、各类问题数和质量分"""
+    store = get_market_store()
+    bars = {symbol: sum(len(chunk["date"]) for chunk in store.iter_chunks(symbol, columns=["close"])) for symbol in symbols}
+    counts = {symbol: {"repaired": 0, "warnings": 0, "quarantined": 0} for symbol in symbols}
+    for symbol, flags, quarantined, count in crud.get_market_data_quality_counts(db, symbols):
+        if quarantined:
+            counts[symbol]["quarantined"] += count
+            continue
+        if flags & REPAIR_FLAGS:
+            counts[symbol]["repaired"] += count
+        if flags & WARNING_FLAGS:
+            counts[symbol]["warnings"] += count
+
+    return [
+        schemas.DataQualityReport(
+            symbol=symbol,
+            bars=bars.get(symbol, 0),
+            **counts[symbol],
+            score=round(quality_score(bars.get(symbol, 0), **counts[symbol]), 4),
+        )
+        for symbol in symbols
+    ]
@@ -0,0 +1,67 @@
+"""
+条件请求（ETag / If-None-Match）
+
+行情类接口的 ETag 由请求参数和数据版本（存储版本、公司行为版本）计算，
+请求的区间已全部在本地存储中时，不读取数据、不序列化即可判断客户端的缓存是否仍然有效并返回 304。
+"""
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+from fastapi import Request, Response
+
+# 客户端可以缓存，但每次使用前需要用 ETag 重新验证
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    """由参数计算强 ETag"""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    return f'"{digest}"'
+
+
+def content_etag(prefix: Iterable[Any], columns: Dict[str, np.ndarray]) -> str:
+    """没有数据版本可用时（如直接来自数据源的分钟线），由数据内容计算 ETag"""
+    digest = hashlib.sha1(repr(tuple(prefix)).encode("utf-8"))
+    for name, values in columns.items():
+        digest.update(name.encode("utf-8"))
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return f'"{digest.hexdigest()}"'
+
+
+def bar_range(start: datetime, end: datetime) -> Tuple[str, str]:
+    """
+    日线K线的时间都是零点，区间 [start, end] 实际包含的是 start 向上取整到 end 向下取整之间的交易日；
+    按日期归一化后，默认截止到当前时间的请求在一天之内得到相同的 ETag
+    """
+    first = pd.Timestamp(start).ceil("D")
+    last = pd.Timestamp(end).floor("D")
+    return first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d")
+
+
+def matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否包含 etag（按弱比较，忽略 W/ 前缀）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
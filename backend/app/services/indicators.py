@@ -0,0 +1,283 @@
+"""
+技术指标计算与缓存
+
+指标名由类型和窗口组成，如 rsi14、sma50、ema20、bb20、atr14、macd。
+计算结果覆盖本地存储中的全部历史，按 (股票, 指标) 缓存，并以存储和公司行为的版本号判断是否过期：
+- 滚动窗口指标（sma、bb）在追加新K线时只重新计算受影响的尾部，往前多取 window-1 根作为预热
+- 递归平滑指标（ema、rsi、macd、atr）同时缓存平滑的中间状态，追加新K线时从改动前一根K线的状态继续递推
+指标基于前复权价格计算，回测和接口共用同一个缓存。
+"""
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from ta.trend import SMAIndicator
+from ta.volatility import BollingerBands
+
+from .. import config
+from .corporate_actions import data_version, read_frame
+from .market_store import get_market_store
+
+INDICATOR_PATTERN = re.compile(r"^([a-z]+)(\d*)$")
+
+
+# 指标计算结果：(指标列, 递归指标的中间状态列)
+Computed = Tuple[pd.DataFrame, Optional[pd.DataFrame]]
+
+
+@dataclass(frozen=True)
+class IndicatorSpec:
+    """指标定义"""
+    name: str
+    kind: str
+    window: int
+    columns: Tuple[str, ...]
+    rolling: bool
+
+    def compute(self, frame: pd.DataFrame, seed: Optional[pd.Series] = None, start: int = 0) -> Computed:
+        """计算指标；递归指标给定 seed 时，frame 的第一行是已计算过的K线，seed 是该行的中间状态，
+        start 是该行在全部历史中的位置，用于确定预热期"""
+        return _INDICATORS[self.kind][3](frame, self, seed, start)
+
+
+def _sma(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    return pd.DataFrame({spec.name: SMAIndicator(frame["Close"], spec.window).sma_indicator()}), None
+
+
+def _bollinger(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    bands = BollingerBands(frame["Close"], spec.window)
+    return pd.DataFrame({
+        f"{spec.name}_upper": bands.bollinger_hband(),
+        f"{spec.name}_middle": bands.bollinger_mavg(),
+        f"{spec.name}_lower": bands.bollinger_lband(),
+    }), None
+
+
+# 递归指标与 ta 库的算法一致（adjust=False 的指数平滑），但保留未屏蔽预热期的平滑值作为中间状态
+
+def _smooth(series: pd.Series, seed: Optional[pd.Series], column: str, **kwargs) -> pd.Series:
+    """指数平滑；给定 seed 时第一个值替换为上一次计算的平滑值，从它继续递推"""
+    if seed is not None:
+        series = pd.Series(np.concatenate(([seed[column]], series.to_numpy()[1:])), index=series.index)
+    return series.ewm(adjust=False, **kwargs).mean()
+
+
+def _warm(frame: pd.DataFrame, start: int, bars: int) -> np.ndarray:
+    """frame 中每行在全部历史中是否已度过 bars 根K线的预热期"""
+    return np.arange(start, start + len(frame)) >= bars - 1
+
+
+def _ema(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    ema = _smooth(frame["Close"], seed, "ema", span=spec.window)
+    return pd.DataFrame({spec.name: ema.where(_warm(frame, start, spec.window))}), pd.DataFrame({"ema": ema})
+
+
+def _rsi(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    diff = frame["Close"].diff()
+    up = _smooth(diff.where(diff > 0, 0.0), seed, "up", alpha=1 / spec.window)
+    down = _smooth(-diff.where(diff < 0, 0.0), seed, "down", alpha=1 / spec.window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = pd.Series(np.where(down == 0, 100, 100 - 100 / (1 + up / down)), index=frame.index)
+    return pd.DataFrame({spec.name: rsi.where(_warm(frame, start, spec.window))}), pd.DataFrame({"up": up, "down": down})
+
+
+# MACD 固定参数
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+
+
+def _macd(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    fast = _smooth(frame["Close"], seed, "fast", span=MACD_FAST)
+    slow = _smooth(frame["Close"], seed, "slow", span=MACD_SLOW)
+    macd = (fast - slow).where(_warm(frame, start, MACD_SLOW))
+    # 信号线从第一个有效的 MACD 值开始平滑
+    signal = _smooth(macd, seed, "signal", span=MACD_SIGNAL)
+    signal_value = signal.where(_warm(frame, start, MACD_SLOW + MACD_SIGNAL - 1))
+    return pd.DataFrame({
+        spec.name: macd,
+        f"{spec.name}_signal": signal_value,
+        f"{spec.name}_diff": macd - signal_value,
+    }), pd.DataFrame({"fast": fast, "slow": slow, "signal": signal})
+
+
+def _atr(frame: pd.DataFrame, spec: IndicatorSpec, seed: Optional[pd.Series], start: int) -> Computed:
+    close = frame["Close"]
+    true_range = pd.concat(
+        [frame["High"] - frame["Low"], (frame["High"] - close.shift()).abs(), (frame["Low"] - close.shift()).abs()],
+        axis=1,
+    ).max(axis=1)
+    # 第 window 根K线取前 window 根真实波幅的均值，之后按 1/window 递推
+    warm = _warm(frame, start, spec.window)
+    atr = pd.Series(np.nan, index=frame.index)
+    if seed is None and len(frame) >= spec.window:
+        true_range.iloc[spec.window - 1] = true_range.iloc[:spec.window].mean()
+    if seed is not None or len(frame) >= spec.window:
+        atr[warm] = _smooth(true_range[warm], seed, "atr", alpha=1 / spec.window)
+    return pd.DataFrame({spec.name: atr.fillna(0.0)}), pd.DataFrame({"atr": atr})
+
+
+# 指标类型 -> (默认窗口, 所需字段, 是否为滚动窗口指标, 计算函数)
+_INDICATORS: Dict[str, Tuple[int, Tuple[str, ...], bool, Callable]] = {
+    "sma": (20, ("Close",), True, _sma),
+    "ema": (20, ("Close",), False, _ema),
+    "rsi": (14, ("Close",), False, _rsi),
+    "macd": (MACD_SLOW, ("Close",), False, _macd),
+    "bb": (20, ("Close",), True, _bollinger),
+    "atr": (14, ("High", "Low", "Close"), False, _atr),
+}
+
+
+def parse_indicator(name: str) -> IndicatorSpec:
+    """解析指标名，如 rsi14 -> RSI(14)，无法识别时抛出 ValueError"""
+    name = name.strip().lower()
+    match = INDICATOR_PATTERN.match(name)
+    if not match or match.group(1) not in _INDICATORS:
+        raise ValueError(f"不支持的指标: {name}，可选: {', '.join(_INDICATORS)}")
+    kind, window = match.group(1), match.group(2)
+    default_window, columns, rolling, _ = _INDICATORS[kind]
+    if kind == "macd" and window:
+        raise ValueError("macd 使用固定参数 (12, 26, 9)，不需要窗口")
+    window = int(window) if window else default_window
+    if window <= 0 or window > 1000:
+        raise ValueError(f"指标窗口超出范围: {name}")
+    return IndicatorSpec(name=f"{kind}{window}" if kind != "macd" else kind, kind=kind, window=window, columns=columns, rolling=rolling)
+
+
+def parse_indicators(names: List[str]) -> List[IndicatorSpec]:
+    specs = {}
+    for name in names:
+        if name and name.strip():
+            spec = parse_indicator(name)
+            specs.setdefault(spec.name, spec)
+    return list(specs.values())
+
+
+# 缓存条目：(数据版本, 指标列, 递归指标的中间状态列)
+CacheEntry = Tuple[Tuple[int, int], pd.DataFrame, Optional[pd.DataFrame]]
+
+
+class IndicatorCache:
+    """按 (股票, 指标) 缓存全部历史的指标序列，LRU 限制条目数"""
+
+    def __init__(self, max_size: int = config.INDICATOR_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.incremental_updates = 0
+        self.full_rebuilds = 0
+
+    def get(self, symbol: str, spec: IndicatorSpec) -> pd.DataFrame:
+        symbol = symbol.upper()
+        key = (symbol, spec.name)
+        # 先取版本号再读数据，读取期间发生的写入会在下次请求时重新处理
+        version = data_version(symbol)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        computed = None
+        if entry is not None:
+            computed = self._update(symbol, spec, entry, version)
+        if computed is None:
+            self.full_rebuilds += 1
+            computed = spec.compute(read_frame(symbol, columns=list(spec.columns)))
+        values, state = computed
+
+        with self._lock:
+            self._entries[key] = (version, values, state)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return values
+
+    def _update(
+        self,
+        symbol: str,
+        spec: IndicatorSpec,
+        entry: CacheEntry,
+        version: Tuple[int, int]
+    ) -> Optional[Computed]:
+        """只重新计算改动日期之后的部分；无法增量更新时返回 None"""
+        cached_version, values, state = entry
+        # 新的公司行为会改变此前所有K线的复权价格
+        if cached_version[1] != version[1]:
+            return None
+        changed = get_market_store().changed_since(symbol, cached_version[0])
+        if changed is None:
+            return None
+        if changed == datetime.max:
+            return values, state
+
+        position = int(values.index.searchsorted(pd.Timestamp(changed)))
+        if position == 0:
+            return None
+        if spec.rolling:
+            # 改动之前的数据不变，往前取 window-1 根K线作为滚动窗口的预热
+            warmup_start = values.index[max(position - spec.window + 1, 0)]
+            tail, _ = spec.compute(read_frame(symbol, warmup_start.to_pydatetime(), columns=list(spec.columns)))
+            self.incremental_updates += 1
+            return pd.concat([values.iloc[:position], tail[tail.index >= pd.Timestamp(changed)]]), None
+
+        # 递归指标从改动前一根K线的中间状态继续递推，预热期内的状态不完整时整体重算
+        seed = state.iloc[position - 1]
+        if seed.isna().any():
+            return None
+        previous = values.index[position - 1]
+        frame = read_frame(symbol, previous.to_pydatetime(), columns=list(spec.columns))
+        if frame.empty or frame.index[0] != previous:
+            return None
+        tail, tail_state = spec.compute(frame, seed, position - 1)
+        self.incremental_updates += 1
+        return (
+            pd.concat([values.iloc[:position], tail.iloc[1:]]),
+            pd.concat([state.iloc[:position], tail_state.iloc[1:]]),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "incremental_updates": self.incremental_updates,
+            "full_rebuilds": self.full_rebuilds,
+        }
+
+
+indicator_cache = IndicatorCache()
+
+
+def get_indicators(
+    symbol: str,
+    specs: List[IndicatorSpec],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> pd.DataFrame:
+    """返回 [start, end] 区间内多个指标合并后的 DataFrame，调用方需先确保行情数据已补齐"""
+    frames = [indicator_cache.get(symbol, spec) for spec in specs]
+    if not frames:
+        return pd.DataFrame()
+    result = pd.concat(frames, axis=1)
+    if start is not None:
+        result = result[result.index >= pd.Timestamp(start)]
+    if end is not None:
+        result = result[result.index <= pd.Timestamp(end)]
+    return result
+
+
+def to_columnar(frame: pd.DataFrame) -> Dict[str, List[Optional[float]]]:
+    """转为按列的 JSON 结构，预热期的 NaN 输出为 null"""
+    return {
+        column: [None if np.isnan(value) else float(value) for value in frame[column].to_numpy(dtype=float)]
+        for column in frame.columns
+    }
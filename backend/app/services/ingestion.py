@@ -0,0 +1,173 @@
+"""
+行情数据获取与写入
+
+本地存储未覆盖的区间并发地从数据源补齐，校验后写入列式存储和数据库。
+所有对数据源的历史数据请求都经过共享的令牌桶限流。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .. import config, crud
+from .corporate_actions import corporate_actions, read_frame
+from .coverage import IntervalSet
+from .data_quality import ValidationResult, save_validation_result, validate_batch
+from .latest_quotes import latest_quotes
+from .market_store import get_market_store
+from .providers import get_provider
+from .rate_limit import upstream_limiter
+
+logger = logging.getLogger(__name__)
+
+# 补齐缺失区间时的并发上游请求数
+_fetch_executor = ThreadPoolExecutor(max_workers=4)
+_symbol_locks: Dict[str, threading.Lock] = {}
+
+
+def symbol_lock(symbol: str) -> threading.Lock:
+    return _symbol_locks.setdefault(symbol.upper(), threading.Lock())
+
+
+def last_complete_day() -> datetime:
+    """当天的K线尚未收盘，覆盖范围只记到前一天"""
+    return datetime.combine(datetime.now().date(), datetime.min.time()) - timedelta(days=1)
+
+
+def load_market_data(
+    db: Session,
+    symbol: str,
+    start_date: datetime,
+    end_date: datetime,
+    columns: Optional[List[str]] = None,
+    adjusted: bool = False
+) -> pd.DataFrame:
+    """
+    读取行情数据，本地存储未覆盖的区间先从数据源补齐。
+    存储中保存未复权的原始数据，adjusted 为 True 时按公司行为前复权。
+    """
+    ensure_market_data(db, symbol, start_date, end_date)
+    return read_frame(symbol, start_date, end_date, columns=columns, adjusted=adjusted)
+
+
+def ensure_market_data(db: Session, symbol: str, start_date: datetime, end_date: datetime) -> int:
+    """
+    确保本地存储覆盖 [start_date, end_date]，返回新写入的K线数。
+    只有已收盘且K线实际写入的日期才永久记入覆盖范围；当天未收盘的K线在 INTRADAY_CACHE_TTL 内、
+    被隔离的K线所在日期在 DATA_QUALITY_RETRY_INTERVAL 内记为临时覆盖，过期后重新获取；获取失败的区间下次请求时重新获取。
+    单个区间获取失败不影响其他区间，全部处理完后再抛出第一个错误。
+    """
+    store = get_market_store()
+    written = 0
+    errors = []
+
+    # 同一股票的补齐串行执行，重叠的并发请求只会访问一次上游
+    with symbol_lock(symbol):
+        missing = store.missing_ranges(symbol, start_date, end_date)
+        if missing:
+            # 写入前需要拆股事件把数据还原为未复权价格
+            corporate_actions.sync(db, symbol)
+            futures = [_fetch_executor.submit(_fetch_gap, symbol, *gap) for gap in missing]
+
+            complete_day = last_complete_day()
+            for (gap_start, gap_end), future in zip(missing, futures):
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.warning("%s 获取 %s 至 %s 的数据失败: %s", symbol, gap_start.date(), gap_end.date(), e)
+                    errors.append(e)
+                    continue
+                quarantined = IntervalSet()
+                if data is not None:
+                    result = _write_batch(db, symbol, data)
+                    written += len(result.clean)
+                    for day in _bar_dates(result.quarantined):
+                        quarantined.add(day, day)
+                for covered_start, covered_end in quarantined.missing(gap_start, min(gap_end, complete_day)):
+                    store.add_coverage(symbol, covered_start, covered_end)
+                for attempt_start, attempt_end in quarantined:
+                    store.add_attempt(symbol, attempt_start, attempt_end, config.DATA_QUALITY_RETRY_INTERVAL)
+                if gap_end > complete_day:
+                    store.add_attempt(symbol, max(gap_start, complete_day + timedelta(days=1)), gap_end, config.INTRADAY_CACHE_TTL)
+
+    if errors:
+        raise errors[0]
+    return written
+
+
+def refresh_recent(db: Session, symbol: str, days: int) -> int:
+    """重新获取最近几天（含当天未收盘的K线）的数据，用于盘中刷新"""
+    end_date = datetime.now()
+    with symbol_lock(symbol):
+        # 新的拆股需要先同步，才能把数据还原为未复权价格
+        corporate_actions.sync(db, symbol)
+        data = _fetch_gap(symbol, end_date - timedelta(days=days), end_date)
+        return write_market_data(db, symbol, data) if data is not None else 0
+
+
+def write_market_data(db: Session, symbol: str, data: pd.DataFrame) -> int:
+    """把数据源返回的K线还原为未复权价格并校验后写入存储和数据库，被隔离的K线不写入，返回写入的K线数"""
+    return len(_write_batch(db, symbol, data).clean)
+
+
+def _write_batch(db: Session, symbol: str, data: pd.DataFrame) -> ValidationResult:
+    data = corporate_actions.to_raw(symbol, data)
+    result = validate_batch(symbol, data)
+    if len(result.quarantined):
+        logger.warning("%s 有 %d 根K线未通过校验，已隔离", symbol, len(result.quarantined))
+    save_validation_result(db, symbol, data, result)
+    if not result.clean.empty:
+        get_market_store().write(symbol, result.clean)
+        save_market_data(db, symbol, result.clean)
+        latest_quotes.update_from_bars(symbol, result.clean)
+    return result
+
+
+def _bar_dates(data: pd.DataFrame) -> List[datetime]:
+    index = pd.DatetimeIndex(data.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.to_pydatetime().tolist()
+
+
+def _fetch_gap(symbol: str, start_date: datetime, end_date: datetime) -> Optional[pd.DataFrame]:
+    """获取单个缺失区间的数据，区间内没有交易日（如周末、节假日）时返回None"""
+    try:
+        return fetch_market_data(symbol, start_date, end_date + timedelta(days=1))
+    except ValueError:
+        return None
+
+
+def save_market_data(db: Session, symbol: str, data: pd.DataFrame) -> int:
+    """将行情数据批量保存到数据库"""
+    index = pd.DatetimeIndex(data.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    rows = [
+        {"symbol": symbol, "date": date, "open": open_, "high": high, "low": low, "close": close, "volume": volume}
+        for date, open_, high, low, close, volume in zip(
+            index.to_pydatetime(),
+            data['Open'].to_numpy(dtype=float).tolist(),
+            data['High'].to_numpy(dtype=float).tolist(),
+            data['Low'].to_numpy(dtype=float).tolist(),
+            data['Close'].to_numpy(dtype=float).tolist(),
+            data['Volume'].to_numpy(dtype=float).tolist()
+        )
+    ]
+    return crud.bulk_upsert_market_data(db, rows)
+
+
+def fetch_market_data(symbol: str, start_date: datetime, end_date: datetime) -> pd.DataFrame:
+    """从配置的数据源获取市场数据，没有数据时抛出 ValueError"""
+    upstream_limiter.acquire()
+    data = get_provider().fetch_history(symbol, start_date, end_date)
+
+    if data.empty:
+        raise ValueError(f"无法获取股票数据: {symbol}")
+
+    return data
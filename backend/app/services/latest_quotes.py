@@ -0,0 +1,143 @@
+"""
+最新报价的物化视图
+
+每只股票的最新价和涨跌保存在内存字典中，读取时不访问数据源和数据库。来源有三种：
+    bar     行情写入时取本批最后一根K线
+    stream  实时推送的轮询结果
+    quote   /prices 和交易执行从数据源获取的报价
+只接受K线时间不早于当前记录的报价，回填历史数据不会覆盖更新的价格。
+更新只写内存并标记为待保存，由调度器定期批量写入 latest_quotes 表；启动时从表中加载。
+每次接受的更新会通知订阅者（如模拟交易的撮合引擎）。
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..database import SessionLocal
+from .providers import QuoteDict, quote_from_history
+
+logger = logging.getLogger(__name__)
+
+BAR = "bar"
+STREAM = "stream"
+QUOTE = "quote"
+
+# 与数据源报价相同的字段，/prices 接口按此格式返回
+QUOTE_KEYS = {"price", "change", "change_percent", "volume", "time"}
+
+
+class LatestQuotes:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._quotes: Dict[str, schemas.LatestQuote] = {}
+        self._dirty: Set[str] = set()
+        self._loaded = False
+        self._listeners: List[Callable[[schemas.LatestQuote], None]] = []
+        self.updates = 0
+        self.rejected = 0
+
+    def _load_all(self):
+        """首次使用时加载全表，之后只读内存"""
+        if self._loaded:
+            return
+        db = SessionLocal()
+        try:
+            quotes = crud.get_latest_quotes(db)
+        finally:
+            db.close()
+        with self._lock:
+            for quote in quotes:
+                # 加载期间内存中已有的报价更新
+                if quote.symbol not in self._quotes:
+                    self._quotes[quote.symbol] = schemas.LatestQuote.model_validate(quote)
+            self._loaded = True
+
+    def update(self, symbol: str, quote: QuoteDict, source: str) -> bool:
+        """写入一条报价，比当前记录旧时忽略并返回 False"""
+        symbol = symbol.upper()
+        entry = schemas.LatestQuote(
+            symbol=symbol,
+            price=quote["price"],
+            change=quote.get("change") or 0,
+            change_percent=quote.get("change_percent") or 0,
+            volume=quote.get("volume") or 0,
+            time=quote["time"],
+            source=source,
+            updated_at=datetime.utcnow(),
+        )
+        self._load_all()
+        with self._lock:
+            current = self._quotes.get(symbol)
+            if current is not None and entry.time < current.time:
+                self.rejected += 1
+                return False
+            self._quotes[symbol] = entry
+            self._dirty.add(symbol)
+            self.updates += 1
+        for listener in self._listeners:
+            try:
+                listener(entry)
+            except Exception:
+                logger.exception("处理 %s 的报价更新失败", symbol)
+        return True
+
+    def subscribe(self, listener: Callable[[schemas.LatestQuote], None]):
+        """注册报价更新的回调，在更新报价的线程中同步调用，需要很快返回"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def update_from_bars(self, symbol: str, bars: pd.DataFrame):
+        """用新写入的一批K线中最后一根更新"""
+        if bars is None or bars.empty:
+            return
+        self.update(symbol, quote_from_history(bars.sort_index()), BAR)
+
+    def get(self, symbol: str, max_age: Optional[float] = None) -> Optional[schemas.LatestQuote]:
+        """最新报价；指定 max_age（秒）时只返回在此时间内更新过的"""
+        self._load_all()
+        quote = self._quotes.get(symbol.upper())
+        if quote is None:
+            return None
+        if max_age is not None and quote.updated_at < datetime.utcnow() - timedelta(seconds=max_age):
+            return None
+        return quote
+
+    def get_many(self, symbols: Iterable[str], max_age: Optional[float] = None) -> Dict[str, schemas.LatestQuote]:
+        quotes = {symbol: self.get(symbol, max_age) for symbol in symbols}
+        return {symbol: quote for symbol, quote in quotes.items() if quote is not None}
+
+    @staticmethod
+    def as_quote(quote: schemas.LatestQuote) -> Dict[str, Any]:
+        return quote.model_dump(include=QUOTE_KEYS)
+
+    def flush(self, db: Session) -> int:
+        """把待保存的报价写入数据库"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            quotes = [self._quotes[symbol] for symbol in sorted(dirty)]
+        if not quotes:
+            return 0
+        try:
+            return crud.upsert_latest_quotes(db, quotes)
+        except Exception:
+            # 下次重试
+            with self._lock:
+                self._dirty |= dirty
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "symbols": len(self._quotes),
+                "pending": len(self._dirty),
+                "updates": self.updates,
+                "rejected": self.rejected,
+            }
+
+
+latest_quotes = LatestQuotes()
@@ -0,0 +1,326 @@
+"""
+本地列式行情存储
+
+每个股票按年份分区，每列保存为一个 .npy 文件：
+    {MARKET_DATA_DIR}/{SYMBOL}/{YEAR}/{date,open,high,low,close,volume}.npy
+读取时使用内存映射，单个分区内的切片不产生数据拷贝。
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .. import config
+from .coverage import IntervalSet
+
+# 存储的列，date 为 datetime64[ns]，其余为 float64
+STORE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+# 与 yfinance 返回的 DataFrame 列名对应
+FRAME_COLUMNS = {column: column.capitalize() for column in STORE_COLUMNS}
+
+# meta.json 中保留的写入记录条数
+CHANGE_LOG_SIZE = 64
+
+
+def _to_datetime64(value) -> np.datetime64:
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_localize(None)
+    return np.datetime64(timestamp.to_datetime64(), "ns")
+
+
+class MarketDataStore:
+    """按股票和年份分区的内存映射列式存储"""
+
+    def __init__(self, root: str = config.MARKET_DATA_DIR):
+        self.root = root
+        self._lock = threading.RLock()
+        self._partitions: Dict[Tuple[str, int], Dict[str, np.ndarray]] = {}
+
+    # 路径与元数据
+    def _symbol_dir(self, symbol: str) -> str:
+        return os.path.join(self.root, symbol.upper())
+
+    def _partition_dir(self, symbol: str, year: int) -> str:
+        return os.path.join(self._symbol_dir(symbol), str(year))
+
+    def _meta_path(self, symbol: str) -> str:
+        return os.path.join(self._symbol_dir(symbol), "meta.json")
+
+    def _read_meta(self, symbol: str) -> Dict:
+        try:
+            with open(self._meta_path(symbol)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, symbol: str, meta: Dict):
+        path = self._meta_path(symbol)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def symbols(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def years(self, symbol: str) -> List[int]:
+        path = self._symbol_dir(symbol)
+        if not os.path.isdir(path):
+            return []
+        return sorted(int(name) for name in os.listdir(path) if name.isdigit())
+
+    def version(self, symbol: str) -> int:
+        """数据版本号，每次写入递增，用于缓存失效"""
+        return self._read_meta(symbol).get("version", 0)
+
+    def changed_since(self, symbol: str, version: int) -> Optional[datetime]:
+        """version 之后的写入所改动的最早日期；没有新写入时返回 datetime.max，记录不足以判断时返回 None"""
+        meta = self._read_meta(symbol)
+        if meta.get("version", 0) <= version:
+            return datetime.max
+        changes = meta.get("changes", [])
+        if not changes or changes[0][0] > version + 1:
+            return None
+        return min(datetime.fromisoformat(changed) for changed_version, changed in changes if changed_version > version)
+
+    # 读取
+    def _load_partition(self, symbol: str, year: int) -> Optional[Dict[str, np.ndarray]]:
+        key = (symbol.upper(), year)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is not None:
+                return partition
+
+            path = self._partition_dir(symbol, year)
+            if not os.path.isdir(path):
+                return None
+            try:
+                partition = {
+                    column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+                    for column in ["date"] + STORE_COLUMNS
+                }
+            except FileNotFoundError:
+                return None
+            self._partitions[key] = partition
+            return partition
+
+    def iter_chunks(
+        self,
+        symbol: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        columns: Optional[List[str]] = None
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """按分区依次返回 [start, end] 区间内的列数据（内存映射视图），用于分页和流式读取"""
+        columns = columns or STORE_COLUMNS
+        start64 = _to_datetime64(start) if start is not None else None
+        end64 = _to_datetime64(end) if end is not None else None
+
+        for year in self.years(symbol):
+            if start is not None and year < pd.Timestamp(start).year:
+                continue
+            if end is not None and year > pd.Timestamp(end).year:
+                continue
+            partition = self._load_partition(symbol, year)
+            if partition is None:
+                continue
+
+            dates = partition["date"]
+            lo = np.searchsorted(dates, start64, side="left") if start64 is not None else 0
+            hi = np.searchsorted(dates, end64, side="right") if end64 is not None else len(dates)
+            if hi > lo:
+                yield {column: partition[column][lo:hi] for column in ["date"] + columns}
+
+    def read(
+        self,
+        symbol: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        columns: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """读取 [start, end] 区间内最多 limit 行列数据；只跨一个分区时返回内存映射视图"""
+        columns = columns or STORE_COLUMNS
+        pieces: List[Dict[str, np.ndarray]] = []
+        remaining = limit
+        for piece in self.iter_chunks(symbol, start, end, columns):
+            if remaining is not None:
+                piece = {column: values[:remaining] for column, values in piece.items()}
+                remaining -= len(piece["date"])
+            pieces.append(piece)
+            if remaining is not None and remaining <= 0:
+                break
+
+        if not pieces:
+            result = {"date": np.array([], dtype="datetime64[ns]")}
+            result.update({column: np.array([], dtype=float) for column in columns})
+            return result
+        if len(pieces) == 1:
+            return pieces[0]
+        return {column: np.concatenate([piece[column] for piece in pieces]) for column in pieces[0]}
+
+    def read_frame(
+        self,
+        symbol: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        columns: Optional[List[str]] = None,
+        limit: Optional[int] = None
+    ) -> pd.DataFrame:
+        """读取为与 yfinance 相同格式（Open/High/Low/Close/Volume）的 DataFrame"""
+        store_columns = [column.lower() for column in columns] if columns else STORE_COLUMNS
+        data = self.read(symbol, start, end, store_columns, limit=limit)
+        return self.to_frame(data, store_columns)
+
+    @staticmethod
+    def to_frame(data: Dict[str, np.ndarray], store_columns: List[str]) -> pd.DataFrame:
+        return pd.DataFrame(
+            {FRAME_COLUMNS[column]: data[column] for column in store_columns},
+            index=pd.DatetimeIndex(data["date"], name="Date"),
+        )
+
+    def date_range(self, symbol: str) -> Optional[Tuple[datetime, datetime]]:
+        years = self.years(symbol)
+        first = self._load_partition(symbol, years[0]) if years else None
+        last = self._load_partition(symbol, years[-1]) if years else None
+        if first is None or last is None or not len(first["date"]) or not len(last["date"]):
+            return None
+        return pd.Timestamp(first["date"][0]).to_pydatetime(), pd.Timestamp(last["date"][-1]).to_pydatetime()
+
+    def coverage(self, symbol: str) -> IntervalSet:
+        """已从上游获取过的日期区间；旧数据没有记录时以已存储的首尾日期为准"""
+        meta = self._read_meta(symbol)
+        if "coverage" in meta:
+            return IntervalSet.from_list(meta["coverage"])
+        stored = self.date_range(symbol)
+        return IntervalSet([stored]) if stored else IntervalSet()
+
+    def add_coverage(self, symbol: str, start: datetime, end: datetime):
+        with self._lock:
+            coverage = self.coverage(symbol)
+            coverage.add(start, end)
+            meta = self._read_meta(symbol)
+            meta["coverage"] = coverage.to_list()
+            os.makedirs(self._symbol_dir(symbol), exist_ok=True)
+            self._write_meta(symbol, meta)
+
+    def attempts(self, symbol: str) -> IntervalSet:
+        """
+        尚未过期的临时覆盖：当天未收盘的K线、被隔离的K线所在日期等获取过但不能永久记入覆盖范围的日期，
+        过期前不重新获取
+        """
+        now = datetime.utcnow().isoformat()
+        return IntervalSet(
+            (start, end) for start, end, expires_at in self._read_meta(symbol).get("attempts", []) if expires_at > now
+        )
+
+    def add_attempt(self, symbol: str, start: datetime, end: datetime, ttl: float):
+        """记录 [start, end] 已获取过，ttl 秒内不再重新获取"""
+        now = datetime.utcnow()
+        with self._lock:
+            meta = self._read_meta(symbol)
+            attempts = [attempt for attempt in meta.get("attempts", []) if attempt[2] > now.isoformat()]
+            attempts.append([
+                pd.Timestamp(start).date().isoformat(),
+                pd.Timestamp(end).date().isoformat(),
+                (now + timedelta(seconds=ttl)).isoformat(),
+            ])
+            meta["attempts"] = attempts
+            os.makedirs(self._symbol_dir(symbol), exist_ok=True)
+            self._write_meta(symbol, meta)
+
+    def missing_ranges(self, symbol: str, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        """[start, end] 中尚未从上游获取过（或临时覆盖已过期）、需要补齐的子区间"""
+        covered = self.coverage(symbol)
+        for attempt_start, attempt_end in self.attempts(symbol):
+            covered.add(attempt_start, attempt_end)
+        return [
+            (datetime.combine(gap_start, datetime.min.time()), datetime.combine(gap_end, datetime.min.time()))
+            for gap_start, gap_end in covered.missing(start, end)
+        ]
+
+    # 写入
+    def write(self, symbol: str, frame: pd.DataFrame):
+        """合并写入行情数据（列名兼容 yfinance），相同日期以新数据为准"""
+        if frame is None or frame.empty:
+            return
+
+        index = pd.DatetimeIndex(frame.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        incoming = pd.DataFrame(
+            {column: frame[FRAME_COLUMNS[column]].to_numpy(dtype=float) for column in STORE_COLUMNS},
+            index=index.astype("datetime64[ns]"),
+        )
+        incoming = incoming[~incoming.index.duplicated(keep="last")]
+
+        with self._lock:
+            meta = self._read_meta(symbol)
+            if "coverage" not in meta:
+                # 旧数据的覆盖范围按写入前的首尾日期固定下来，不能因为新写入的K线而扩大
+                meta["coverage"] = self.coverage(symbol).to_list()
+            changed = False
+            for year, part in incoming.groupby(incoming.index.year):
+                existing = self.read(symbol, datetime(year, 1, 1), datetime(year, 12, 31, 23, 59, 59))
+                if len(existing["date"]):
+                    current = pd.DataFrame(
+                        {column: np.array(existing[column]) for column in STORE_COLUMNS},
+                        index=pd.DatetimeIndex(np.array(existing["date"])),
+                    )
+                    # 重复获取的K线与已存储的完全相同时不改写分区，也不增加版本号
+                    if part.index.isin(current.index).all() and current.loc[part.index].equals(part):
+                        continue
+                    part = pd.concat([current[~current.index.isin(part.index)], part])
+                part = part.sort_index()
+                self._write_partition(symbol, int(year), part)
+                changed = True
+            if not changed:
+                return
+
+            meta["version"] = meta.get("version", 0) + 1
+            meta["updated_at"] = datetime.utcnow().isoformat()
+            # 记录每个版本改动的最早日期，派生数据据此判断能否增量更新
+            changes = meta.get("changes", []) + [[meta["version"], incoming.index[0].isoformat()]]
+            meta["changes"] = changes[-CHANGE_LOG_SIZE:]
+            self._write_meta(symbol, meta)
+
+    def _write_partition(self, symbol: str, year: int, part: pd.DataFrame):
+        path = self._partition_dir(symbol, year)
+        tmp_path = f"{path}.tmp"
+        old_path = f"{path}.old"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, "date.npy"), part.index.to_numpy(dtype="datetime64[ns]"))
+        for column in STORE_COLUMNS:
+            np.save(os.path.join(tmp_path, f"{column}.npy"), part[column].to_numpy(dtype=float))
+
+        # 先整体替换分区目录；已打开的内存映射在旧文件删除后仍然有效
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.isdir(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self._partitions.pop((symbol.upper(), year), None)
+
+
+_store: Optional[MarketDataStore] = None
+_store_lock = threading.Lock()
+
+
+def get_market_store() -> MarketDataStore:
+    """获取全局行情存储实例"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MarketDataStore()
+        return _store
@@ -0,0 +1,647 @@
+"""
+模拟交易的订单簿与撮合引擎
+
+每只股票一个订单簿，按价格优先、时间优先撮合：
+    买卖两侧各有一个有序的价格列表，每个价格档位是一个先进先出队列
+    新委托先与对手方的挂单撮合，按挂单价格成交；之后剩余部分按最新价与模拟的市场流动性成交：
+        市价单全部成交，限价单在最新价优于限价时最多成交 ORDER_BOOK_TICK_LIQUIDITY 股，其余挂入订单簿
+    止损单在最新价触及止损价时触发，止损单按市价单处理，止损限价单按限价单处理
+    行情每次更新（见 latest_quotes）时先触发止损单，再让限价优于最新价的挂单按最新价成交，
+    每侧最多成交 ORDER_BOOK_TICK_LIQUIDITY 股，超出的部分等待后续行情，形成部分成交
+同一用户的委托不互相成交：新委托遇到自己的挂单时撤销该挂单，再继续与其他挂单撮合。
+下单时冻结投资组合的资金和持仓：限价买单冻结 数量 x 限价 的现金，卖单冻结相应数量的持仓，
+现金或持仓不足时拒绝委托；市价买单和止损买单无法预知成交价，每次成交前检查可用现金，不足时撤销剩余部分。
+可用现金和持仓在内存中维护（首次用到时从数据库加载），保证写入数据库的每笔成交都能更新投资组合。
+撤单只做标记，已撤销的订单到达档位队首时才移除，撤单不需要查找档位。
+撮合全部在内存中进行，成交和委托单状态的变化交给后台线程批量写入数据库（trades、orders 和投资组合）。
+"""
+import bisect
+import heapq
+import itertools
+import logging
+import queue
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .. import config, crud, schemas
+from ..database import SessionLocal
+from .latest_quotes import latest_quotes
+from .rate_limit import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+BUY = "buy"
+SELL = "sell"
+
+MARKET = "market"
+LIMIT = "limit"
+STOP = "stop"
+STOP_LIMIT = "stop_limit"
+
+OPEN = "open"
+PARTIALLY_FILLED = "partially_filled"
+FILLED = "filled"
+CANCELED = "canceled"
+
+# 数量比较的容差
+EPSILON = 1e-9
+
+# 后台线程每次最多写入的成交数
+WRITE_BATCH_SIZE = 1000
+
+
+@dataclass(eq=False)
+class BookOrder:
+    id: int
+    user_id: int
+    portfolio_id: Optional[int]
+    symbol: str
+    side: str
+    order_type: str
+    quantity: float
+    limit_price: Optional[float] = None
+    stop_price: Optional[float] = None
+    filled: float = 0.0
+    notional: float = 0.0  # 已成交金额
+    canceled: bool = False
+    triggered: bool = False  # 止损单是否已触发
+
+    @property
+    def remaining(self) -> float:
+        return self.quantity - self.filled
+
+    @property
+    def done(self) -> bool:
+        return self.canceled or self.remaining <= EPSILON
+
+    @property
+    def status(self) -> str:
+        if self.remaining <= EPSILON:
+            return FILLED
+        if self.canceled:
+            return CANCELED
+        return PARTIALLY_FILLED if self.filled > EPSILON else OPEN
+
+    @property
+    def average_price(self) -> Optional[float]:
+        return self.notional / self.filled if self.filled > EPSILON else None
+
+    @property
+    def limit(self) -> Optional[float]:
+        """撮合时的限价，市价单和止损单为 None"""
+        return self.limit_price if self.order_type in (LIMIT, STOP_LIMIT) else None
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "filled_quantity": self.filled,
+            "average_price": self.average_price,
+            "status": self.status,
+            "triggered": self.triggered,
+        }
+
+
+@dataclass
+class Fill:
+    order_id: int
+    user_id: int
+    portfolio_id: Optional[int]
+    symbol: str
+    side: str
+    price: float
+    quantity: float
+    time: datetime
+
+
+class InsufficientFunds(Exception):
+    """可用现金或持仓不足，委托被拒绝"""
+
+
+@dataclass
+class _Account:
+    """投资组合扣除冻结部分后的可用现金和持仓"""
+    cash: float
+    shares: Dict[str, float]
+
+
+class _Accounts:
+    """撮合引擎维护的投资组合可用余额，只在引擎的锁内读写"""
+
+    def __init__(self):
+        self._accounts: Dict[int, _Account] = {}
+
+    def __contains__(self, portfolio_id: Optional[int]) -> bool:
+        return portfolio_id is None or portfolio_id in self._accounts
+
+    def add(self, portfolio_id: int, account: Optional[_Account]):
+        if account is not None:
+            self._accounts.setdefault(portfolio_id, account)
+
+    @staticmethod
+    def load(portfolio_id: int) -> Optional[_Account]:
+        db = SessionLocal()
+        try:
+            portfolio = crud.get_portfolio(db, portfolio_id)
+            if portfolio is None:
+                return None
+            assets = crud.get_assets_by_portfolio(db, portfolio_id=portfolio_id)
+            return _Account(cash=portfolio.cash_balance, shares={asset.symbol: asset.quantity for asset in assets})
+        finally:
+            db.close()
+
+    def reserve(self, order: BookOrder):
+        """冻结委托剩余部分所需的现金或持仓，不足时抛出 InsufficientFunds"""
+        account = self._accounts.get(order.portfolio_id)
+        if account is None:
+            return
+        if order.side == BUY:
+            if order.limit is None:
+                return
+            amount = order.remaining * order.limit
+            if account.cash < amount - EPSILON:
+                raise InsufficientFunds(f"可用现金不足: 需要 {amount:.2f}，可用 {account.cash:.2f}")
+            account.cash -= amount
+        else:
+            held = account.shares.get(order.symbol, 0.0)
+            if held < order.remaining - EPSILON:
+                raise InsufficientFunds(f"可卖持仓不足: 需要 {order.remaining:g}，可用 {held:g}")
+            account.shares[order.symbol] = held - order.remaining
+
+    def release(self, order: BookOrder):
+        """撤销的委托解冻剩余部分"""
+        account = self._accounts.get(order.portfolio_id)
+        if account is None or order.remaining <= EPSILON:
+            return
+        if order.side == BUY:
+            if order.limit is not None:
+                account.cash += order.remaining * order.limit
+        else:
+            account.shares[order.symbol] = account.shares.get(order.symbol, 0.0) + order.remaining
+
+    def affordable(self, order: BookOrder, price: float, quantity: float) -> bool:
+        """未冻结资金的买单（市价单、止损单）能否按 price 成交 quantity 股"""
+        account = self._accounts.get(order.portfolio_id)
+        if account is None or order.side != BUY or order.limit is not None:
+            return True
+        return account.cash >= price * quantity - EPSILON
+
+    def apply(self, order: BookOrder, price: float, quantity: float):
+        account = self._accounts.get(order.portfolio_id)
+        if account is None:
+            return
+        if order.side == BUY:
+            if order.limit is not None:
+                # 成交价不高于限价，多冻结的部分退回
+                account.cash += quantity * order.limit
+            account.cash -= quantity * price
+            account.shares[order.symbol] = account.shares.get(order.symbol, 0.0) + quantity
+        else:
+            account.cash += quantity * price
+
+    def adjust(self, portfolio_id: int, symbol: str, cash: float, shares: float) -> bool:
+        """引擎之外的成交（见 trading 路由）同步到可用余额，不足时返回 False 且不做修改"""
+        account = self._accounts.get(portfolio_id)
+        if account is None:
+            return True
+        held = account.shares.get(symbol, 0.0)
+        if account.cash + cash < -EPSILON or held + shares < -EPSILON:
+            return False
+        account.cash += cash
+        account.shares[symbol] = held + shares
+        return True
+
+
+class _Events:
+    """一次操作产生的成交和状态发生变化的委托单"""
+    __slots__ = ("fills", "orders", "time", "accounts")
+
+    def __init__(self, accounts: Optional[_Accounts] = None):
+        self.fills: List[Fill] = []
+        self.orders: Dict[int, BookOrder] = {}
+        self.time = datetime.now()
+        self.accounts = accounts
+
+    def affordable(self, order: BookOrder, price: float, quantity: float) -> bool:
+        return self.accounts is None or self.accounts.affordable(order, price, quantity)
+
+    def cancel(self, order: BookOrder):
+        order.canceled = True
+        self.orders[order.id] = order
+
+    def fill(self, order: BookOrder, price: float, quantity: float):
+        order.filled += quantity
+        order.notional += price * quantity
+        if self.accounts is not None:
+            self.accounts.apply(order, price, quantity)
+        self.fills.append(Fill(
+            order.id, order.user_id, order.portfolio_id, order.symbol, order.side, price, quantity, self.time
+        ))
+        self.orders[order.id] = order
+
+
+class _Side:
+    """订单簿的一侧：有序的价格档位，每个档位是先进先出队列；排序键使最优价格总在列表末尾"""
+
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+        self.keys: List[float] = []
+        self.levels: Dict[float, Deque[BookOrder]] = {}
+
+    def _key(self, price: float) -> float:
+        return price if self.is_bid else -price
+
+    def add(self, order: BookOrder):
+        price = order.limit_price
+        level = self.levels.get(price)
+        if level is None:
+            level = self.levels[price] = deque()
+            bisect.insort(self.keys, self._key(price))
+        level.append(order)
+
+    def best(self) -> Optional[Tuple[float, Deque[BookOrder]]]:
+        """最优档位，顺带移除队首已撤销或已成交的订单和空档位"""
+        while self.keys:
+            price = self._key(self.keys[-1])
+            level = self.levels[price]
+            while level and level[0].done:
+                level.popleft()
+            if level:
+                return price, level
+            del self.levels[price]
+            self.keys.pop()
+        return None
+
+    def depth(self, levels: int) -> List[List[float]]:
+        """从最优价格开始的 [价格, 剩余数量, 订单数]"""
+        result = []
+        for key in reversed(self.keys):
+            price = self._key(key)
+            orders = [order for order in self.levels[price] if not order.done]
+            if orders:
+                result.append([price, sum(order.remaining for order in orders), len(orders)])
+                if len(result) >= levels:
+                    break
+        return result
+
+
+class OrderBook:
+    def __init__(self, symbol: str, last_price: Optional[float] = None, liquidity: float = config.ORDER_BOOK_TICK_LIQUIDITY):
+        self.symbol = symbol
+        self.last_price = last_price
+        self.liquidity = liquidity if liquidity > 0 else float("inf")
+        self.bids = _Side(is_bid=True)
+        self.asks = _Side(is_bid=False)
+        # 未触发的止损单：买入止损按止损价升序（价格涨到止损价触发），卖出止损按止损价降序
+        self._buy_stops: List[Tuple[float, int, BookOrder]] = []
+        self._sell_stops: List[Tuple[float, int, BookOrder]] = []
+        self._sequence = itertools.count()
+
+    def submit(self, order: BookOrder, events: _Events):
+        if order.order_type in (STOP, STOP_LIMIT) and not order.triggered:
+            if self.last_price is None or not self._stop_hit(order, self.last_price):
+                self._add_stop(order)
+                return
+            self._trigger(order, events)
+        self._match(order, events)
+
+    def restore(self, order: BookOrder):
+        """恢复重启前的挂单，不撮合；已触发的止损限价单按限价单恢复"""
+        if order.order_type in (STOP, STOP_LIMIT) and not order.triggered:
+            self._add_stop(order)
+        elif order.order_type in (LIMIT, STOP_LIMIT):
+            self._side(order.side).add(order)
+
+    def on_price(self, price: float, events: _Events):
+        """行情更新：触发止损单，再让限价优于最新价的挂单按最新价成交"""
+        self.last_price = price
+        triggered = []
+        while self._buy_stops and self._buy_stops[0][0] <= price:
+            triggered.append(heapq.heappop(self._buy_stops))
+        while self._sell_stops and -self._sell_stops[0][0] >= price:
+            triggered.append(heapq.heappop(self._sell_stops))
+        # 按下单顺序处理同时触发的止损单
+        for _, _, order in sorted(triggered, key=lambda item: item[1]):
+            if not order.done:
+                self._trigger(order, events)
+                self._match(order, events)
+
+        self._fill_at_market(self.bids, price, self.liquidity, events)
+        self._fill_at_market(self.asks, price, self.liquidity, events)
+
+    def depth(self, levels: int = 10) -> Dict[str, Any]:
+        return {
+            "symbol": self.symbol,
+            "last_price": self.last_price,
+            "bids": self.bids.depth(levels),
+            "asks": self.asks.depth(levels),
+            "stops": len(self._buy_stops) + len(self._sell_stops),
+        }
+
+    def _side(self, side: str) -> _Side:
+        return self.bids if side == BUY else self.asks
+
+    @staticmethod
+    def _stop_hit(order: BookOrder, price: float) -> bool:
+        return price >= order.stop_price if order.side == BUY else price <= order.stop_price
+
+    @staticmethod
+    def _trigger(order: BookOrder, events: _Events):
+        """标记止损单已触发；即使没有成交也要保存，重启后按限价单恢复"""
+        order.triggered = True
+        events.orders[order.id] = order
+
+    def _add_stop(self, order: BookOrder):
+        if order.side == BUY:
+            heapq.heappush(self._buy_stops, (order.stop_price, next(self._sequence), order))
+        else:
+            heapq.heappush(self._sell_stops, (-order.stop_price, next(self._sequence), order))
+
+    def _match(self, order: BookOrder, events: _Events):
+        limit = order.limit
+        opposite = self.asks if order.side == BUY else self.bids
+        while order.remaining > EPSILON:
+            best = opposite.best()
+            if best is None:
+                break
+            price, level = best
+            if limit is not None and (price > limit if order.side == BUY else price < limit):
+                break
+            maker = level[0]
+            if maker.user_id == order.user_id:
+                # 防止自成交：撤销自己的挂单
+                events.cancel(maker)
+                continue
+            quantity = min(order.remaining, maker.remaining)
+            if not events.affordable(order, price, quantity):
+                # 现金不足，撤销剩余部分
+                events.cancel(order)
+                return
+            events.fill(maker, price, quantity)
+            events.fill(order, price, quantity)
+
+        if order.remaining <= EPSILON:
+            return
+        if limit is None:
+            # 市价单剩余部分按最新价成交，没有可用价格或现金不足时撤销
+            if self.last_price is not None and events.affordable(order, self.last_price, order.remaining):
+                events.fill(order, self.last_price, order.remaining)
+            else:
+                events.cancel(order)
+            return
+
+        if self.last_price is not None and (self.last_price <= limit if order.side == BUY else self.last_price >= limit):
+            events.fill(order, self.last_price, min(order.remaining, self.liquidity))
+        if order.remaining > EPSILON:
+            self._side(order.side).add(order)
+
+    @staticmethod
+    def _fill_at_market(side: _Side, price: float, liquidity: float, events: _Events):
+        available = liquidity
+        while available > EPSILON:
+            best = side.best()
+            if best is None:
+                break
+            level_price, level = best
+            if level_price < price if side.is_bid else level_price > price:
+                break
+            order = level[0]
+            quantity = min(order.remaining, available)
+            events.fill(order, price, quantity)
+            available -= quantity
+
+
+class _FillWriter:
+    """后台线程把成交和委托单状态批量写入数据库"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[Tuple[List[Fill], List[Dict[str, Any]]]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.written = 0
+        self.failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="order-fill-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        if self._thread is not None:
+            self._stopping.set()
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, fills: List[Fill], states: List[Dict[str, Any]]):
+        self._queue.put((fills, states))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            fills = list(item[0])
+            # 同一委托单只保留最后的状态
+            states = {state["id"]: state for state in item[1]}
+            while len(fills) < WRITE_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                fills.extend(item[0])
+                states.update((state["id"], state) for state in item[1])
+            self._write(fills, list(states.values()))
+
+    def _write(self, fills: List[Fill], states: List[Dict[str, Any]]):
+        """写入一批成交；失败时按指数退避重试同一批，后续批次排队等待，保证按顺序写入。
+        内存中的订单簿已经按这些成交更新，因此只在停止时仍然失败才放弃"""
+        attempt = 0
+        stopping = False
+        while True:
+            db = SessionLocal()
+            try:
+                crud.record_order_fills(db, [asdict(fill) for fill in fills], states)
+                self.written += len(fills)
+                return
+            except Exception:
+                self.failures += 1
+                logger.exception("保存 %d 笔成交失败（第 %d 次）", len(fills), attempt + 1)
+                db.rollback()
+            finally:
+                db.close()
+            if stopping:
+                logger.error("停止时仍无法保存 %d 笔成交和 %d 个委托单状态", len(fills), len(states))
+                return
+            # 停止时提前结束等待，最后再尝试一次
+            stopping = self._stopping.wait(backoff_delay(attempt))
+            attempt += 1
+
+
+class MatchingEngine:
+    """所有股票的订单簿；撮合在一把锁内串行执行"""
+
+    def __init__(self, liquidity: float = config.ORDER_BOOK_TICK_LIQUIDITY):
+        self.liquidity = liquidity
+        self._lock = threading.Lock()
+        self._books: Dict[str, OrderBook] = {}
+        # 未完成的委托单
+        self._orders: Dict[int, BookOrder] = {}
+        self._accounts = _Accounts()
+        self._writer = _FillWriter()
+        self._started = False
+        self.events = 0
+        self.fills = 0
+
+    def start(self):
+        """从数据库恢复未完成的委托单，开始接收行情更新"""
+        if self._started:
+            return
+        db = SessionLocal()
+        try:
+            open_orders = crud.get_open_orders(db)
+        finally:
+            db.close()
+        accounts = {
+            db_order.portfolio_id: _Accounts.load(db_order.portfolio_id)
+            for db_order in open_orders if db_order.portfolio_id is not None
+        }
+        with self._lock:
+            for portfolio_id, account in accounts.items():
+                self._accounts.add(portfolio_id, account)
+            for db_order in open_orders:
+                order = from_db_order(db_order)
+                try:
+                    self._accounts.reserve(order)
+                except InsufficientFunds:
+                    # 余额在引擎之外发生了变化，无法再冻结的挂单撤销
+                    logger.warning("恢复委托单 %d 时可用余额不足，撤销", order.id)
+                    order.canceled = True
+                    self._writer.put([], [order.state()])
+                    continue
+                self._book(order.symbol).restore(order)
+                self._orders[order.id] = order
+        self._writer.start()
+        latest_quotes.subscribe(self._on_quote)
+        self._started = True
+
+    def stop(self):
+        """停止前写完尚未保存的成交"""
+        self._writer.stop()
+        self._started = False
+
+    def _book(self, symbol: str) -> OrderBook:
+        book = self._books.get(symbol)
+        if book is None:
+            latest = latest_quotes.get(symbol)
+            book = self._books[symbol] = OrderBook(symbol, latest.price if latest is not None else None, self.liquidity)
+        return book
+
+    def submit(self, order: BookOrder) -> BookOrder:
+        """提交新委托并立即撮合，返回撮合后的委托单；可用现金或持仓不足时抛出 InsufficientFunds"""
+        if order.portfolio_id not in self._accounts:
+            account = _Accounts.load(order.portfolio_id)
+        events = _Events(self._accounts)
+        with self._lock:
+            if order.portfolio_id not in self._accounts:
+                self._accounts.add(order.portfolio_id, account)
+            self._accounts.reserve(order)
+            self.events += 1
+            self._orders[order.id] = order
+            self._book(order.symbol).submit(order, events)
+            self._publish(events)
+        return order
+
+    def cancel(self, order_id: int) -> Optional[BookOrder]:
+        """撤销未完成的委托单，已完成或不存在时返回 None"""
+        events = _Events(self._accounts)
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or order.done:
+                return None
+            self.events += 1
+            events.cancel(order)
+            self._publish(events)
+        return order
+
+    def on_price(self, symbol: str, price: float):
+        events = _Events(self._accounts)
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return
+            self.events += 1
+            book.on_price(price, events)
+            self._publish(events)
+
+    def _on_quote(self, quote: schemas.LatestQuote):
+        self.on_price(quote.symbol, quote.price)
+
+    def _publish(self, events: _Events):
+        """在锁内调用：移除已完成的委托单，把变化交给后台线程写入"""
+        if not events.orders:
+            return
+        for order in events.orders.values():
+            if order.canceled:
+                self._accounts.release(order)
+            if order.done:
+                self._orders.pop(order.id, None)
+        self.fills += len(events.fills)
+        self._writer.put(events.fills, [order.state() for order in events.orders.values()])
+
+    def adjust(self, portfolio_id: int, symbol: str, cash: float, shares: float) -> bool:
+        """引擎之外直接成交时扣减可用余额，余额不足时返回 False"""
+        with self._lock:
+            return self._accounts.adjust(portfolio_id, symbol, cash, shares)
+
+    def get(self, order_id: int) -> Optional[BookOrder]:
+        return self._orders.get(order_id)
+
+    def depth(self, symbol: str, levels: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                return {"symbol": symbol, "last_price": None, "bids": [], "asks": [], "stops": 0}
+            return book.depth(levels)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "books": len(self._books),
+            "open_orders": len(self._orders),
+            "events": self.events,
+            "fills": self.fills,
+            "pending_writes": self._writer.pending(),
+            "written_fills": self._writer.written,
+            "write_failures": self._writer.failures,
+        }
+
+
+def from_db_order(db_order) -> BookOrder:
+    filled = db_order.filled_quantity or 0.0
+    return BookOrder(
+        id=db_order.id,
+        user_id=db_order.user_id,
+        portfolio_id=db_order.portfolio_id,
+        symbol=db_order.symbol,
+        side=db_order.side,
+        order_type=db_order.order_type,
+        quantity=db_order.quantity,
+        limit_price=db_order.limit_price,
+        stop_price=db_order.stop_price,
+        filled=filled,
+        notional=(db_order.average_price or 0.0) * filled,
+        triggered=bool(db_order.triggered),
+    )
+
+
+matching_engine = MatchingEngine()
@@ -0,0 +1,84 @@
+"""
+行情数据的年度分区与冷数据归档
+
+数据库中的行情数据按年份存放在 market_data_{year} 表中，market_data_partitions 表登记每个分区的状态。
+最近 MARKET_DATA_HOT_YEARS 年的分区保留在数据库中；更早的分区把列式存储中缺少的K线补写进去后
+标记为已归档并删除分区表，这些年份只从列式存储读取。已归档年份的新数据（如回补）也只写入列式存储。
+"""
+import logging
+from datetime import datetime
+from typing import List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from .. import config, crud
+from .market_store import get_market_store
+
+logger = logging.getLogger(__name__)
+
+
+def _rows_to_frame(rows) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "Open": [row.open for row in rows],
+            "High": [row.high for row in rows],
+            "Low": [row.low for row in rows],
+            "Close": [row.close for row in rows],
+            "Volume": [row.volume for row in rows],
+        },
+        index=pd.DatetimeIndex([row.date for row in rows]),
+    )
+
+
+def _write_missing(symbol: str, year: int, rows) -> int:
+    """把列式存储中缺少的K线写入存储，返回写入的行数"""
+    store = get_market_store()
+    frame = _rows_to_frame(rows)
+    stored = store.read(symbol, datetime(year, 1, 1), datetime(year, 12, 31, 23, 59, 59), ["close"])["date"]
+    missing = frame[~frame.index.isin(np.asarray(stored))]
+    if not missing.empty:
+        store.write(symbol, missing)
+    return len(missing)
+
+
+def _archive_partition(db: Session, year: int) -> int:
+    """把分区中列式存储缺少的K线写入存储，返回分区的行数"""
+    row_count = 0
+    # 按股票逐个读取，避免一次性加载整年的数据
+    for symbol in crud.get_market_data_partition_symbols(db, year):
+        rows = crud.get_market_data_partition_rows(db, year, symbol)
+        row_count += len(rows)
+        _write_missing(symbol, year, rows)
+    return row_count
+
+
+def archive_legacy_market_data(db: Session) -> int:
+    """旧版 market_data 单表中属于已归档年份的数据，补写到列式存储后从旧表删除，返回补写的K线数"""
+    written = 0
+    for partition in crud.get_market_data_partitions(db):
+        if not partition.archived:
+            continue
+        symbols = crud.get_legacy_market_data_symbols(db, partition.year)
+        for symbol in symbols:
+            written += _write_missing(symbol, partition.year, crud.get_legacy_market_data_rows(db, partition.year, symbol))
+        if symbols:
+            crud.delete_legacy_market_data(db, partition.year)
+            logger.info("旧表中 %d 年的行情数据已补写到列式存储", partition.year)
+    return written
+
+
+def compact_partitions(db: Session, hot_years: int = config.MARKET_DATA_HOT_YEARS) -> List[int]:
+    """归档超出保留年数的分区，返回本次归档的年份"""
+    cutoff = datetime.now().year - hot_years + 1
+    archived = []
+    for partition in crud.get_market_data_partitions(db):
+        if partition.archived or partition.year >= cutoff:
+            continue
+        row_count = _archive_partition(db, partition.year)
+        crud.archive_market_data_partition(db, partition.year, row_count)
+        logger.info("行情分区 %d 已归档，共 %d 行", partition.year, row_count)
+        archived.append(partition.year)
+    return archived
+
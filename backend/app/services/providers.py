@@ -0,0 +1,365 @@
+"""
+行情数据源
+
+MarketDataProvider 定义统一的接口：异步方法 history/quote/quotes/info 供接口路由使用，
+对应的阻塞方法 fetch_* 供后台线程（回测、数据更新）直接调用。
+通过配置 MARKET_DATA_PROVIDER 选择数据源：
+    yfinance   Yahoo Finance，使用共享的连接池会话
+    fixture    从本地 CSV/Parquet 文件读取，用于离线测试
+    synthetic  按股票代码生成确定性的模拟行情，用于压测和基准测试
+"""
+import asyncio
+import json
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .. import config
+
+_executor = ThreadPoolExecutor(max_workers=config.PROVIDER_MAX_WORKERS)
+
+# 报价字段与 /prices 接口一致
+QuoteDict = Dict[str, Any]
+
+
+def quote_from_history(hist: pd.DataFrame) -> QuoteDict:
+    """根据最近一根K线生成报价"""
+    last = hist.iloc[-1]
+    price = float(last["Close"])
+    open_price = float(last["Open"])
+    return {
+        "price": price,
+        "change": price - open_price,
+        "change_percent": (price - open_price) / open_price * 100 if open_price else 0.0,
+        "volume": float(last["Volume"]),
+        "time": hist.index[-1].strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+class MarketDataProvider(ABC):
+    """行情数据源接口"""
+
+    name = "base"
+
+    # 历史K线是否已按拆股复权（分红始终不复权）
+    split_adjusted = False
+
+    # 阻塞实现，由子类提供
+    @abstractmethod
+    def fetch_history(self, symbol: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+        """返回 [start, end) 区间的K线，列为 Open/High/Low/Close/Volume"""
+
+    @abstractmethod
+    def fetch_quote(self, symbol: str) -> QuoteDict:
+        """返回最新报价"""
+
+    @abstractmethod
+    def fetch_info(self, symbol: str) -> Dict[str, Any]:
+        """返回股票基本信息"""
+
+    def fetch_actions(self, symbol: str) -> pd.DataFrame:
+        """返回拆股和分红事件，列为 Dividends / Stock Splits，默认没有事件"""
+        return pd.DataFrame(columns=["Dividends", "Stock Splits"], index=pd.DatetimeIndex([], name="Date"))
+
+    def fetch_quotes(self, symbols: List[str]) -> Tuple[Dict[str, QuoteDict], Dict[str, str]]:
+        """批量获取报价，默认在线程池中逐只获取"""
+        quotes, errors = {}, {}
+        futures = {symbol: _executor.submit(self.fetch_quote, symbol) for symbol in symbols}
+        for symbol, future in futures.items():
+            try:
+                quotes[symbol] = future.result(timeout=config.QUOTE_TIMEOUT)
+            except Exception as e:
+                errors[symbol] = str(e)
+        return quotes, errors
+
+    # 异步接口
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+    async def history(self, symbol: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+        return await self._run(self.fetch_history, symbol, start, end, interval)
+
+    async def quote(self, symbol: str) -> QuoteDict:
+        return await self._run(self.fetch_quote, symbol)
+
+    async def quotes(self, symbols: List[str]) -> Tuple[Dict[str, QuoteDict], Dict[str, str]]:
+        return await self._run(self.fetch_quotes, symbols)
+
+    async def info(self, symbol: str) -> Dict[str, Any]:
+        return await self._run(self.fetch_info, symbol)
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Yahoo Finance 数据源，所有请求共享一个连接池会话"""
+
+    name = "yfinance"
+    split_adjusted = True
+
+    def __init__(self):
+        self.session = self._create_session()
+
+    @staticmethod
+    def _create_session():
+        try:
+            from curl_cffi import requests as curl_requests
+            return curl_requests.Session(impersonate="chrome")
+        except ImportError:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=config.PROVIDER_MAX_WORKERS, pool_maxsize=config.PROVIDER_MAX_WORKERS)
+            session.mount("https://", adapter)
+            return session
+
+    def _ticker(self, symbol: str):
+        import yfinance as yf
+        return yf.Ticker(symbol, session=self.session)
+
+    def fetch_history(self, symbol: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+        # 不做分红复权，复权因子在读取时由公司行为计算
+        return self._ticker(symbol).history(start=start, end=end, interval=interval, auto_adjust=False, actions=False)
+
+    def fetch_actions(self, symbol: str) -> pd.DataFrame:
+        return self._ticker(symbol).actions
+
+    def fetch_quote(self, symbol: str) -> QuoteDict:
+        hist = self._ticker(symbol).history(period="1d")
+        if hist.empty:
+            raise ValueError(f"无法获取股票价格: {symbol}")
+        return quote_from_history(hist)
+
+    def fetch_quotes(self, symbols: List[str]) -> Tuple[Dict[str, QuoteDict], Dict[str, str]]:
+        """一次批量请求获取一组股票的报价"""
+        import yfinance as yf
+        data = yf.download(
+            tickers=symbols,
+            period="1d",
+            group_by="ticker",
+            threads=False,
+            progress=False,
+            auto_adjust=False,
+            session=self.session,
+        )
+
+        quotes, errors = {}, {}
+        for symbol in symbols:
+            try:
+                hist = data[symbol] if isinstance(data.columns, pd.MultiIndex) else data
+                hist = hist.dropna(subset=["Close"])
+                if hist.empty:
+                    errors[symbol] = "没有可用的报价数据"
+                else:
+                    quotes[symbol] = quote_from_history(hist)
+            except KeyError:
+                errors[symbol] = "没有可用的报价数据"
+        return quotes, errors
+
+    def fetch_info(self, symbol: str) -> Dict[str, Any]:
+        info = self._ticker(symbol).info
+
+        # 提取有用的信息
+        return {
+            "symbol": symbol,
+            "name": info.get("shortName", ""),
+            "sector": info.get("sector", ""),
+            "industry": info.get("industry", ""),
+            "market_cap": info.get("marketCap", 0),
+            "pe_ratio": info.get("trailingPE", 0),
+            "dividend_yield": info.get("dividendYield", 0) * 100 if info.get("dividendYield") else 0,
+            "beta": info.get("beta", 0),
+            "52_week_high": info.get("fiftyTwoWeekHigh", 0),
+            "52_week_low": info.get("fiftyTwoWeekLow", 0),
+            "avg_volume": info.get("averageVolume", 0),
+            "description": info.get("longBusinessSummary", ""),
+        }
+
+
+def _info_from_history(symbol: str, hist: pd.DataFrame, name: str = "", sector: str = "", industry: str = "") -> Dict[str, Any]:
+    """离线数据源根据历史K线推算基本信息"""
+    last_year = hist.iloc[-252:]
+    return {
+        "symbol": symbol,
+        "name": name or symbol,
+        "sector": sector,
+        "industry": industry,
+        "market_cap": 0,
+        "pe_ratio": 0,
+        "dividend_yield": 0,
+        "beta": 0,
+        "52_week_high": float(last_year["High"].max()) if not last_year.empty else 0,
+        "52_week_low": float(last_year["Low"].min()) if not last_year.empty else 0,
+        "avg_volume": float(last_year["Volume"].mean()) if not last_year.empty else 0,
+        "description": "",
+    }
+
+
+class FixtureProvider(MarketDataProvider):
+    """从本地文件读取行情：{fixture_dir}/{SYMBOL}.parquet 或 {SYMBOL}.csv，可选 info.json"""
+
+    name = "fixture"
+
+    def __init__(self, fixture_dir: str = config.MARKET_DATA_FIXTURE_DIR):
+        self.fixture_dir = fixture_dir
+        self._lock = threading.Lock()
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._info: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _load(self, symbol: str) -> pd.DataFrame:
+        symbol = symbol.upper()
+        with self._lock:
+            if symbol in self._frames:
+                return self._frames[symbol]
+
+            parquet_path = os.path.join(self.fixture_dir, f"{symbol}.parquet")
+            csv_path = os.path.join(self.fixture_dir, f"{symbol}.csv")
+            if os.path.exists(parquet_path):
+                frame = pd.read_parquet(parquet_path)
+            elif os.path.exists(csv_path):
+                frame = pd.read_csv(csv_path, index_col=0)
+            else:
+                raise ValueError(f"没有找到行情数据文件: {symbol}")
+
+            frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index), name="Date")
+            frame = frame.rename(columns=str.capitalize).sort_index()
+            self._frames[symbol] = frame
+            return frame
+
+    def fetch_history(self, symbol: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+        if interval != "1d":
+            raise ValueError(f"本地数据源只支持日线数据: {interval}")
+        frame = self._load(symbol)
+        return frame[(frame.index >= pd.Timestamp(start)) & (frame.index < pd.Timestamp(end))]
+
+    def fetch_quote(self, symbol: str) -> QuoteDict:
+        frame = self._load(symbol)
+        hist = frame[frame.index <= pd.Timestamp(datetime.now())]
+        if hist.empty:
+            raise ValueError(f"无法获取股票价格: {symbol}")
+        return quote_from_history(hist)
+
+    def fetch_actions(self, symbol: str) -> pd.DataFrame:
+        """可选的 {SYMBOL}.actions.csv，列为 Date, Dividends, Stock Splits，价格为未复权价格"""
+        path = os.path.join(self.fixture_dir, f"{symbol.upper()}.actions.csv")
+        if not os.path.exists(path):
+            return super().fetch_actions(symbol)
+        actions = pd.read_csv(path, index_col=0)
+        actions.index = pd.DatetimeIndex(pd.to_datetime(actions.index), name="Date")
+        return actions
+
+    def fetch_info(self, symbol: str) -> Dict[str, Any]:
+        if self._info is None:
+            info_path = os.path.join(self.fixture_dir, "info.json")
+            try:
+                with open(info_path) as f:
+                    self._info = json.load(f)
+            except (OSError, ValueError):
+                self._info = {}
+        symbol = symbol.upper()
+        info = _info_from_history(symbol, self._load(symbol))
+        info.update(self._info.get(symbol, {}))
+        return info
+
+
+class SyntheticProvider(MarketDataProvider):
+    """按股票代码生成确定性的模拟行情（几何布朗运动），同一代码在任何时候得到相同的数据"""
+
+    name = "synthetic"
+
+    SECTORS = ["Technology", "Healthcare", "Financial Services", "Energy", "Consumer Cyclical", "Industrials"]
+
+    def __init__(self, seed: int = config.SYNTHETIC_SEED, epoch: str = "2000-01-03"):
+        self.seed = seed
+        self.epoch = pd.Timestamp(epoch)
+
+    def _symbol_seed(self, symbol: str) -> int:
+        return zlib.crc32(symbol.upper().encode()) ^ self.seed
+
+    @lru_cache(maxsize=1024)
+    def _series(self, symbol: str, end_year: int) -> pd.DataFrame:
+        """生成从 epoch 到 end_year 年底的日线，按年份缓存以保证同一区间结果一致"""
+        rng = np.random.default_rng(self._symbol_seed(symbol))
+        index = pd.bdate_range(self.epoch, pd.Timestamp(year=end_year, month=12, day=31), name="Date")
+        n = len(index)
+
+        drift = rng.uniform(-0.0001, 0.0006)
+        volatility = rng.uniform(0.01, 0.03)
+        start_price = rng.uniform(10, 500)
+        base_volume = rng.uniform(1e5, 5e7)
+        # 所有列按行一次抽取，每天的随机数只取决于之前的天数，end_year 变化时已有日期的数据不变
+        noise = rng.standard_normal((n, 4))
+        returns = drift + volatility * noise[:, 0]
+        close = start_price * np.exp(np.cumsum(returns))
+        open_ = close * np.exp(volatility / 4 * noise[:, 1])
+        spread = np.abs(volatility / 2 * noise[:, 2])
+        high = np.maximum(open_, close) * (1 + spread)
+        low = np.minimum(open_, close) * (1 - spread)
+        volume = np.round(np.exp(np.log(base_volume) + 0.4 * noise[:, 3]))
+
+        return pd.DataFrame(
+            {"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume},
+            index=index,
+        )
+
+    def _frame(self, symbol: str, end: datetime) -> pd.DataFrame:
+        return self._series(symbol.upper(), max(pd.Timestamp(end).year, datetime.now().year))
+
+    def fetch_history(self, symbol: str, start: datetime, end: datetime, interval: str = "1d") -> pd.DataFrame:
+        if interval != "1d":
+            raise ValueError(f"模拟数据源只支持日线数据: {interval}")
+        frame = self._frame(symbol, end)
+        return frame[(frame.index >= pd.Timestamp(start)) & (frame.index < pd.Timestamp(end))]
+
+    def fetch_quote(self, symbol: str) -> QuoteDict:
+        now = datetime.now()
+        frame = self._frame(symbol, now)
+        return quote_from_history(frame[frame.index <= pd.Timestamp(now)])
+
+    def fetch_info(self, symbol: str) -> Dict[str, Any]:
+        symbol = symbol.upper()
+        now = datetime.now()
+        frame = self._frame(symbol, now)
+        seed = self._symbol_seed(symbol)
+        return _info_from_history(
+            symbol,
+            frame[frame.index <= pd.Timestamp(now)],
+            name=f"{symbol} Synthetic Corp",
+            sector=self.SECTORS[seed % len(self.SECTORS)],
+        )
+
+
+_PROVIDERS = {
+    "yfinance": YFinanceProvider,
+    "fixture": FixtureProvider,
+    "synthetic": SyntheticProvider,
+}
+
+_provider: Optional[MarketDataProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> MarketDataProvider:
+    """获取配置的行情数据源"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            provider_class = _PROVIDERS.get(config.MARKET_DATA_PROVIDER)
+            if provider_class is None:
+                raise ValueError(f"未知的行情数据源: {config.MARKET_DATA_PROVIDER}")
+            _provider = provider_class()
+        return _provider
+
+
+def set_provider(provider: MarketDataProvider):
+    """替换当前数据源（用于测试和基准测试）"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,38 @@
+"""
+批量行情报价服务
+
+通过数据源的批量接口一次获取多只股票的最新报价，批量请求失败或有遗漏时退回到逐只获取。
+"""
+from typing import Any, Dict, List, Tuple
+
+from .. import config
+from .providers import MarketDataProvider, get_provider
+
+
+def normalize_symbols(symbols: List[str]) -> List[str]:
+    """去除空白、统一大写并去重，保持原有顺序"""
+    return list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+
+
+def fetch_quotes(symbols: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+    """获取多只股票的最新报价，返回 (报价, 每只股票的错误信息)"""
+    provider = get_provider()
+    symbols = normalize_symbols(symbols)
+    quotes: Dict[str, Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+
+    for i in range(0, len(symbols), config.QUOTE_BATCH_SIZE):
+        batch = symbols[i:i + config.QUOTE_BATCH_SIZE]
+        try:
+            batch_quotes, batch_errors = provider.fetch_quotes(batch)
+        except Exception:
+            batch_quotes, batch_errors = MarketDataProvider.fetch_quotes(provider, batch)
+        else:
+            # 批量请求中缺失的股票再单独重试一次
+            if batch_errors and type(provider).fetch_quotes is not MarketDataProvider.fetch_quotes:
+                retry_quotes, batch_errors = MarketDataProvider.fetch_quotes(provider, list(batch_errors))
+                batch_quotes.update(retry_quotes)
+        quotes.update(batch_quotes)
+        errors.update(batch_errors)
+
+    return quotes, errors
@@ -0,0 +1,90 @@
+"""
+上游请求限流与重试
+"""
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple, Type, TypeVar
+
+from .. import config
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 个请求，最多允许 capacity 个突发请求"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """取得令牌，必要时等待；超过 timeout 仍未取得时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    if waited:
+                        self.waits += 1
+                        self.wait_seconds += now - started
+                    return True
+                delay = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            waited = True
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                "rate": self.rate,
+                "capacity": self.capacity,
+                "available": round(self._tokens, 2),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+            }
+
+
+def backoff_delay(attempt: int, base: float = config.INGESTION_BACKOFF_BASE, maximum: float = config.INGESTION_BACKOFF_MAX) -> float:
+    """带完全抖动的指数退避：在 [0, min(maximum, base * 2^attempt)] 中随机取值"""
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+def retry_with_backoff(
+    func: Callable[[], T],
+    retries: int = config.INGESTION_MAX_RETRIES,
+    retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+    on_retry: Optional[Callable[[int, BaseException], None]] = None,
+    sleep: Callable[[float], None] = time.sleep
+) -> T:
+    """调用 func，失败时按指数退避重试，最多重试 retries 次，最后一次的异常原样抛出"""
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except retry_on as e:
+            if attempt >= retries:
+                raise
+            if on_retry is not None:
+                on_retry(attempt, e)
+            sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+# 所有访问行情数据源的请求共用的限流器
+upstream_limiter = TokenBucket(rate=config.UPSTREAM_RATE_LIMIT, capacity=config.UPSTREAM_BURST)
@@ -0,0 +1,139 @@
+"""
+K线周期转换
+
+日线按周、月聚合（开盘取第一根、最高取最大、最低取最小、收盘取最后一根、成交量求和），
+聚合结果按股票和周期缓存。本地存储有新数据写入时，只重新计算受影响的最后几个周期。
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from .. import config
+from .corporate_actions import data_version, read_frame
+from .market_store import get_market_store
+
+OHLCV_AGGREGATION = {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+
+# 由日线聚合得到的周期及对应的 pandas 规则，周期以起始日期标记
+RESAMPLE_RULES = {
+    "1w": "W-MON",
+    "1mo": "MS",
+    "3mo": "QS",
+}
+
+# 直接从数据源获取的日内周期
+INTRADAY_INTERVALS = {"1h"}
+
+SUPPORTED_INTERVALS = ["1d"] + list(RESAMPLE_RULES) + sorted(INTRADAY_INTERVALS)
+
+
+def resample_ohlcv(frame: pd.DataFrame, interval: str) -> pd.DataFrame:
+    """把日线聚合为更长的周期，去掉没有交易日的周期"""
+    if interval == "1d" or frame.empty:
+        return frame
+    rule = RESAMPLE_RULES[interval]
+    if rule.startswith("W-"):
+        resampler = frame.resample(rule, label="left", closed="left")
+    else:
+        resampler = frame.resample(rule)
+    return resampler.agg(OHLCV_AGGREGATION).dropna(subset=["Open"])
+
+
+class AggregateCache:
+    """按 (股票, 周期, 是否复权) 缓存全部历史的聚合结果，LRU 限制条目数"""
+
+    def __init__(self, max_size: int = config.OHLCV_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str, bool], Tuple[Tuple[int, int], pd.DataFrame]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.incremental_updates = 0
+        self.full_rebuilds = 0
+
+    def get(self, symbol: str, interval: str, adjusted: bool = True) -> pd.DataFrame:
+        symbol = symbol.upper()
+        key = (symbol, interval, adjusted)
+        # 先取版本号再读数据，读取期间发生的写入会在下次请求时重新处理；
+        # 未复权的数据与公司行为无关
+        version = data_version(symbol) if adjusted else (get_market_store().version(symbol), 0)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        aggregates = None
+        if entry is not None:
+            aggregates = self._update(symbol, interval, adjusted, entry, version)
+        if aggregates is None:
+            self.full_rebuilds += 1
+            aggregates = resample_ohlcv(read_frame(symbol, adjusted=adjusted), interval)
+
+        with self._lock:
+            self._entries[key] = (version, aggregates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return aggregates
+
+    def _update(
+        self,
+        symbol: str,
+        interval: str,
+        adjusted: bool,
+        entry: Tuple[Tuple[int, int], pd.DataFrame],
+        version: Tuple[int, int]
+    ) -> Optional[pd.DataFrame]:
+        """从受影响的第一个周期开始重新聚合；无法增量更新时返回 None 表示需要全量重算"""
+        cached_version, aggregates = entry
+        # 新的公司行为会改变此前所有K线的复权价格
+        if cached_version[1] != version[1]:
+            return None
+        changed = get_market_store().changed_since(symbol, cached_version[0])
+        if changed is None or aggregates.empty:
+            return None
+        if changed == datetime.max:
+            return aggregates
+
+        # 新数据只影响它所在的周期及之后的周期
+        kept = aggregates[aggregates.index <= pd.Timestamp(changed)]
+        if kept.empty:
+            return None
+        tail_start = kept.index[-1]
+
+        tail = resample_ohlcv(read_frame(symbol, tail_start.to_pydatetime(), adjusted=adjusted), interval)
+        self.incremental_updates += 1
+        return pd.concat([kept[kept.index < tail_start], tail])
+
+    def invalidate(self, symbol: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == symbol.upper()]:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "incremental_updates": self.incremental_updates,
+            "full_rebuilds": self.full_rebuilds,
+        }
+
+
+aggregate_cache = AggregateCache()
+
+
+def slice_bars(frame: pd.DataFrame, start: Optional[datetime], end: Optional[datetime]) -> pd.DataFrame:
+    """取起始日期落在 [start, end] 内的K线"""
+    if start is not None:
+        frame = frame[frame.index >= pd.Timestamp(start)]
+    if end is not None:
+        frame = frame[frame.index <= pd.Timestamp(end)]
+    return frame
@@ -0,0 +1,330 @@
+"""
+策略沙箱工作进程池
+
+工作进程预先导入 pandas/numpy/ta 和回测引擎，每个工作进程在完成一定数量的任务或内存增长超过上限后自动回收并重建。
+
+策略代码在受限的命名空间中执行：
+    内置函数只保留计算所需的部分，不提供 getattr、type、object 等内省函数，也不能定义类
+    编译时拒绝访问下划线开头的属性、栈帧属性和文件读写方法
+    numpy/pandas/ta 等模块只以代理对象提供，代理不暴露文件读写函数和其他模块
+Python 层面的限制只能挡住常见的逃逸方式，不构成完整的安全边界；工作进程另有操作系统限制：
+地址空间的增长上限为 SANDBOX_MAX_MEMORY_MB，有权限时进入独立的网络命名空间，无法建立网络连接。
+SANDBOX_ENABLED=false 时回测在服务进程内执行，没有操作系统限制，只应在可信环境中使用。
+"""
+import ast
+import builtins
+import ctypes
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Callable, Dict, Optional
+
+from .. import config
+
+logger = logging.getLogger(__name__)
+
+# unshare(2) 创建新网络命名空间的标志
+CLONE_NEWNET = 0x40000000
+
+# 工作进程启动时预加载的模块，包括策略允许导入的全部模块
+PRELOAD_MODULES = [
+    "math", "statistics", "datetime", "collections", "itertools", "functools",
+    "numpy", "pandas", "ta", "app.services.backtest_engine",
+]
+
+# 策略代码允许导入的模块，导入得到的是模块代理
+ALLOWED_MODULES = {
+    "math", "statistics", "datetime", "collections", "itertools", "functools",
+    "numpy", "pandas", "ta",
+}
+
+# 模块代理中不可访问的属性（按顶层包），包括文件读写、数据源和内部实现的子模块
+_BLOCKED_MODULE_ATTRIBUTES = {
+    "numpy": {
+        "load", "loadtxt", "genfromtxt", "fromfile", "fromregex", "save", "savez",
+        "savez_compressed", "savetxt", "memmap", "DataSource", "lib", "core",
+        "ctypeslib", "f2py", "distutils", "testing", "compat",
+    },
+    "pandas": {
+        "io", "core", "compat", "util", "api", "testing", "plotting", "eval",
+        "HDFStore", "ExcelFile", "ExcelWriter", "to_pickle", "set_option", "options",
+    },
+}
+
+# 策略代码中不可访问的属性：栈帧（可以拿到真实的内置函数）和文件读写方法
+_BLOCKED_ATTRIBUTES = {
+    "gi_frame", "gi_code", "cr_frame", "cr_code", "ag_frame", "ag_code",
+    "tb_frame", "tb_next", "f_back", "f_builtins", "f_globals", "f_locals", "f_code",
+    "to_csv", "to_pickle", "to_parquet", "to_feather", "to_hdf", "to_sql", "to_excel",
+    "to_clipboard", "to_json", "to_html", "to_xml", "to_latex", "to_markdown",
+    "to_stata", "to_orc", "tofile", "dump",
+}
+
+# 策略代码可以使用的内置函数
+_ALLOWED_BUILTINS = [
+    "abs", "all", "any", "bool", "dict", "divmod", "enumerate", "filter", "float",
+    "format", "frozenset", "int", "isinstance", "issubclass", "iter", "len", "list",
+    "map", "max", "min", "next", "pow", "print", "range", "reversed", "round",
+    "set", "slice", "sorted", "str", "sum", "tuple", "zip", "hasattr",
+    "callable", "hash", "repr", "chr", "ord",
+    "Exception", "ValueError", "TypeError", "KeyError", "IndexError",
+    "ZeroDivisionError", "ArithmeticError", "RuntimeError", "StopIteration",
+    "True", "False", "None", "__name__",
+]
+
+
+class _ModuleProxy:
+    """模块代理：只暴露公开属性，同一个包的子模块同样以代理返回，其他模块和屏蔽的属性不可访问"""
+
+    def __init__(self, module: ModuleType):
+        self._module = module
+        self._root = module.__name__.split(".")[0]
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_") or name.startswith("read_") or name in _BLOCKED_MODULE_ATTRIBUTES.get(self._root, ()):
+            raise AttributeError(f"策略代码不允许访问 {self._module.__name__}.{name}")
+        value = getattr(self._module, name)
+        if isinstance(value, ModuleType):
+            if value.__name__.split(".")[0] != self._root:
+                raise AttributeError(f"策略代码不允许访问 {self._module.__name__}.{name}")
+            return _ModuleProxy(value)
+        return value
+
+    def __repr__(self) -> str:
+        return f"<module '{self._module.__name__}'>"
+
+
+def module_proxy(module: ModuleType) -> _ModuleProxy:
+    return _ModuleProxy(module)
+
+
+def _restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """只允许导入白名单中的模块，返回模块代理"""
+    if level != 0 or name.split(".")[0] not in ALLOWED_MODULES:
+        raise ImportError(f"策略代码不允许导入模块: {name}")
+    builtins.__import__(name, globals, locals, fromlist, level)
+    parts = name.split(".")
+    proxy = _ModuleProxy(sys.modules[parts[0]])
+    try:
+        # 逐级经过代理，被屏蔽的子模块无法导入
+        target = proxy
+        for part in parts[1:]:
+            target = getattr(target, part)
+    except AttributeError as e:
+        raise ImportError(str(e))
+    return target if fromlist else proxy
+
+
+SAFE_BUILTINS: Dict[str, Any] = {
+    name: getattr(builtins, name) for name in _ALLOWED_BUILTINS if hasattr(builtins, name)
+}
+SAFE_BUILTINS["__import__"] = _restricted_import
+
+
+def compile_strategy(code: str):
+    """编译策略代码，拒绝类定义、下划线开头的属性和名称以及被屏蔽的属性，不符合时抛出 ValueError"""
+    tree = ast.parse(code, "<string>", "exec")
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            raise ValueError("策略代码不允许定义类")
+        if isinstance(node, ast.Attribute) and (node.attr.startswith("_") or node.attr in _BLOCKED_ATTRIBUTES):
+            raise ValueError(f"策略代码不允许访问属性: {node.attr}")
+        if isinstance(node, ast.Name) and node.id.startswith("__"):
+            raise ValueError(f"策略代码不允许使用名称: {node.id}")
+        if isinstance(node, ast.alias) and node.name.split(".")[-1].startswith("_"):
+            raise ValueError(f"策略代码不允许导入: {node.name}")
+    return compile(tree, "<string>", "exec")
+
+
+def _current_rss_mb() -> float:
+    """当前进程的常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _apply_os_limits(max_memory_mb: float):
+    """
+    限制工作进程的资源，在预加载模块之后、执行策略之前调用：
+        地址空间最多在当前基础上增长 max_memory_mb
+        进入新的网络命名空间（只有未启用的回环接口），策略无法建立网络连接；没有权限时只记录日志
+    文件访问由模块代理和 compile_strategy 在接口层面屏蔽，不限制文件描述符，pandas/numpy 的延迟导入照常进行。
+    """
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            virtual_bytes = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = virtual_bytes + int(max_memory_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, OSError, ValueError) as e:
+        logger.warning(f"沙箱工作进程无法限制内存: {e}")
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.unshare(CLONE_NEWNET) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (AttributeError, OSError) as e:
+        logger.info(f"沙箱工作进程无法隔离网络: {e}")
+
+
+def _worker_main(conn, max_jobs: int, max_memory_growth_mb: float, max_memory_mb: float):
+    """工作进程主循环：接收任务、执行、返回结果，达到回收条件后退出"""
+    for module in PRELOAD_MODULES:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    baseline_rss = _current_rss_mb()
+    _apply_os_limits(max_memory_mb)
+    jobs = 0
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        func, args, kwargs = job
+        try:
+            reply = ("ok", func(*args, **kwargs))
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+
+        jobs += 1
+        retire = jobs >= max_jobs or _current_rss_mb() - baseline_rss > max_memory_growth_mb
+        try:
+            conn.send(reply + (retire,))
+        except Exception as e:
+            # 结果无法序列化时返回错误信息
+            conn.send(("error", f"无法返回执行结果: {e}", retire))
+        if retire:
+            break
+
+    conn.close()
+
+
+def _get_context():
+    """优先使用预加载了科学计算库的 forkserver，不支持时退回 spawn"""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class _Worker:
+    def __init__(self, context, max_jobs: int, max_memory_growth_mb: float, max_memory_mb: float):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, max_jobs, max_memory_growth_mb, max_memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, kill: bool = False):
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SandboxPool:
+    """预热的沙箱工作进程池，线程安全"""
+
+    def __init__(
+        self,
+        size: int = config.SANDBOX_WORKERS,
+        max_jobs: int = config.SANDBOX_MAX_JOBS_PER_WORKER,
+        max_memory_growth_mb: float = config.SANDBOX_MAX_MEMORY_GROWTH_MB,
+        max_memory_mb: float = config.SANDBOX_MAX_MEMORY_MB,
+    ):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_memory_growth_mb = max_memory_growth_mb
+        self.max_memory_mb = max_memory_mb
+        self._context = _get_context()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.max_jobs, self.max_memory_growth_mb, self.max_memory_mb)
+
+    def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """在空闲工作进程中执行 func(*args, **kwargs)，func 必须是可导入的模块级函数"""
+        if self._closed:
+            raise RuntimeError("沙箱进程池已关闭")
+
+        timeout = timeout or config.SANDBOX_TIMEOUT
+        worker = self._idle.get()
+        try:
+            worker.conn.send((func, args, kwargs))
+            if not worker.conn.poll(timeout):
+                worker.stop(kill=True)
+                worker = self._spawn()
+                raise TimeoutError(f"策略执行超时（{timeout}秒）")
+
+            status, payload, retire = worker.conn.recv()
+            if retire:
+                worker.stop()
+                worker = self._spawn()
+        except (EOFError, ConnectionError):
+            # 工作进程异常退出，重建后报告错误
+            worker.stop(kill=True)
+            worker = self._spawn()
+            raise RuntimeError("沙箱工作进程异常退出")
+        finally:
+            self._idle.put(worker)
+
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool: Optional[SandboxPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """获取全局沙箱进程池（首次调用时创建）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+            logger.info(f"沙箱进程池已启动，工作进程数: {_pool.size}")
+        return _pool
+
+
+def shutdown_sandbox_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
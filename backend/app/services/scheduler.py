@@ -0,0 +1,286 @@
+"""
+行情数据自动更新调度
+
+维护一个股票池（tracked_symbols 表），后台定时执行两类任务：
+    eod       收盘后补齐日线，新加入的股票先回填 INGESTION_HISTORY_DAYS 天的历史
+    intraday  交易日内定期重新获取最近几天的K线，刷新当天未收盘的数据
+    info      刷新证券主数据（名称、行业、基本面），每天检查一次过期的股票，请求中遇到的新股票随时加入
+每天收盘后的调度中还会把超出保留年数的行情分区归档到列式存储；每次调度时把内存中更新过的最新报价写入数据库。
+任务由固定数量的工作线程执行，每个任务使用独立的数据库会话；上游请求经过共享的令牌桶限流，
+失败时按带抖动的指数退避重试，并记录每只股票的更新时间和失败次数。
+"""
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .. import config, crud
+from ..database import SessionLocal
+from .ingestion import ensure_market_data, refresh_recent
+from .latest_quotes import latest_quotes
+from .market_store import get_market_store
+from .partitions import compact_partitions
+from .rate_limit import retry_with_backoff, upstream_limiter
+from .security_master import security_master
+
+logger = logging.getLogger(__name__)
+
+EOD = "eod"
+INTRADAY = "intraday"
+INFO = "info"
+
+# 检查是否需要调度新任务的间隔（秒）
+SCHEDULER_TICK = 30
+
+
+class SchedulerStopped(Exception):
+    pass
+
+
+@dataclass
+class IngestionJob:
+    symbol: str
+    kind: str
+    enqueued_at: float
+
+
+class IngestionScheduler:
+    def __init__(self, workers: int = config.INGESTION_WORKERS):
+        self.workers = workers
+        self._queue: "queue.Queue[Optional[IngestionJob]]" = queue.Queue()
+        self._pending: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.periodic = False
+        self.last_eod_date = None
+        self.last_intraday_at = 0.0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+
+    # 生命周期
+    def start(self, periodic: bool = True):
+        """启动工作线程；periodic 为 True 时同时按计划自动调度任务"""
+        if self._threads:
+            return
+        self._stop.clear()
+        self.periodic = periodic
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ingestion-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        if periodic:
+            self._seed_universe()
+            # 启动时补上停机期间错过的日终更新
+            self._enqueue_stale()
+            thread = threading.Thread(target=self._schedule, name="ingestion-scheduler", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def is_running(self) -> bool:
+        """是否有工作线程在处理队列中的任务"""
+        return bool(self._threads) and self.workers > 0
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        # 停止前保存尚未写入数据库的最新报价
+        self._flush_latest_quotes()
+
+    # 任务
+    def enqueue(self, symbol: str, kind: str = EOD) -> bool:
+        """加入任务队列，同一股票同类任务尚未执行时不重复加入"""
+        key = (symbol.upper(), kind)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._queue.put(IngestionJob(symbol=key[0], kind=kind, enqueued_at=time.monotonic()))
+        return True
+
+    def enqueue_universe(self, kind: str) -> int:
+        return sum(self.enqueue(symbol, kind) for symbol in self._universe())
+
+    def _universe(self) -> List[str]:
+        db = SessionLocal()
+        try:
+            return [tracked.symbol for tracked in crud.get_tracked_symbols(db)]
+        finally:
+            db.close()
+
+    def _seed_universe(self):
+        db = SessionLocal()
+        try:
+            if not crud.get_tracked_symbols(db, active_only=False):
+                symbols = [s.strip().upper() for s in config.INGESTION_DEFAULT_UNIVERSE.split(",") if s.strip()]
+                crud.add_tracked_symbols(db, symbols)
+        finally:
+            db.close()
+
+    def _enqueue_stale(self):
+        db = SessionLocal()
+        try:
+            threshold = datetime.utcnow() - timedelta(days=1)
+            tracked_symbols = crud.get_tracked_symbols(db)
+            for tracked in tracked_symbols:
+                if tracked.last_success_at is None or tracked.last_success_at < threshold:
+                    self.enqueue(tracked.symbol, EOD)
+        finally:
+            db.close()
+        self._enqueue_stale_info([tracked.symbol for tracked in tracked_symbols])
+
+    def _enqueue_stale_info(self, symbols: List[str]):
+        for symbol in security_master.stale(symbols):
+            self.enqueue(symbol, INFO)
+
+    def _compact_partitions(self):
+        db = SessionLocal()
+        try:
+            compact_partitions(db)
+        except Exception:
+            logger.exception("归档行情分区失败")
+        finally:
+            db.close()
+
+    def _flush_latest_quotes(self):
+        db = SessionLocal()
+        try:
+            latest_quotes.flush(db)
+        except Exception:
+            logger.exception("保存最新报价失败")
+        finally:
+            db.close()
+
+    def _schedule(self):
+        while not self._stop.wait(SCHEDULER_TICK):
+            self._flush_latest_quotes()
+            try:
+                for symbol in security_master.take_missing():
+                    self.enqueue(symbol, INFO)
+
+                now = datetime.now()
+                if now.hour >= config.INGESTION_EOD_HOUR and self.last_eod_date != now.date():
+                    self.last_eod_date = now.date()
+                    self.enqueue_universe(EOD)
+                    self._enqueue_stale_info(self._universe())
+                    self._compact_partitions()
+                elif now.weekday() < 5 and time.monotonic() - self.last_intraday_at >= config.INGESTION_INTRADAY_INTERVAL:
+                    self.last_intraday_at = time.monotonic()
+                    self.enqueue_universe(INTRADAY)
+            except Exception:
+                logger.exception("调度行情更新任务失败")
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._queue.get()
+            if job is None:
+                break
+            with self._lock:
+                self._pending.discard((job.symbol, job.kind))
+                self.running += 1
+            try:
+                self._execute(job)
+            except SchedulerStopped:
+                break
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def _sleep(self, delay: float):
+        if self._stop.wait(delay):
+            raise SchedulerStopped()
+
+    def _on_retry(self, attempt: int, error: BaseException):
+        with self._lock:
+            self.retries += 1
+
+    def _execute(self, job: IngestionJob):
+        db = SessionLocal()
+        started = time.perf_counter()
+        try:
+            def run():
+                try:
+                    if job.kind == INFO:
+                        return security_master.refresh(db, job.symbol)
+                    if job.kind == INTRADAY:
+                        return refresh_recent(db, job.symbol, config.INGESTION_INTRADAY_DAYS)
+                    now = datetime.now()
+                    return ensure_market_data(db, job.symbol, now - timedelta(days=config.INGESTION_HISTORY_DAYS), now)
+                except Exception:
+                    # 每次失败都回滚，否则数据库错误之后的重试会直接因为会话处于失败状态而失败
+                    db.rollback()
+                    raise
+
+            try:
+                retry_with_backoff(run, on_retry=self._on_retry, sleep=self._sleep)
+            except SchedulerStopped:
+                raise
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logger.warning("行情更新失败: %s (%s): %s", job.symbol, job.kind, e)
+                if job.kind == INFO:
+                    return
+                crud.record_ingestion_result(
+                    db, job.symbol, success=False,
+                    duration_ms=(time.perf_counter() - started) * 1000, error=str(e)
+                )
+                return
+
+            with self._lock:
+                self.completed += 1
+            if job.kind == INFO:
+                return
+            stored = get_market_store().date_range(job.symbol)
+            crud.record_ingestion_result(
+                db, job.symbol, success=True,
+                duration_ms=(time.perf_counter() - started) * 1000,
+                last_bar_date=stored[1] if stored else None
+            )
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "periodic": self.periodic,
+                "queued": self._queue.qsize(),
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "last_eod_date": self.last_eod_date.isoformat() if self.last_eod_date else None,
+                "rate_limiter": upstream_limiter.stats(),
+            }
+
+
+_scheduler: Optional[IngestionScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_ingestion_scheduler() -> IngestionScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = IngestionScheduler()
+        return _scheduler
+
+
+def shutdown_ingestion_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
@@ -0,0 +1,354 @@
+"""
+横截面选股
+
+对整个股票池按表达式筛选和排序，例如：
+    rsi14 < 30 and volume > 2 * avg_volume20 and close > sma200
+表达式用 ast 解析，只允许字段名、数字、算术、比较和 and/or/not，在 (股票 × 字段) 的矩阵上
+以 NumPy 向量运算求值，不执行任意代码。
+
+可用字段：
+    open / high / low / close / volume   最新一根K线（前复权）
+    change_pct                           相对前一根K线收盘价的涨跌幅（%）
+    avg_volumeN                          最近 N 根K线的平均成交量
+    sma50、ema20、rsi14、atr14、macd、macd_signal、macd_diff、bb20_upper/middle/lower 等技术指标
+    market_cap / pe_ratio / dividend_yield / beta                证券主数据
+
+矩阵按字段列缓存，只重算有新K线的股票所在的行；检查数据版本的间隔为 SCREENER_REFRESH_INTERVAL 秒。
+只使用本地已有的数据，不访问上游数据源。
+"""
+import ast
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .. import config
+from .corporate_actions import data_version, read_frame
+from .indicators import IndicatorSpec, indicator_cache, parse_indicator
+from .market_store import get_market_store
+from .security_master import security_master
+
+BAR_FIELDS = ["open", "high", "low", "close", "volume"]
+FUNDAMENTAL_FIELDS = ["market_cap", "pe_ratio", "dividend_yield", "beta"]
+
+AVG_VOLUME_PATTERN = re.compile(r"^avg_volume(\d+)$")
+# 多列指标的输出列后缀，如 bb20_upper、macd_signal
+INDICATOR_COLUMN_PATTERN = re.compile(r"^([a-z]+\d*)(_upper|_middle|_lower|_signal|_diff)?$")
+
+MAX_EXPRESSION_LENGTH = 500
+
+_COMPARE_OPS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+}
+
+
+@dataclass(frozen=True)
+class Feature:
+    """选股字段：source 为 bar / change / avg_volume / indicator / fundamental"""
+    name: str
+    source: str
+    window: int = 0
+    indicator: Optional[IndicatorSpec] = None
+
+
+def parse_feature(name: str) -> Feature:
+    """解析字段名，无法识别时抛出 ValueError"""
+    if name in BAR_FIELDS:
+        return Feature(name=name, source="bar")
+    if name == "change_pct":
+        return Feature(name=name, source="change", window=2)
+    if name in FUNDAMENTAL_FIELDS:
+        return Feature(name=name, source="fundamental")
+    match = AVG_VOLUME_PATTERN.match(name)
+    if match:
+        window = int(match.group(1))
+        if window <= 0 or window > 1000:
+            raise ValueError(f"窗口超出范围: {name}")
+        return Feature(name=name, source="avg_volume", window=window)
+    match = INDICATOR_COLUMN_PATTERN.match(name)
+    if match:
+        try:
+            spec = parse_indicator(match.group(1))
+        except ValueError:
+            pass
+        else:
+            column = spec.name + (match.group(2) or "")
+            if column == name and column in _indicator_columns(spec):
+                return Feature(name=name, source="indicator", indicator=spec)
+    raise ValueError(f"不支持的字段: {name}")
+
+
+def _indicator_columns(spec: IndicatorSpec) -> List[str]:
+    if spec.kind == "macd":
+        return [spec.name, f"{spec.name}_signal", f"{spec.name}_diff"]
+    if spec.kind == "bb":
+        return [f"{spec.name}_upper", f"{spec.name}_middle", f"{spec.name}_lower"]
+    return [spec.name]
+
+
+class ScreenExpression:
+    """解析并校验选股表达式，在列数组上向量化求值"""
+
+    def __init__(self, source: str):
+        if not source or not source.strip():
+            raise ValueError("表达式不能为空")
+        if len(source) > MAX_EXPRESSION_LENGTH:
+            raise ValueError(f"表达式过长，最多 {MAX_EXPRESSION_LENGTH} 个字符")
+        self.source = source.strip()
+        try:
+            self.tree = ast.parse(self.source, mode="eval").body
+        except SyntaxError as e:
+            raise ValueError(f"表达式语法错误: {e.msg}")
+        self.features: Dict[str, Feature] = {}
+        self._check(self.tree)
+
+    def _check(self, node: ast.AST):
+        if isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub, ast.UAdd)):
+            self._check(node.operand)
+        elif isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.Compare) and all(type(op) in _COMPARE_OPS for op in node.ops):
+            self._check(node.left)
+            for comparator in node.comparators:
+                self._check(comparator)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            pass
+        elif isinstance(node, ast.Name):
+            if node.id not in self.features:
+                self.features[node.id] = parse_feature(node.id)
+        else:
+            raise ValueError(f"表达式中不支持的语法: {ast.dump(node)[:40]}")
+
+    def matches(self, columns: Dict[str, np.ndarray], size: int) -> np.ndarray:
+        """求值为布尔掩码，表达式是常量时广播到 size 行"""
+        return np.broadcast_to(_as_bool(self.evaluate(columns)), (size,))
+
+    def evaluate(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._evaluate(self.tree, columns)
+
+    def _evaluate(self, node: ast.AST, columns: Dict[str, np.ndarray]):
+        if isinstance(node, ast.BoolOp):
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            result = _as_bool(self._evaluate(node.values[0], columns))
+            for value in node.values[1:]:
+                result = combine(result, _as_bool(self._evaluate(value, columns)))
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, columns)
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(_as_bool(operand))
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.BinOp):
+            return _BINARY_OPS[type(node.op)](self._evaluate(node.left, columns), self._evaluate(node.right, columns))
+        if isinstance(node, ast.Compare):
+            # 链式比较 a < b < c 等价于 a < b and b < c
+            left = self._evaluate(node.left, columns)
+            result = None
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._evaluate(comparator, columns)
+                current = _COMPARE_OPS[type(op)](left, right)
+                result = current if result is None else np.logical_and(result, current)
+                left = right
+            return result
+        if isinstance(node, ast.Constant):
+            return float(node.value)
+        return columns[node.id]
+
+
+def _as_bool(values) -> np.ndarray:
+    # 数值按非零且非 NaN 视为真
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return np.logical_and(values != 0, ~np.isnan(values))
+
+
+class ScreenerMatrix:
+    """(股票 × 字段) 的最新值矩阵，按列缓存，按股票的数据版本增量刷新行"""
+
+    def __init__(self, refresh_interval: float = config.SCREENER_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._symbols: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}
+        self._features: Dict[str, Feature] = {}
+        self._dates = np.array([], dtype="datetime64[ns]")
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._checked_at = 0.0
+        self.row_updates = 0
+        self.column_builds = 0
+
+    def snapshot(self, symbols: List[str], features: Dict[str, Feature]) -> Tuple[List[str], np.ndarray, Dict[str, np.ndarray]]:
+        """返回 (股票, 最新K线日期, 字段列)，基本面字段每次从证券主数据读取"""
+        stored = [feature for feature in features.values() if feature.source != "fundamental"]
+        with self._lock:
+            self._set_universe(symbols)
+            # 先补齐新字段的整列（尚未计算过的行留给下面的行刷新），再刷新有新数据的行
+            for feature in stored:
+                if feature.name not in self._columns:
+                    self._features[feature.name] = feature
+                    self._columns[feature.name] = np.array(
+                        [
+                            self._latest(symbol, [feature])[feature.name] if symbol in self._versions else np.nan
+                            for symbol in self._symbols
+                        ],
+                        dtype=float
+                    )
+                    self.column_builds += 1
+
+            now = time.monotonic()
+            if now - self._checked_at >= self.refresh_interval:
+                self._checked_at = now
+                self._refresh_rows()
+
+            columns = {feature.name: self._columns[feature.name].copy() for feature in stored}
+            dates = self._dates.copy()
+
+        for feature in features.values():
+            if feature.source == "fundamental":
+                columns[feature.name] = np.array(
+                    [_fundamental(symbol, feature.name) for symbol in symbols], dtype=float
+                )
+        return list(symbols), dates, columns
+
+    def _set_universe(self, symbols: List[str]):
+        if symbols == self._symbols:
+            return
+        # 保留已有股票的行，新股票的行置为 NaN 并在下次刷新时计算
+        order = np.array([self._positions.get(symbol, -1) for symbol in symbols], dtype=int)
+        existing = order >= 0
+        for name, values in self._columns.items():
+            column = np.full(len(symbols), np.nan)
+            column[existing] = values[order[existing]]
+            self._columns[name] = column
+        dates = np.full(len(symbols), np.datetime64("NaT"), dtype="datetime64[ns]")
+        dates[existing] = self._dates[order[existing]]
+        self._dates = dates
+        self._symbols = list(symbols)
+        self._positions = {symbol: i for i, symbol in enumerate(symbols)}
+        self._versions = {symbol: version for symbol, version in self._versions.items() if symbol in self._positions}
+        self._checked_at = 0.0
+
+    def _refresh_rows(self):
+        features = list(self._features.values())
+        for symbol, position in self._positions.items():
+            version = data_version(symbol)
+            if self._versions.get(symbol) == version:
+                continue
+            values = self._latest(symbol, features)
+            for feature in features:
+                self._columns[feature.name][position] = values[feature.name]
+            self._dates[position] = values["date"]
+            self._versions[symbol] = version
+            self.row_updates += 1
+
+    @staticmethod
+    def _latest(symbol: str, features: List[Feature]) -> Dict[str, Any]:
+        """计算一只股票各字段的最新值，没有数据时为 NaN"""
+        values: Dict[str, Any] = {feature.name: np.nan for feature in features}
+        values["date"] = np.datetime64("NaT")
+        stored = get_market_store().date_range(symbol)
+        if stored is None:
+            return values
+
+        window = max([feature.window for feature in features if feature.source in ("change", "avg_volume")] + [1])
+        # 交易日换算为自然日，多取一些以覆盖节假日
+        bars = read_frame(symbol, stored[1] - timedelta(days=int(window * 1.5) + 10), stored[1])
+        if bars.empty:
+            return values
+        values["date"] = bars.index[-1].to_datetime64()
+
+        for feature in features:
+            if feature.source == "bar":
+                values[feature.name] = float(bars[feature.name.capitalize()].iloc[-1])
+            elif feature.source == "change":
+                closes = bars["Close"].to_numpy(dtype=float)
+                if len(closes) >= 2 and closes[-2]:
+                    values[feature.name] = (closes[-1] / closes[-2] - 1) * 100
+            elif feature.source == "avg_volume":
+                volumes = bars["Volume"].to_numpy(dtype=float)
+                if len(volumes) >= feature.window:
+                    values[feature.name] = float(volumes[-feature.window:].mean())
+            elif feature.source == "indicator":
+                series = indicator_cache.get(symbol, feature.indicator)
+                if not series.empty:
+                    values[feature.name] = float(series[feature.name].iloc[-1])
+        return values
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "symbols": len(self._symbols),
+            "features": len(self._columns),
+            "row_updates": self.row_updates,
+            "column_builds": self.column_builds,
+        }
+
+
+def _fundamental(symbol: str, field: str) -> float:
+    security = security_master.get(symbol)
+    value = getattr(security, field, None) if security is not None else None
+    return float(value) if value else np.nan
+
+
+screener_matrix = ScreenerMatrix()
+
+
+def run_screen(
+    symbols: List[str],
+    expression: str,
+    sort_by: Optional[str] = None,
+    descending: bool = True,
+    limit: int = 50
+) -> Dict[str, Any]:
+    """在 symbols 上执行选股，返回命中的股票及表达式中用到的字段值"""
+    screen = ScreenExpression(expression)
+    ranking = ScreenExpression(sort_by) if sort_by else None
+    features = dict(screen.features)
+    if ranking is not None:
+        features.update(ranking.features)
+
+    symbols, dates, columns = screener_matrix.snapshot(symbols, features)
+    matched = np.flatnonzero(screen.matches(columns, len(symbols)))
+
+    if ranking is not None and len(matched):
+        scores = np.broadcast_to(np.asarray(ranking.evaluate(columns), dtype=float), (len(symbols),))[matched]
+        # NaN 排在最后
+        keys = np.where(np.isnan(scores), np.inf, -scores if descending else scores)
+        matched = matched[np.argsort(keys, kind="stable")]
+
+    results = []
+    for position in matched[:limit]:
+        row = {
+            "symbol": symbols[position],
+            "name": security_master.name(symbols[position]),
+            "date": None if np.isnat(dates[position]) else str(np.datetime_as_string(dates[position], unit="D")),
+        }
+        row.update({
+            name: None if np.isnan(column[position]) else float(column[position])
+            for name, column in columns.items()
+        })
+        results.append(row)
+
+    return {"expression": screen.source, "total": len(symbols), "matched": int(len(matched)), "results": results}
@@ -0,0 +1,191 @@
+"""
+股票代码和公司名称搜索
+
+为输入联想提供内存索引，随证券主数据的更新增量维护：
+    代码前缀   前缀树，节点上保存按市值排序的股票列表，取前 K 个即可
+    名称前缀   同样的前缀树，按名称中的每个单词建立
+    模糊匹配   三元组倒排索引，前缀结果不足 K 个时按三元组重合比例补充
+"""
+import bisect
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+# 模糊匹配要求的最低三元组重合比例
+MIN_TRIGRAM_SIMILARITY = 0.3
+# 出现在过多股票中的三元组（如 "inc"）区分度低，模糊匹配时跳过，避免遍历大部分索引
+MAX_TRIGRAM_POSTINGS = 500
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# 排序键：(-市值, 代码)，市值大的排在前面
+Rank = Tuple[float, str]
+
+
+class _TrieNode:
+    __slots__ = ("children", "ranked")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.ranked: List[Rank] = []
+
+
+class _Trie:
+    """前缀树，每个节点保存经过它的所有股票，按排序键有序"""
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def insert(self, key: str, rank: Rank):
+        node = self.root
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            position = bisect.bisect_left(node.ranked, rank)
+            if position == len(node.ranked) or node.ranked[position] != rank:
+                node.ranked.insert(position, rank)
+
+    def remove(self, key: str, rank: Rank):
+        path = []
+        node = self.root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                return
+            path.append((node, char, child))
+            node = child
+        for parent, char, child in reversed(path):
+            position = bisect.bisect_left(child.ranked, rank)
+            if position < len(child.ranked) and child.ranked[position] == rank:
+                child.ranked.pop(position)
+            if not child.ranked and not child.children:
+                del parent.children[char]
+
+    def prefix(self, key: str) -> List[Rank]:
+        node = self.root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.ranked
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymbolIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tickers = _Trie()
+        self._names = _Trie()
+        self._trigrams: Dict[str, Set[str]] = {}
+        # symbol -> (排序键, 名称, 行业, 名称中的单词)
+        self._entries: Dict[str, Tuple[Rank, str, str, Tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def upsert(self, symbol: str, name: str = "", sector: str = "", market_cap: Optional[float] = None):
+        """加入或更新一只股票，只改动该股票相关的索引项"""
+        symbol = symbol.upper()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            rank = (-(market_cap or 0.0), symbol)
+            if entry is not None:
+                if entry[0] == rank and entry[1] == name:
+                    self._entries[symbol] = (rank, name, sector, entry[3])
+                    return
+                self._remove(symbol)
+
+            words = tuple(sorted(set(_words(name))))
+            self._entries[symbol] = (rank, name, sector, words)
+            self._tickers.insert(symbol.lower(), rank)
+            for word in words:
+                self._names.insert(word, rank)
+            for trigram in _trigrams(f"{symbol} {name}"):
+                self._trigrams.setdefault(trigram, set()).add(symbol)
+
+    def remove(self, symbol: str):
+        with self._lock:
+            self._remove(symbol.upper())
+
+    def _remove(self, symbol: str):
+        entry = self._entries.pop(symbol, None)
+        if entry is None:
+            return
+        rank, name, _, words = entry
+        self._tickers.remove(symbol.lower(), rank)
+        for word in words:
+            self._names.remove(word, rank)
+        for trigram in _trigrams(f"{symbol} {name}"):
+            symbols = self._trigrams.get(trigram)
+            if symbols is not None:
+                symbols.discard(symbol)
+                if not symbols:
+                    del self._trigrams[trigram]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        """按 代码完全匹配 > 代码前缀 > 名称单词前缀 > 模糊匹配 的顺序返回前 limit 个结果"""
+        query = query.strip().lower()
+        if not query or limit <= 0:
+            return []
+
+        results: List[Dict[str, str]] = []
+        seen: Set[str] = set()
+
+        def add(symbol: str, match: str) -> bool:
+            if symbol not in seen:
+                seen.add(symbol)
+                _, name, sector, _ = self._entries[symbol]
+                results.append({"symbol": symbol, "name": name, "sector": sector, "match": match})
+            return len(results) >= limit
+
+        with self._lock:
+            ticker = query.upper()
+            if ticker in self._entries and add(ticker, "symbol"):
+                return results
+
+            for _, symbol in self._tickers.prefix(query):
+                if add(symbol, "symbol_prefix"):
+                    return results
+
+            words = _words(query)
+            if words:
+                # 每个单词都要是名称中某个单词的前缀；从候选最少的单词开始遍历，其余单词逐个检查
+                words = sorted(set(words), key=lambda word: len(self._names.prefix(word)))
+                candidates, others = self._names.prefix(words[0]), words[1:]
+                for _, symbol in candidates:
+                    symbol_words = self._entries[symbol][3]
+                    if all(any(w.startswith(word) for w in symbol_words) for word in others) and add(symbol, "name_prefix"):
+                        return results
+
+            query_trigrams = _trigrams(query)
+            postings = sorted((self._trigrams.get(trigram, ()) for trigram in query_trigrams), key=len)
+            counts: Dict[str, int] = {}
+            for position, symbols in enumerate(postings):
+                if position and len(symbols) > MAX_TRIGRAM_POSTINGS:
+                    break
+                for symbol in symbols:
+                    if symbol not in seen:
+                        counts[symbol] = counts.get(symbol, 0) + 1
+            scored = sorted(
+                (-(count / len(query_trigrams)), self._entries[symbol][0], symbol)
+                for symbol, count in counts.items()
+                if count / len(query_trigrams) >= MIN_TRIGRAM_SIMILARITY
+            )
+            for _, _, symbol in scored:
+                if add(symbol, "fuzzy"):
+                    break
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"symbols": len(self._entries), "trigrams": len(self._trigrams)}
+
+
+symbol_index = SymbolIndex()
@@ -0,0 +1,162 @@
+"""
+证券主数据
+
+名称、行业和基本面指标保存在 securities 表中，由行情更新调度器在后台定期从数据源刷新。
+请求路径只读取内存缓存（未命中时读数据库），不访问上游数据源；
+未同步过的股票记录下来（只记录格式合法的代码，数量有上限），由调度器安排刷新。
+调度器没有运行时，/info 接口通过 refresh_once 在请求中限流刷新一次。
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from .. import config, crud, schemas
+from ..database import SessionLocal
+from .providers import get_provider
+from .rate_limit import upstream_limiter
+from .search import symbol_index
+from .strategy_analyzer import SYMBOL_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# 数据源返回的信息字段 -> 表字段
+_INFO_FIELDS = {"52_week_high": "week_52_high", "52_week_low": "week_52_low"}
+
+
+def _to_info(security: schemas.Security) -> Dict[str, Any]:
+    """转为 /info 接口原有的字段格式"""
+    info = security.model_dump()
+    for info_key, field in _INFO_FIELDS.items():
+        info[info_key] = info.pop(field)
+    return info
+
+
+def _from_info(symbol: str, info: Dict[str, Any]) -> schemas.SecurityCreate:
+    values = {_INFO_FIELDS.get(key, key): value for key, value in info.items()}
+    values["symbol"] = symbol
+    # 数据源缺失的字段可能是 None
+    fields = schemas.SecurityCreate.model_fields
+    values = {key: value for key, value in values.items() if key in fields and value is not None}
+    return schemas.SecurityCreate(**values)
+
+
+class SecurityMaster:
+    """证券主数据的内存读穿缓存"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._securities: Dict[str, schemas.Security] = {}
+        self._loaded = False
+        self._missing: Set[str] = set()
+
+    def _load_all(self):
+        """首次使用时一次性加载全表，证券数量不大"""
+        if self._loaded:
+            return
+        db = SessionLocal()
+        try:
+            securities = crud.get_securities(db)
+        finally:
+            db.close()
+        with self._lock:
+            for security in securities:
+                if security.symbol not in self._securities:
+                    self._securities[security.symbol] = schemas.Security.model_validate(security)
+                    self._index(self._securities[security.symbol])
+            self._loaded = True
+
+    @staticmethod
+    def _index(security: schemas.Security):
+        symbol_index.upsert(security.symbol, security.name, security.sector, security.market_cap)
+
+    def get(self, symbol: str) -> Optional[schemas.Security]:
+        symbol = symbol.strip().upper()
+        self._load_all()
+        with self._lock:
+            security = self._securities.get(symbol)
+            if (
+                security is None
+                and SYMBOL_PATTERN.match(symbol)
+                and len(self._missing) < config.SECURITY_MISSING_MAX
+            ):
+                self._missing.add(symbol)
+            return security
+
+    def info(self, symbol: str) -> Optional[Dict[str, Any]]:
+        security = self.get(symbol)
+        return _to_info(security) if security is not None else None
+
+    def name(self, symbol: str) -> str:
+        security = self.get(symbol)
+        return security.name if security is not None and security.name else f"{symbol} 公司"
+
+    def names(self, symbols: Iterable[str]) -> Dict[str, str]:
+        return {symbol: self.name(symbol) for symbol in symbols}
+
+    def sector(self, symbol: str) -> str:
+        security = self.get(symbol)
+        return security.sector if security is not None else ""
+
+    def take_missing(self) -> List[str]:
+        """取出请求中遇到的未同步股票，交给调度器刷新"""
+        with self._lock:
+            missing, self._missing = sorted(self._missing), set()
+            return missing
+
+    def stale(self, symbols: Iterable[str], ttl: float = config.SECURITY_REFRESH_TTL) -> List[str]:
+        """返回从未同步或超过 ttl 未刷新的股票"""
+        self._load_all()
+        threshold = datetime.utcnow() - timedelta(seconds=ttl)
+        with self._lock:
+            return [
+                symbol for symbol in symbols
+                if symbol not in self._securities
+                or self._securities[symbol].updated_at is None
+                or self._securities[symbol].updated_at < threshold
+            ]
+
+    def refresh(self, db: Session, symbol: str) -> schemas.Security:
+        """从数据源获取最新信息并写入数据库，只在后台任务中调用"""
+        symbol = symbol.strip().upper()
+        upstream_limiter.acquire()
+        return self._fetch(db, symbol)
+
+    def refresh_once(self, symbol: str) -> Optional[schemas.Security]:
+        """调度器没有运行时在请求中刷新一次；等不到限流令牌或数据源失败时返回 None"""
+        symbol = symbol.strip().upper()
+        if not SYMBOL_PATTERN.match(symbol):
+            return None
+        if not upstream_limiter.acquire(timeout=config.SECURITY_INLINE_REFRESH_TIMEOUT):
+            return None
+        db = SessionLocal()
+        try:
+            return self._fetch(db, symbol)
+        except Exception:
+            db.rollback()
+            logger.warning("获取 %s 的证券信息失败", symbol, exc_info=True)
+            return None
+        finally:
+            db.close()
+
+    def _fetch(self, db: Session, symbol: str) -> schemas.Security:
+        info = get_provider().fetch_info(symbol)
+        security = schemas.Security.model_validate(crud.upsert_security(db, _from_info(symbol, info)))
+        with self._lock:
+            self._securities[symbol] = security
+            self._missing.discard(symbol)
+        self._index(security)
+        return security
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        self._load_all()
+        return symbol_index.search(query, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"securities": len(self._securities), "missing": len(self._missing), "index": symbol_index.stats()}
+
+
+security_master = SecurityMaster()
@@ -0,0 +1,138 @@
+"""
+行情数据的响应格式
+
+K线数据直接从列数组序列化，不为每一行创建 Pydantic 对象。支持的格式：
+    json      逐行的对象数组（默认，与原接口兼容）
+    columnar  按字段的数组，application/vnd.qvanish.columnar+json
+    arrow     Arrow IPC 流，application/vnd.apache.arrow.stream（需要 pyarrow）
+    msgpack   按字段的数组，日期为毫秒时间戳，application/msgpack（需要 msgpack）
+格式由 format 查询参数指定，未指定时按 Accept 请求头协商。
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException, Request, Response
+
+BAR_FIELDS = ["open", "high", "low", "close", "volume"]
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.qvanish.columnar+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "msgpack": "application/msgpack",
+}
+
+# Accept 请求头中可以识别的类型
+ACCEPT_TYPES = {
+    "application/json": "json",
+    "application/vnd.qvanish.columnar+json": "columnar",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+
+def negotiate_format(request: Request, format: Optional[str] = None) -> str:
+    """确定响应格式，无法满足时抛出 406"""
+    if format:
+        format = format.lower()
+        if format not in MEDIA_TYPES:
+            raise HTTPException(status_code=406, detail=f"不支持的格式: {format}，可选: {', '.join(MEDIA_TYPES)}")
+        return format
+
+    # 按 q 值从高到低选择第一个支持的类型
+    candidates = []
+    for position, item in enumerate(request.headers.get("accept", "").split(",")):
+        parts = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, parts[0].lower()))
+    for quality, _, media_type in sorted(candidates):
+        if quality < 0 and media_type in ACCEPT_TYPES:
+            return ACCEPT_TYPES[media_type]
+    return "json"
+
+
+def frame_columns(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """把 Open/High/... 列名的 DataFrame 转为小写字段名的列数组"""
+    columns = {"date": pd.DatetimeIndex(frame.index).to_numpy(dtype="datetime64[ns]")}
+    for field in BAR_FIELDS:
+        if field.capitalize() in frame:
+            columns[field] = frame[field.capitalize()].to_numpy(dtype=float)
+    return columns
+
+
+def _float_list(values: np.ndarray) -> List[Optional[float]]:
+    items = values.tolist()
+    if np.isnan(values).any():
+        items = [None if value != value else value for value in items]
+    return items
+
+
+def _iso_dates(dates: np.ndarray) -> List[str]:
+    return np.datetime_as_string(dates, unit="s").tolist()
+
+
+def render_columns(
+    columns: Dict[str, np.ndarray],
+    format: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    rows_key: Optional[str] = None
+) -> Response:
+    """
+    按指定格式序列化列数据。
+    metadata 是附加的标量字段（如 symbol、interval）；json 格式下 rows_key 为 None 时直接返回行数组，
+    否则把行数组放在 rows_key 字段中。
+    """
+    metadata = metadata or {}
+    fields = [field for field in columns if field != "date"]
+
+    if format == "json":
+        dates = _iso_dates(columns["date"])
+        values = [_float_list(columns[field]) for field in fields]
+        # 直接返回行数组时每行带上股票代码，与原来的 MarketDataBase 结构一致
+        constant = {"symbol": metadata["symbol"]} if rows_key is None and "symbol" in metadata else {}
+        rows = [
+            {**constant, "date": date, **dict(zip(fields, row))}
+            for date, *row in zip(dates, *values)
+        ]
+        body = rows if rows_key is None else {**metadata, rows_key: rows}
+        return Response(json.dumps(body, ensure_ascii=False), media_type=MEDIA_TYPES["json"])
+
+    if format == "columnar":
+        body = {**metadata, "date": _iso_dates(columns["date"])}
+        body.update({field: _float_list(columns[field]) for field in fields})
+        return Response(json.dumps(body, ensure_ascii=False), media_type=MEDIA_TYPES["columnar"])
+
+    if format == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise HTTPException(status_code=406, detail="服务器未安装 pyarrow，无法输出 Arrow 格式")
+        table = pa.table(
+            {"date": pa.array(columns["date"], type=pa.timestamp("ns")), **{field: columns[field] for field in fields}}
+        )
+        table = table.replace_schema_metadata({key: str(value) for key, value in metadata.items()})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=MEDIA_TYPES["arrow"])
+
+    if format == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise HTTPException(status_code=406, detail="服务器未安装 msgpack，无法输出 msgpack 格式")
+        body = {**metadata, "date": columns["date"].astype("datetime64[ms]").astype(np.int64).tolist()}
+        body.update({field: columns[field].tolist() for field in fields})
+        return Response(msgpack.packb(body, use_bin_type=True), media_type=MEDIA_TYPES["msgpack"])
+
+    raise HTTPException(status_code=406, detail=f"不支持的格式: {format}")
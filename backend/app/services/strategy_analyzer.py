@@ -0,0 +1,211 @@
+"""
+策略代码静态分析，从策略源码中推断回测所需的行情数据
+"""
+import ast
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from .indicators import parse_indicator
+
+# 行情数据中可用的字段
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# 股票代码格式，如 AAPL、BRK-B、600519.SS
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9]{1,6}([.\-][A-Z0-9]{1,3})?$")
+
+# 参数名中包含这些关键字时视为窗口长度
+WINDOW_KEYWORDS = ("window", "period", "span", "lookback", "length")
+
+# 会产生回看窗口的 pandas 方法
+WINDOW_METHODS = {"rolling", "ewm", "shift", "diff", "pct_change", "tail", "expanding"}
+
+# 回测引擎按 {symbol}_data / {symbol}_price 注入的变量
+ENGINE_VARIABLE = re.compile(r"^([A-Z0-9]+)_(data|price)$")
+
+
+@dataclass
+class StrategyDataRequirements:
+    """策略的数据需求"""
+    symbols: List[str] = field(default_factory=list)
+    columns: List[str] = field(default_factory=list)
+    windows: List[int] = field(default_factory=list)
+    lookback: int = 0
+    indicators: List[str] = field(default_factory=list)
+
+    def warmup_days(self) -> int:
+        """把交易日回看窗口换算为需要额外获取的自然日数（考虑周末和节假日）"""
+        if self.lookback <= 0:
+            return 0
+        return int(self.lookback * 1.5) + 5
+
+
+class _StrategyVisitor(ast.NodeVisitor):
+    def __init__(self, parameters: Dict[str, Any]):
+        self.parameters = parameters
+        self.names: Dict[str, Any] = {}
+        self.symbols: List[str] = []
+        self.columns: Set[str] = set()
+        self.windows: Set[int] = set()
+        self.indicators: List[str] = []
+
+    # 常量求值：支持字面量、已知变量和简单算术
+    def evaluate(self, node: Optional[ast.AST]) -> Any:
+        if node is None:
+            return None
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, (ast.List, ast.Tuple)):
+            return [self.evaluate(item) for item in node.elts]
+        if isinstance(node, ast.Name):
+            return self.names.get(node.id)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = self.evaluate(node.operand)
+            return -value if isinstance(value, (int, float)) else None
+        if isinstance(node, ast.BinOp):
+            left, right = self.evaluate(node.left), self.evaluate(node.right)
+            if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+                if isinstance(node.op, ast.Add):
+                    return left + right
+                if isinstance(node.op, ast.Sub):
+                    return left - right
+                if isinstance(node.op, ast.Mult):
+                    return left * right
+            return None
+        if isinstance(node, ast.Call):
+            return self.evaluate_parameter_lookup(node)
+        if isinstance(node, ast.Subscript) and self.is_parameters(node.value):
+            key = self.evaluate(node.slice)
+            return self.parameters.get(key) if isinstance(key, str) else None
+        return None
+
+    def is_parameters(self, node: ast.AST) -> bool:
+        return isinstance(node, ast.Name) and node.id == "parameters"
+
+    def evaluate_parameter_lookup(self, node: ast.Call) -> Any:
+        """parameters.get('key', default) -> 实际参数值或默认值"""
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr == "get" and self.is_parameters(func.value)):
+            return None
+        if not node.args:
+            return None
+        key = self.evaluate(node.args[0])
+        if isinstance(key, str) and key in self.parameters:
+            return self.parameters[key]
+        return self.evaluate(node.args[1]) if len(node.args) > 1 else None
+
+    def add_symbol(self, value: Any):
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if isinstance(item, str) and SYMBOL_PATTERN.match(item) and item not in self.symbols:
+                self.symbols.append(item)
+
+    def add_window(self, value: Any):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            window = abs(int(value))
+            if window > 0:
+                self.windows.add(window)
+
+    def add_indicator(self, value: Any):
+        """记录可以预先计算的指标，bb20_upper 之类的输出列归到对应指标"""
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if not isinstance(item, str):
+                continue
+            try:
+                name = parse_indicator(item.split("_")[0]).name
+            except ValueError:
+                continue
+            if name not in self.indicators:
+                self.indicators.append(name)
+
+    def visit_Assign(self, node: ast.Assign):
+        self.generic_visit(node)
+        value = self.evaluate(node.value)
+        for target in node.targets:
+            if not isinstance(target, ast.Name):
+                continue
+            self.names[target.id] = value
+            name = target.id.lower()
+            if name in ("symbol", "symbols", "ticker", "tickers"):
+                self.add_symbol(value)
+            elif any(keyword in name for keyword in WINDOW_KEYWORDS):
+                self.add_window(value)
+
+    def visit_Constant(self, node: ast.Constant):
+        if node.value in OHLCV_COLUMNS:
+            self.columns.add(node.value)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        if node.attr in OHLCV_COLUMNS:
+            self.columns.add(node.attr)
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name):
+        match = ENGINE_VARIABLE.match(node.id)
+        if match:
+            self.add_symbol(match.group(1))
+
+    def visit_Subscript(self, node: ast.Subscript):
+        self.generic_visit(node)
+        # market_data['AAPL']
+        if isinstance(node.value, ast.Name) and node.value.id == "market_data":
+            self.add_symbol(self.evaluate(node.slice))
+        # indicators['AAPL']['rsi14']
+        if isinstance(node.value, ast.Subscript) and isinstance(node.value.value, ast.Name) and node.value.value.id == "indicators":
+            self.add_indicator(self.evaluate(node.slice))
+        # data.iloc[-(N+1):-1] 之类的切片同样构成回看窗口
+        if isinstance(node.slice, ast.Slice):
+            for bound in (node.slice.lower, node.slice.upper):
+                value = self.evaluate(bound)
+                if isinstance(value, int) and value < 0:
+                    self.add_window(value)
+
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        func = node.func
+        if isinstance(func, ast.Attribute):
+            if func.attr == "get" and isinstance(func.value, ast.Name) and func.value.id == "market_data" and node.args:
+                self.add_symbol(self.evaluate(node.args[0]))
+            if func.attr in WINDOW_METHODS and node.args:
+                self.add_window(self.evaluate(node.args[0]))
+        for keyword in node.keywords:
+            # min_periods 只是最少观测数，不构成回看窗口
+            if keyword.arg and keyword.arg != "min_periods" and any(word in keyword.arg for word in WINDOW_KEYWORDS):
+                self.add_window(self.evaluate(keyword.value))
+
+
+def analyze_strategy(code: Optional[str], parameters: Optional[Dict[str, Any]] = None) -> StrategyDataRequirements:
+    """分析策略代码，返回其引用的股票代码、行情字段、指标窗口、最大回看长度和可预先计算的指标"""
+    parameters = parameters or {}
+    visitor = _StrategyVisitor(parameters)
+
+    # 参数中显式给出的股票代码和窗口优先
+    for key in ("symbols", "symbol"):
+        if key in parameters:
+            visitor.add_symbol(parameters[key])
+    for key, value in parameters.items():
+        if any(keyword in key.lower() for keyword in WINDOW_KEYWORDS):
+            visitor.add_window(value)
+    if "indicators" in parameters:
+        visitor.add_indicator(parameters["indicators"])
+
+    if code:
+        try:
+            visitor.visit(ast.parse(code))
+        except SyntaxError:
+            # 语法错误留给回测引擎报告，这里退化为获取全部字段
+            visitor.columns = set(OHLCV_COLUMNS)
+
+    # 未引用任何字段时无法判断，保守地获取全部字段；收盘价是引擎估值必需的
+    columns = visitor.columns or set(OHLCV_COLUMNS)
+    columns.add("Close")
+
+    windows = sorted(visitor.windows)
+    return StrategyDataRequirements(
+        symbols=visitor.symbols,
+        columns=[column for column in OHLCV_COLUMNS if column in columns],
+        windows=windows,
+        lookback=windows[-1] if windows else 0,
+        indicators=visitor.indicators,
+    )
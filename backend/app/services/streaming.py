@@ -0,0 +1,151 @@
+"""
+实时行情推送
+
+每个股票只有一个后台轮询任务，按固定间隔从数据源获取报价，
+价格变化时把变化的字段广播给所有订阅者。每个连接有独立的有界队列，
+慢速客户端的队列满时丢弃最旧的消息，不会阻塞轮询任务和其他连接。
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from .. import config
+from .cache import quote_cache
+from .latest_quotes import STREAM, latest_quotes
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+# 比较报价是否变化时使用的字段
+QUOTE_FIELDS = ["price", "change", "change_percent", "volume", "time"]
+
+
+class Subscriber:
+    """一个 WebSocket 连接的订阅状态"""
+
+    def __init__(self, queue_size: int = config.STREAM_QUEUE_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.symbols: Set[str] = set()
+        self.dropped = 0
+
+    def send(self, message: Dict[str, Any]):
+        """非阻塞地放入消息，队列已满时丢弃最旧的一条"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(message)
+
+    async def receive(self) -> Dict[str, Any]:
+        return await self.queue.get()
+
+
+class PriceStreamHub:
+    """管理所有股票的轮询任务和订阅关系"""
+
+    def __init__(self, interval: float = config.STREAM_POLL_INTERVAL):
+        self.interval = interval
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self._pollers: Dict[str, asyncio.Task] = {}
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+    def subscribe(self, subscriber: Subscriber, symbol: str):
+        if symbol in subscriber.symbols:
+            return
+        subscriber.symbols.add(symbol)
+        self._subscribers.setdefault(symbol, set()).add(subscriber)
+
+        # 新订阅者先收到完整的最新报价
+        last = self._last.get(symbol)
+        if last is not None:
+            subscriber.send({"type": "snapshot", "symbol": symbol, **last})
+
+        if symbol not in self._pollers:
+            self._pollers[symbol] = asyncio.create_task(self._poll(symbol))
+
+    def unsubscribe(self, subscriber: Subscriber, symbol: str):
+        subscriber.symbols.discard(symbol)
+        subscribers = self._subscribers.get(symbol)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            # 最后一个订阅者离开后停止轮询
+            del self._subscribers[symbol]
+            self._last.pop(symbol, None)
+            poller = self._pollers.pop(symbol, None)
+            if poller is not None:
+                poller.cancel()
+
+    def disconnect(self, subscriber: Subscriber):
+        for symbol in list(subscriber.symbols):
+            self.unsubscribe(subscriber, symbol)
+
+    def _broadcast(self, symbol: str, quote: Dict[str, Any]):
+        last = self._last.get(symbol)
+        if last is None:
+            message = {"type": "snapshot", "symbol": symbol, **quote}
+        else:
+            delta = {field: quote[field] for field in QUOTE_FIELDS if quote.get(field) != last.get(field)}
+            if not delta:
+                return
+            message = {"type": "update", "symbol": symbol, **delta}
+        self._last[symbol] = quote
+
+        for subscriber in list(self._subscribers.get(symbol, ())):
+            subscriber.send(message)
+
+    async def _poll(self, symbol: str):
+        provider = get_provider()
+        while True:
+            try:
+                quote = await provider.quote(symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("获取 %s 实时报价失败: %s", symbol, e)
+                for subscriber in list(self._subscribers.get(symbol, ())):
+                    subscriber.send({"type": "error", "symbol": symbol, "detail": str(e)})
+            else:
+                # 轮询结果同时刷新报价缓存和最新报价，/prices 接口可以直接命中
+                quote_cache.set(symbol, quote)
+                latest_quotes.update(symbol, quote, STREAM)
+                self._broadcast(symbol, quote)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        connections = set().union(*self._subscribers.values()) if self._subscribers else set()
+        return {
+            "symbols": len(self._pollers),
+            "connections": len(connections),
+            "dropped_messages": sum(subscriber.dropped for subscriber in connections),
+        }
+
+    async def shutdown(self):
+        pollers = list(self._pollers.values())
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        self._pollers.clear()
+        self._subscribers.clear()
+        self._last.clear()
+
+
+_hub: Optional[PriceStreamHub] = None
+
+
+def get_stream_hub() -> PriceStreamHub:
+    """获取全局行情推送中心（只在事件循环中使用）"""
+    global _hub
+    if _hub is None:
+        _hub = PriceStreamHub()
+    return _hub
+
+
+async def shutdown_stream_hub():
+    global _hub
+    if _hub is not None:
+        await _hub.shutdown()
+        _hub = None
@@ -27,6 +27,9 @@ def init_db():
     db = SessionLocal()
     
     try:
+        # 旧数据库补建行情数据唯一约束
+        crud.ensure_market_data_unique_index(db)
+        
         # 检查数据库中是否已存在用户
         existing_users = db.query(models.User).count()
         if existing_users == 0:
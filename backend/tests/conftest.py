@@ -0,0 +1,97 @@
+"""
+测试环境：导入应用前把数据库和行情存储指向临时目录，关闭沙箱进程池和后台行情更新
+"""
+import os
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix="qvanish-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+os.environ["MARKET_DATA_DIR"] = os.path.join(_TEST_DIR, "market")
+os.environ["MARKET_DATA_PROVIDER"] = "synthetic"
+os.environ["SANDBOX_ENABLED"] = "false"
+os.environ["INGESTION_ENABLED"] = "false"
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, models
+from app.database import Base, SessionLocal, engine
+from app.main import app
+from app.routers.auth import get_current_active_user
+from app.services import ingestion, market_store
+from app.services.corporate_actions import corporate_actions
+
+
+@pytest.fixture
+def db():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    crud._market_data_partition_state.clear()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """每个测试使用独立的列式存储目录"""
+    store = market_store.MarketDataStore(str(tmp_path / "market"))
+    monkeypatch.setattr(market_store, "_store", store)
+    return store
+
+
+@pytest.fixture
+def client(db, store):
+    app.dependency_overrides[get_current_active_user] = lambda: models.User(id=1, username="reader", is_active=True)
+    try:
+        # 不进入上下文，不启动后台服务
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+
+def bars(start: str, end: str, close: float = 100.0) -> pd.DataFrame:
+    index = pd.bdate_range(start, end)
+    closes = np.full(len(index), close)
+    return pd.DataFrame(
+        {"Open": closes, "High": closes + 1, "Low": closes - 1, "Close": closes, "Volume": 1000.0},
+        index=index,
+    )
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """替换数据源：按请求的区间返回 responses 中的结果，记录每次请求"""
+    calls = []
+    responses = {}
+
+    def fetch(symbol, start_date, end_date):
+        calls.append((start_date.date(), end_date.date()))
+        for (start, end), response in responses.items():
+            if start <= start_date.date() <= end:
+                if isinstance(response, Exception):
+                    raise response
+                return response
+        raise ValueError(f"无法获取股票数据: {symbol}")
+
+    monkeypatch.setattr(ingestion, "fetch_market_data", fetch)
+    monkeypatch.setattr(corporate_actions, "sync", lambda db, symbol, force=False: 0)
+    return calls, responses
+
+
+def advance_clock(monkeypatch, seconds: float):
+    """让存储判断临时覆盖是否过期时看到 seconds 秒之后的时间"""
+    later = datetime.utcnow() + timedelta(seconds=seconds)
+
+    class Later(datetime):
+        @classmethod
+        def utcnow(cls):
+            return later
+
+    monkeypatch.setattr(market_store, "datetime", Later)
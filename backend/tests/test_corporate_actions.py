@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from app import crud, schemas
+from app.services.corporate_actions import SPLIT, CorporateActionBook
+
+
+def split(date: datetime, ratio: float) -> schemas.CorporateActionCreate:
+    return schemas.CorporateActionCreate(symbol="AAPL", date=date, action_type=SPLIT, value=ratio)
+
+
+def test_version_is_derived_from_persisted_events(db):
+    assert CorporateActionBook().version("AAPL") == 0
+
+    crud.save_corporate_actions(db, [split(datetime(2020, 8, 31), 4.0)])
+    first = CorporateActionBook().version("AAPL")
+    # 新进程（或重启后）对相同的事件得到相同的版本号
+    assert first != 0
+    assert CorporateActionBook().version("AAPL") == first
+
+    crud.save_corporate_actions(db, [split(datetime(2024, 6, 10), 10.0)])
+    assert CorporateActionBook().version("AAPL") not in (0, first)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+from ta.momentum import RSIIndicator
+from ta.trend import MACD, EMAIndicator
+from ta.volatility import AverageTrueRange
+
+from app.services.indicators import IndicatorCache, parse_indicator
+from app.services.providers import SyntheticProvider
+
+RECURSIVE = ["ema20", "rsi14", "macd", "atr14"]
+
+
+@pytest.fixture
+def history():
+    return SyntheticProvider()._series("AAPL", 2021).loc["2019-01-01":"2021-06-30"]
+
+
+def test_recursive_indicators_match_ta(history):
+    close = history["Close"]
+    expected = {
+        "ema20": EMAIndicator(close, 20).ema_indicator(),
+        "rsi14": RSIIndicator(close, 14).rsi(),
+        "macd": MACD(close).macd_signal(),
+        "atr14": AverageTrueRange(history["High"], history["Low"], close, 14).average_true_range(),
+    }
+    for name, series in expected.items():
+        values, _ = parse_indicator(name).compute(history)
+        column = "macd_signal" if name == "macd" else name
+        np.testing.assert_allclose(values[column], series, rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize("name", RECURSIVE + ["sma20", "bb20"])
+def test_appended_bars_extend_cached_indicator(db, store, history, name):
+    spec = parse_indicator(name)
+    cache = IndicatorCache()
+    store.write("AAPL", history.loc[:"2021-03-31"])
+    cache.get("AAPL", spec)
+
+    store.write("AAPL", history.loc["2021-04-01":])
+    updated = cache.get("AAPL", spec)
+
+    assert cache.incremental_updates == 1
+    pd.testing.assert_frame_equal(updated, IndicatorCache().get("AAPL", spec), rtol=1e-9)
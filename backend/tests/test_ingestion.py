@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from app import config
+from app.services import ingestion
+
+from .conftest import advance_clock, bars
+
+
+def day(value: str):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def test_fills_every_gap_and_marks_coverage(db, store, upstream):
+    calls, responses = upstream
+    store.add_coverage("AAPL", datetime(2024, 1, 10), datetime(2024, 1, 20))
+    responses[(day("2024-01-01"), day("2024-01-09"))] = bars("2024-01-01", "2024-01-09")
+    responses[(day("2024-01-21"), day("2024-01-31"))] = bars("2024-01-21", "2024-01-31")
+
+    written = ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 31))
+
+    assert written == len(bars("2024-01-01", "2024-01-09")) + len(bars("2024-01-21", "2024-01-31"))
+    assert len(calls) == 2
+    assert store.missing_ranges("AAPL", datetime(2024, 1, 1), datetime(2024, 1, 31)) == []
+
+    # 已覆盖的区间不再访问数据源
+    assert ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 31)) == 0
+    assert len(calls) == 2
+
+
+def test_gap_without_trading_days_is_covered(db, store, upstream):
+    calls, _ = upstream
+
+    assert ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 6), datetime(2024, 1, 7)) == 0
+    assert store.missing_ranges("AAPL", datetime(2024, 1, 6), datetime(2024, 1, 7)) == []
+
+
+def test_quarantined_dates_are_retried_after_interval(db, store, upstream, monkeypatch):
+    calls, responses = upstream
+    data = bars("2024-01-01", "2024-01-12")
+    data.loc[pd.Timestamp("2024-01-05"), "Close"] = -1.0
+    responses[(day("2024-01-01"), day("2024-01-12"))] = data
+
+    written = ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 12))
+
+    assert written == len(data) - 1
+    assert store.coverage("AAPL").missing(datetime(2024, 1, 1), datetime(2024, 1, 12)) == [
+        (day("2024-01-05"), day("2024-01-05"))
+    ]
+    stored = store.read("AAPL", datetime(2024, 1, 1), datetime(2024, 1, 12), ["close"])
+    assert pd.Timestamp("2024-01-05") not in pd.DatetimeIndex(stored["date"])
+
+    # 重试间隔内不再访问数据源
+    assert ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 12)) == 0
+    assert len(calls) == 1
+
+    # 间隔过期后只重新获取被隔离的日期
+    advance_clock(monkeypatch, config.DATA_QUALITY_RETRY_INTERVAL + 1)
+    responses.clear()
+    responses[(day("2024-01-05"), day("2024-01-05"))] = bars("2024-01-05", "2024-01-05")
+    assert ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 12)) == 1
+    assert calls[-1] == (day("2024-01-05"), day("2024-01-06"))
+    assert store.missing_ranges("AAPL", datetime(2024, 1, 1), datetime(2024, 1, 12)) == []
+
+
+def test_range_ending_today_is_fetched_once_per_ttl(db, store, upstream, monkeypatch):
+    calls, responses = upstream
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    start = today - timedelta(days=10)
+    responses[(start.date(), today.date())] = bars(start, today)
+
+    for _ in range(3):
+        ingestion.ensure_market_data(db, "AAPL", start, datetime.now())
+    assert len(calls) == 1
+    # 当天的K线只是临时覆盖
+    assert store.coverage("AAPL").missing(start, today) == [(today.date(), today.date())]
+
+    advance_clock(monkeypatch, config.INTRADAY_CACHE_TTL + 1)
+    ingestion.ensure_market_data(db, "AAPL", start, datetime.now())
+    assert calls[-1][0] == today.date()
+
+
+def test_failed_gap_does_not_abort_other_gaps(db, store, upstream):
+    calls, responses = upstream
+    store.add_coverage("AAPL", datetime(2024, 1, 10), datetime(2024, 1, 20))
+    responses[(day("2024-01-01"), day("2024-01-09"))] = ConnectionError("上游超时")
+    responses[(day("2024-01-21"), day("2024-01-31"))] = bars("2024-01-21", "2024-01-31")
+
+    with pytest.raises(ConnectionError):
+        ingestion.ensure_market_data(db, "AAPL", datetime(2024, 1, 1), datetime(2024, 1, 31))
+
+    # 成功的区间已写入并记入覆盖范围，失败的区间下次重新获取
+    stored = store.read("AAPL", datetime(2024, 1, 21), datetime(2024, 1, 31), ["close"])
+    assert len(stored["close"]) == len(bars("2024-01-21", "2024-01-31"))
+    assert store.missing_ranges("AAPL", datetime(2024, 1, 1), datetime(2024, 1, 31)) == [
+        (datetime(2024, 1, 1), datetime(2024, 1, 9))
+    ]
@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+
+from .conftest import bars
+
+
+def test_default_range_returns_304_without_fetching(client, upstream):
+    calls, responses = upstream
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    responses[((today - timedelta(days=40)).date(), today.date())] = bars(today - timedelta(days=40), today)
+
+    # 不指定 end_date，区间截止到当前时间，包含当天未收盘的K线
+    first = client.get("/api/market-data/historical", params={"symbol": "aapl"})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert len(calls) == 1
+
+    second = client.get("/api/market-data/historical", params={"symbol": "AAPL"}, headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert len(calls) == 1
@@ -0,0 +1,277 @@
+import pytest
+
+from app import crud, models, schemas
+from app.services import order_book
+from app.services.order_book import (
+    BUY, CANCELED, FILLED, LIMIT, MARKET, OPEN, PARTIALLY_FILLED, SELL, STOP, STOP_LIMIT,
+    BookOrder, InsufficientFunds, MatchingEngine, OrderBook, _Events, from_db_order,
+)
+
+_ids = iter(range(1, 1_000_000))
+
+
+def order(side, order_type=LIMIT, quantity=10.0, limit_price=None, stop_price=None, user_id=1):
+    return BookOrder(
+        id=next(_ids), user_id=user_id, portfolio_id=None, symbol="AAPL", side=side,
+        order_type=order_type, quantity=quantity, limit_price=limit_price, stop_price=stop_price,
+    )
+
+
+def submit(book, new_order):
+    events = _Events()
+    book.submit(new_order, events)
+    return events
+
+
+def on_price(book, price):
+    events = _Events()
+    book.on_price(price, events)
+    return events
+
+
+# 订单簿
+
+def test_price_time_priority_and_partial_fills():
+    book = OrderBook("AAPL")
+    first = order(SELL, limit_price=101.0, quantity=5, user_id=1)
+    second = order(SELL, limit_price=101.0, quantity=5, user_id=2)
+    better = order(SELL, limit_price=100.0, quantity=3, user_id=3)
+    for resting in (first, second, better):
+        submit(book, resting)
+
+    taker = order(BUY, limit_price=101.0, quantity=10, user_id=4)
+    events = submit(book, taker)
+
+    # 先成交更优的价格，同价位按时间先后
+    assert [(fill.order_id, fill.price, fill.quantity) for fill in events.fills if fill.side == SELL] == [
+        (better.id, 100.0, 3), (first.id, 101.0, 5), (second.id, 101.0, 2),
+    ]
+    assert taker.status == FILLED
+    assert taker.average_price == pytest.approx((3 * 100.0 + 7 * 101.0) / 10)
+    assert second.status == PARTIALLY_FILLED and second.remaining == 3
+    assert book.depth()["asks"] == [[101.0, 3, 1]]
+
+
+def test_limit_order_rests_until_price_crosses():
+    book = OrderBook("AAPL", last_price=105.0, liquidity=4)
+    bid = order(BUY, limit_price=100.0, quantity=10)
+    assert not submit(book, bid).fills
+    assert book.depth()["bids"] == [[100.0, 10, 1]]
+
+    assert not on_price(book, 100.5).fills
+    # 每次行情最多成交 liquidity 股
+    events = on_price(book, 99.0)
+    assert [(fill.price, fill.quantity) for fill in events.fills] == [(99.0, 4)]
+    assert bid.status == PARTIALLY_FILLED
+    on_price(book, 99.0)
+    on_price(book, 99.0)
+    assert bid.status == FILLED
+    assert book.depth()["bids"] == []
+
+
+def test_market_order_fills_at_last_price_or_cancels_without_one():
+    book = OrderBook("AAPL", last_price=50.0)
+    buy = order(BUY, MARKET, quantity=7)
+    events = submit(book, buy)
+    assert [(fill.price, fill.quantity) for fill in events.fills] == [(50.0, 7)]
+
+    no_price = OrderBook("MSFT")
+    sell = order(SELL, MARKET)
+    submit(no_price, sell)
+    assert sell.status == CANCELED
+
+
+def test_stop_orders_trigger_on_price():
+    book = OrderBook("AAPL", last_price=100.0)
+    stop_sell = order(SELL, STOP, quantity=5, stop_price=95.0)
+    stop_buy = order(BUY, STOP_LIMIT, quantity=5, stop_price=105.0, limit_price=106.0)
+    submit(book, stop_sell)
+    submit(book, stop_buy)
+    assert book.depth()["stops"] == 2
+
+    events = on_price(book, 94.0)
+    assert [(fill.order_id, fill.price) for fill in events.fills] == [(stop_sell.id, 94.0)]
+    assert not stop_buy.triggered
+
+    events = on_price(book, 107.0)
+    # 触发后最新价高于限价，止损限价单作为限价单挂单，触发状态需要保存
+    assert stop_buy.triggered and not events.fills
+    assert events.orders[stop_buy.id].state()["triggered"] is True
+    assert book.depth()["bids"] == [[106.0, 5, 1]]
+
+
+def test_canceled_orders_are_skipped():
+    book = OrderBook("AAPL")
+    canceled = order(SELL, limit_price=100.0, user_id=1)
+    resting = order(SELL, limit_price=100.0, user_id=2)
+    submit(book, canceled)
+    submit(book, resting)
+    canceled.canceled = True
+
+    events = submit(book, order(BUY, limit_price=100.0, quantity=10, user_id=3))
+    assert {fill.order_id for fill in events.fills if fill.side == SELL} == {resting.id}
+    assert canceled.filled == 0
+
+
+def test_self_trade_cancels_resting_order():
+    book = OrderBook("AAPL")
+    own_bid = order(BUY, limit_price=363.98, quantity=10, user_id=1)
+    other_bid = order(BUY, limit_price=360.0, quantity=10, user_id=2)
+    submit(book, own_bid)
+    submit(book, other_bid)
+    book.last_price = 358.98
+
+    stop_sell = order(SELL, STOP, quantity=10, stop_price=359.0, user_id=1)
+    events = submit(book, stop_sell)
+
+    assert own_bid.status == CANCELED and own_bid.filled == 0
+    assert own_bid.id in events.orders
+    assert [(fill.order_id, fill.price) for fill in events.fills if fill.side == BUY] == [(other_bid.id, 360.0)]
+    assert all(fill.user_id != 1 or fill.order_id == stop_sell.id for fill in events.fills)
+
+
+def test_restore_keeps_triggered_stop_limit_on_limit_side():
+    book = OrderBook("AAPL", last_price=100.0)
+    waiting = order(SELL, STOP_LIMIT, stop_price=90.0, limit_price=89.0)
+    triggered = order(SELL, STOP_LIMIT, stop_price=95.0, limit_price=94.0)
+    triggered.triggered = True
+    book.restore(waiting)
+    book.restore(triggered)
+
+    depth = book.depth()
+    assert depth["asks"] == [[94.0, 10, 1]]
+    assert depth["stops"] == 1
+
+
+# 撮合引擎与成交写入
+
+@pytest.fixture
+def portfolio(db):
+    user = models.User(username="trader", email="trader@example.com", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return crud.create_portfolio(
+        db, schemas.PortfolioCreate(name="默认投资组合", cash_balance=10000.0, total_value=10000.0), user_id=user.id
+    )
+
+
+def place(db, portfolio, side, order_type, quantity, limit_price=None, stop_price=None):
+    return crud.create_order(db, schemas.OrderCreate(
+        symbol="AAPL", side=side, order_type=order_type, quantity=quantity,
+        limit_price=limit_price, stop_price=stop_price, portfolio_id=portfolio.id,
+    ), user_id=portfolio.user_id)
+
+
+def test_engine_persists_fills_and_restores_open_orders(db, portfolio):
+    engine = MatchingEngine(liquidity=5)
+    engine.start()
+    engine.on_price("AAPL", 100.0)
+    buy = place(db, portfolio, "buy", "limit", 8, limit_price=99.0)
+    stop = place(db, portfolio, "buy", "stop_limit", 8, limit_price=106.0, stop_price=105.0)
+    engine.submit(from_db_order(buy))
+    engine.submit(from_db_order(stop))
+    # 行情在 99 以下时买单每次最多成交 5 股
+    engine.on_price("AAPL", 98.0)
+    engine.stop()
+
+    db.expire_all()
+    trades = db.query(models.Trade).filter(models.Trade.order_id == buy.id).all()
+    assert [(trade.price, trade.quantity) for trade in trades] == [(98.0, 5)]
+    assert crud.get_order(db, buy.id).status == PARTIALLY_FILLED
+    assert crud.get_portfolio(db, portfolio.id).cash_balance == pytest.approx(10000.0 - 5 * 98.0)
+    asset = crud.get_asset_by_symbol(db, portfolio_id=portfolio.id, symbol="AAPL")
+    assert asset.quantity == 5
+
+    # 重启后恢复剩余的买单和未触发的止损单
+    restarted = MatchingEngine(liquidity=5)
+    restarted.start()
+    restored = restarted.get(buy.id)
+    assert restored.remaining == 3 and restored.average_price == pytest.approx(98.0)
+    assert restarted.get(stop.id) is not None and not restarted.get(stop.id).triggered
+    restarted.on_price("AAPL", 97.0)
+    assert restarted.cancel(stop.id).status == CANCELED
+    assert restarted.cancel(buy.id) is None
+    restarted.stop()
+
+    db.expire_all()
+    assert crud.get_order(db, buy.id).status == FILLED
+    assert crud.get_order(db, stop.id).status == CANCELED
+    assert crud.get_asset_by_symbol(db, portfolio_id=portfolio.id, symbol="AAPL").quantity == 8
+
+
+def test_engine_restores_triggered_stop_limit_as_limit(db, portfolio):
+    engine = MatchingEngine()
+    engine.start()
+    engine.on_price("AAPL", 100.0)
+    stop = place(db, portfolio, "buy", "stop_limit", 4, limit_price=101.0, stop_price=102.0)
+    engine.submit(from_db_order(stop))
+    # 触发后最新价高于限价，不成交
+    engine.on_price("AAPL", 103.0)
+    engine.stop()
+
+    db.expire_all()
+    assert crud.get_order(db, stop.id).triggered is True
+    assert crud.get_order(db, stop.id).status == OPEN
+
+    restarted = MatchingEngine()
+    restarted.start()
+    assert restarted.depth("AAPL")["bids"] == [[101.0, 4, 1]]
+    restarted.stop()
+
+
+def test_engine_reserves_funds_and_never_writes_unfunded_fills(db, portfolio, monkeypatch):
+    # 不使用其他测试留下的最新报价
+    monkeypatch.setattr(order_book.latest_quotes, "get", lambda symbol, max_age=None: None)
+    engine = MatchingEngine()
+    engine.start()
+
+    # 没有持仓的卖单、超出现金的限价买单直接拒绝
+    with pytest.raises(InsufficientFunds):
+        engine.submit(from_db_order(place(db, portfolio, "sell", "limit", 1, limit_price=250.0)))
+    with pytest.raises(InsufficientFunds):
+        engine.submit(from_db_order(place(db, portfolio, "buy", "limit", 60, limit_price=190.0)))
+
+    # 挂单冻结 40 x 190 的现金，剩余现金不够市价买入 20 股，市价单撤销
+    resting = engine.submit(from_db_order(place(db, portfolio, "buy", "limit", 40, limit_price=190.0)))
+    engine.on_price("AAPL", 200.0)
+    market = engine.submit(from_db_order(place(db, portfolio, "buy", "market", 20)))
+    assert market.status == CANCELED and market.filled == 0
+
+    # 撤单后解冻，市价单可以成交
+    engine.cancel(resting.id)
+    market = engine.submit(from_db_order(place(db, portfolio, "buy", "market", 20)))
+    assert market.status == FILLED
+    engine.stop()
+
+    db.expire_all()
+    trades = db.query(models.Trade).all()
+    assert [(trade.order_id, trade.quantity) for trade in trades] == [(market.id, 20)]
+    assert crud.get_portfolio(db, portfolio.id).cash_balance == pytest.approx(10000.0 - 20 * 200.0)
+    assert crud.get_asset_by_symbol(db, portfolio_id=portfolio.id, symbol="AAPL").quantity == 20
+
+
+def test_fill_writer_retries_failed_batch(db, portfolio, monkeypatch):
+    record = crud.record_order_fills
+    calls = []
+
+    def flaky(session, fills, states):
+        calls.append(len(fills))
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        record(session, fills, states)
+
+    monkeypatch.setattr(order_book.crud, "record_order_fills", flaky)
+    monkeypatch.setattr(order_book, "backoff_delay", lambda attempt: 0)
+    engine = MatchingEngine()
+    engine.start()
+    buy = place(db, portfolio, "buy", "limit", 5, limit_price=99.0)
+    engine.submit(from_db_order(buy))
+    engine.on_price("AAPL", 98.0)
+    engine.stop()
+
+    # 第一次写入失败后重试同一批，成交没有丢失
+    assert calls == [1, 1]
+    assert engine.stats()["write_failures"] == 1
+    db.expire_all()
+    assert crud.get_order(db, buy.id).status == FILLED
+    assert crud.get_portfolio(db, portfolio.id).cash_balance == pytest.approx(10000.0 - 5 * 98.0)
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from app import crud, models
+from app.services.partitions import archive_legacy_market_data
+
+
+def legacy_row(symbol: str, date: datetime, close: float) -> dict:
+    return {"symbol": symbol, "date": date, "open": close, "high": close, "low": close, "close": close, "volume": 100.0}
+
+
+def test_legacy_rows_of_archived_years_are_written_to_store(db, store):
+    crud.ensure_market_data_partition(db, 2020)
+    crud.archive_market_data_partition(db, 2020, 0)
+    db.execute(models.MarketData.__table__.insert(), [
+        legacy_row("AAPL", datetime(2020, 3, 2), 70.0),
+        legacy_row("AAPL", datetime(2024, 3, 1), 180.0),
+    ])
+    db.commit()
+
+    crud.migrate_legacy_market_data(db)
+    # 已归档年份的数据在补写到列式存储之前不能删除
+    assert len(crud.get_legacy_market_data_rows(db, 2020, "AAPL")) == 1
+    assert len(crud.get_market_data_partition_rows(db, 2024, "AAPL")) == 1
+
+    assert archive_legacy_market_data(db) == 1
+    stored = store.read("AAPL", datetime(2020, 1, 1), datetime(2020, 12, 31))
+    assert stored["close"].tolist() == [70.0]
+    assert db.query(models.MarketData).count() == 0
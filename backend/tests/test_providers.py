@@ -0,0 +1,11 @@
+import pandas as pd
+
+from app.services.providers import SyntheticProvider
+
+
+def test_synthetic_history_does_not_depend_on_end_year():
+    provider = SyntheticProvider()
+    short = provider._series("AAPL", 2010)
+    long = provider._series("AAPL", 2030)
+
+    pd.testing.assert_frame_equal(short, long.loc[short.index])
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.backtest_engine import simple_backtest_engine
+from app.services.sandbox import SandboxPool
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = SandboxPool(size=1)
+    yield pool
+    pool.shutdown()
+
+
+def run(pool, code):
+    index = pd.date_range("2024-01-01", periods=30)
+    closes = np.linspace(10, 20, 30)
+    frame = pd.DataFrame(
+        {"Open": closes, "High": closes + 1, "Low": closes - 1, "Close": closes, "Volume": 1000.0}, index=index
+    )
+    return pool.run(
+        simple_backtest_engine, market_data={"AAPL": frame}, strategy_code=code, parameters={},
+        initial_capital=1000.0, start_date=datetime(2024, 1, 1), end_date=datetime(2024, 2, 1),
+    )
+
+
+@pytest.mark.parametrize("code", [
+    "summary = market_data['AAPL'].describe()",
+    "print(market_data['AAPL'])\ntext = str(AAPL_data)",
+    "ema = market_data['AAPL']['Close'].ewm(span=5).mean()",
+    "level = market_data['AAPL']['Close'].quantile(0.9)",
+    "from ta.trend import SMAIndicator\nsma = SMAIndicator(market_data['AAPL']['Close'], 5).sma_indicator()",
+])
+def test_ordinary_strategy_code_runs(pool, code):
+    result = run(pool, code + "\nif AAPL_price < 12: buy('AAPL', 1, AAPL_price)")
+    assert result.get("error") is None
+    assert len(result["trades"]) > 0
+
+
+@pytest.mark.parametrize("code", [
+    "import pandas\npandas.io.common.os.getcwd()",
+    "().__class__.__base__.__subclasses__()",
+    "getattr(1, 'real')",
+    "import statistics\nstatistics.sys.modules",
+    "open('/etc/passwd')",
+    "market_data['AAPL'].to_csv('/tmp/out.csv')",
+    "import os",
+])
+def test_escapes_are_rejected(pool, code):
+    assert run(pool, code).get("error")
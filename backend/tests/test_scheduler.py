@@ -0,0 +1,29 @@
+from datetime import datetime
+
+from app import crud, models
+from app.services import scheduler
+from app.services.scheduler import EOD, IngestionJob, IngestionScheduler
+
+
+def test_retry_after_database_error_uses_a_clean_session(db, store, monkeypatch):
+    crud.add_tracked_symbols(db, ["AAPL"])
+    attempts = []
+
+    def ensure(session, symbol, start_date, end_date):
+        attempts.append(symbol)
+        if len(attempts) == 1:
+            # 违反唯一约束，会话需要回滚后才能继续使用
+            for _ in range(2):
+                session.add(models.CorporateAction(symbol=symbol, date=datetime(2020, 1, 1), action_type="split", value=2.0))
+            session.flush()
+        return session.query(models.CorporateAction).count()
+
+    monkeypatch.setattr(scheduler, "ensure_market_data", ensure)
+    ingestion = IngestionScheduler(workers=0)
+    monkeypatch.setattr(ingestion, "_sleep", lambda delay: None)
+
+    ingestion._execute(IngestionJob(symbol="AAPL", kind=EOD, enqueued_at=0.0))
+
+    assert len(attempts) == 2
+    assert ingestion.retries == 1
+    assert ingestion.completed == 1 and ingestion.failed == 0
@@ -0,0 +1,28 @@
+from app import config
+from app.routers import market_data
+from app.services.security_master import SecurityMaster
+
+
+def test_info_refreshes_inline_when_scheduler_is_not_running(client, monkeypatch):
+    master = SecurityMaster()
+    monkeypatch.setattr(market_data, "security_master", master)
+
+    # 测试中不启动后台调度器，请求中直接刷新一次，之后从缓存读取
+    response = client.get("/api/market-data/info/msft")
+    assert response.status_code == 200
+    assert response.json()["name"] == "MSFT Synthetic Corp"
+    assert master.get("MSFT") is not None
+    assert master.take_missing() == []
+
+
+def test_missing_symbols_are_validated_and_capped(db, monkeypatch):
+    monkeypatch.setattr(config, "SECURITY_MISSING_MAX", 3)
+    master = SecurityMaster()
+
+    for symbol in ["not a symbol", "<script>", "A" * 20]:
+        assert master.get(symbol) is None
+    assert master.take_missing() == []
+
+    for symbol in ["AAA", "BBB", "CCC", "DDD"]:
+        master.get(symbol)
+    assert master.take_missing() == ["AAA", "BBB", "CCC"]
@@ -0,0 +1,17 @@
+from app import models
+from app.routers import streaming
+
+
+def test_subscribe_accepts_symbol_string_and_rejects_other_values(client, monkeypatch):
+    user = models.User(id=1, username="reader", is_active=True)
+    monkeypatch.setattr(streaming, "get_user_from_token", lambda token: user)
+
+    with client.websocket_connect("/ws/market-data?token=t") as websocket:
+        websocket.send_json({"action": "subscribe", "symbols": "aapl"})
+        message = websocket.receive_json()
+        while message["type"] != "subscribed":
+            message = websocket.receive_json()
+        assert message["symbols"] == ["AAPL"]
+
+        websocket.send_json({"action": "subscribe", "symbols": {"AAPL": 1}})
+        assert websocket.receive_json()["type"] == "error"